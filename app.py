@@ -4,7 +4,7 @@ from flask_login import LoginManager
 from config import Config
 import os
 
-from extensions import db, login_manager, csrf, limiter
+from extensions import db, login_manager, csrf, limiter, cache, storage
 from utils.logging_config import setup_logging
 from utils.error_handlers import register_error_handlers, setup_error_middleware
 
@@ -19,11 +19,49 @@ def create_app():
     login_manager.init_app(app)
     csrf.init_app(app)
     limiter.init_app(app)
+    cache.init_app(app)
+    storage.init_app(app)
     login_manager.login_view = 'auth.login'
     
     # Register error handlers
     register_error_handlers(app)
     setup_error_middleware(app)
+
+    # Mantenimiento incremental de rollups de reportes
+    from services import rollup_service
+    rollup_service.init_app(app)
+
+    # Jerarquía de supervisión (tabla de clausura)
+    from services import hierarchy_service
+    hierarchy_service.init_app(app)
+
+    # Invalidación de datos de referencia en caché
+    from services import reference_data
+    reference_data.init_app(app)
+
+    # Versiones de tablas para ETags de la API
+    from services import http_cache
+    http_cache.init_app(app)
+
+    # Invalidación del usuario de sesión en caché
+    from services import user_session
+    user_session.init_app(app)
+
+    # Índice de búsqueda de texto completo
+    from services import search_index
+    search_index.init_app(app)
+
+    # Limpieza de recibos escritos por transacciones revertidas
+    from services import receipt_store
+    receipt_store.init_app(app)
+
+    # Alcance de visibilidad por rol (caché por request)
+    from services import visibility
+    visibility.init_app(app)
+
+    # Comandos CLI
+    from cli import register_commands
+    register_commands(app)
     
     # Create necessary directories
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -36,6 +74,7 @@ def create_app():
     from routes.approvals import approvals_bp
     from routes.reports import reports_bp
     from routes.api import api_bp
+    from routes.receipts import receipts_bp
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(expenses_bp)
@@ -44,6 +83,7 @@ def create_app():
     app.register_blueprint(approvals_bp)
     app.register_blueprint(reports_bp)
     app.register_blueprint(api_bp)
+    app.register_blueprint(receipts_bp)
     
     @app.route('/')
     def index():
@@ -0,0 +1,91 @@
+"""
+Micro-benchmark del extractor de campos de boletas
+
+Compara los extractores individuales de ocr_service (extract_amounts,
+extract_date, extract_rut, extract_keywords) contra extract_fields sobre el
+corpus de regresión de tests/fixtures, y verifica que los resultados sean
+idénticos.
+
+Uso:
+    python benchmarks/bench_receipt_extractor.py [--repeat N]
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from services import receipt_extractor  # noqa: E402
+from services.ocr_service import extract_amounts, extract_date, extract_rut, extract_keywords  # noqa: E402
+from services.receipt_extractor import DEFAULT_CATEGORY_KEYWORDS, KeywordMatcher, extract_fields  # noqa: E402
+
+
+CORPUS_PATH = os.path.join(ROOT, 'tests', 'fixtures', 'ocr_texts.json')
+
+
+def legacy(text):
+    return {
+        'amounts': extract_amounts(text),
+        'date': extract_date(text),
+        'ruts': extract_rut(text),
+        'categories': extract_keywords(text),
+    }
+
+
+def cold(text):
+    """extract_fields sin resultados memorizados de ejecuciones anteriores"""
+    receipt_extractor._token_cache.clear()
+    return extract_fields(text)
+
+
+def per_text(fn, texts, repeat):
+    best = min(timeit.repeat(lambda: [fn(t) for t in texts], number=repeat, repeat=5))
+    return best / repeat / len(texts) * 1e6
+
+
+def naive_keywords(category_keywords):
+    def match(text):
+        text_lower = text.lower()
+        return [c for c, words in category_keywords.items() if any(w in text_lower for w in words)]
+    return match
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    with open(CORPUS_PATH) as f:
+        texts = json.load(f)
+
+    mismatches = [t for t in texts if extract_fields(t) != legacy(t)]
+    print(f'Corpus: {len(texts)} textos, diferencias con los extractores actuales: {len(mismatches)}')
+
+    print(f'\n{"Extractor":<36}{"µs/texto":>10}')
+    baseline = per_text(legacy, texts, args.repeat)
+    print(f'{"extractores individuales":<36}{baseline:>10.2f}')
+    for label, fn in (('extract_fields (sin caché de tokens)', cold),
+                      ('extract_fields', extract_fields)):
+        elapsed = per_text(fn, texts, args.repeat)
+        print(f'{label:<36}{elapsed:>10.2f}  ({baseline / elapsed:.1f}x)')
+
+    # Búsqueda de palabras clave al crecer el catálogo de categorías
+    print(f'\n{"Palabras clave":<16}{"substring µs":>14}{"autómata µs":>14}')
+    for extra in (0, 100, 500):
+        category_keywords = dict(DEFAULT_CATEGORY_KEYWORDS)
+        for i in range(extra):
+            category_keywords.setdefault(f'Categoria {i % 50}', []).append(f'palabra{i}x')
+        matcher = KeywordMatcher(category_keywords)
+        total = sum(len(words) for words in category_keywords.values())
+        naive = per_text(naive_keywords(category_keywords), texts, args.repeat)
+        automaton = per_text(lambda t: matcher.match(t.lower()), texts, args.repeat)
+        print(f'{total:<16}{naive:>14.2f}{automaton:>14.2f}')
+
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""
+Benchmark de la búsqueda de texto completo de gastos
+
+Genera una base SQLite temporal con N gastos sintéticos (motivo, cliente y
+texto OCR), construye el índice con search_index.rebuild() y mide la primera
+página de resultados (20) para varias búsquedas, con alcance de admin y de
+usuario, comparada con un LIKE sobre el motivo.
+
+Uso:
+    python benchmarks/bench_search.py [--count N] [--repeat N]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORDS = ('taxi aeropuerto almuerzo hotel peaje estacionamiento combustible reunión cliente '
+         'pasajes bus tren cena desayuno materiales oficina impresión courier capacitación').split()
+QUERIES = ('taxi', 'hotel concepción', 'peaje autopista', 'restaurante', '96.555.444-3', 'zzz')
+
+
+def populate(db, count, users, clients):
+    from sqlalchemy import insert
+    from models.expense import Expense
+
+    rng = random.Random(42)
+    batch = []
+    for i in range(count):
+        reason = ' '.join(rng.sample(WORDS, 3))
+        raw_text = f'BOLETA ELECTRONICA {rng.choice(WORDS).upper()} TOTAL {rng.randint(1000, 90000)}'
+        batch.append({
+            'user_id': rng.choice(users), 'client_id': rng.choice(clients), 'amount': rng.randint(1000, 90000),
+            'category': 'Transporte', 'reason': reason, 'receipt_image': 'r.jpg', 'status': 'pending',
+            'expense_date': date(2024, rng.randint(1, 12), rng.randint(1, 28)),
+            'ocr_data': {'success': True, 'raw_text': raw_text},
+        })
+        if len(batch) == 10000:
+            db.session.execute(insert(Expense), batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(Expense), batch)
+    db.session.commit()
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), max(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(folder, "bench.db")}'
+
+    from app import create_app
+    from extensions import db
+    from models.company import Company
+    from models.expense import Expense
+    from models.user import User
+    from services import search_index, visibility
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        users = [User(email=f'u{i}@bench.cl', first_name='U', last_name=str(i), role='user') for i in range(50)]
+        admin = User(email='admin@bench.cl', first_name='A', last_name='B', role='admin')
+        clients = [Company(rut=f'96.555.{i:03d}-3', name=f'Cliente {i}', status='active') for i in range(200)]
+        db.session.add_all(users + [admin] + clients)
+        db.session.commit()
+
+        started = time.perf_counter()
+        populate(db, args.count, [u.id for u in users], [c.id for c in clients])
+        print(f'{args.count} gastos insertados en {time.perf_counter() - started:.1f}s')
+
+        started = time.perf_counter()
+        search_index.rebuild()
+        print(f'Índice construido en {time.perf_counter() - started:.1f}s\n')
+
+        print(f'{"búsqueda":<22}{"alcance":<10}{"FTS p50/máx (ms)":>20}{"LIKE p50/máx (ms)":>20}')
+        for q in QUERIES:
+            words = search_index.terms(q)
+            for label, user in (('admin', admin), ('usuario', users[0])):
+                scoped = visibility.for_user(user).expenses(include_self=True)
+                fts = timed(lambda: search_index.search(scoped, words), args.repeat)
+                like = scoped
+                for word in words:
+                    like = like.filter(Expense.reason.ilike(f'%{word}%'))
+                baseline = timed(lambda: like.order_by(Expense.id.desc()).limit(20).all(), args.repeat)
+                print(f'{q:<22}{label:<10}{fts[0]:>11.2f}/{fts[1]:<8.2f}{baseline[0]:>11.2f}/{baseline[1]:<8.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Comandos de línea de comandos (Flask CLI)
+
+Uso: flask --app app:create_app <grupo> <comando>
+"""
+import time
+import click
+from flask.cli import AppGroup
+
+
+rollup_cli = AppGroup('rollup', help='Mantenimiento de rollups mensuales de gastos')
+
+
+@rollup_cli.command('rebuild')
+def rollup_rebuild():
+    """Reconstruye la tabla de rollups desde los gastos existentes"""
+    from services.rollup_service import rebuild_rollups
+
+    started = time.perf_counter()
+    buckets = rebuild_rollups()
+    click.echo(f'Rollup reconstruido: {buckets} bucket(s) en {time.perf_counter() - started:.2f}s')
+
+
+hierarchy_cli = AppGroup('hierarchy', help='Jerarquía de supervisión de usuarios')
+
+
+@hierarchy_cli.command('rebuild')
+def hierarchy_rebuild():
+    """Reconstruye la tabla de clausura desde users.supervisor_id"""
+    from services.hierarchy_service import rebuild_hierarchy
+
+    started = time.perf_counter()
+    rows = rebuild_hierarchy()
+    click.echo(f'Jerarquía reconstruida: {rows} fila(s) en {time.perf_counter() - started:.2f}s')
+
+
+ocr_cli = AppGroup('ocr', help='Procesamiento OCR de recibos')
+
+
+@ocr_cli.command('worker')
+@click.option('--processes', type=int, default=None, help='Procesos del pool (default: OCR_WORKER_PROCESSES)')
+@click.option('--once', is_flag=True, help='Procesar la cola pendiente y terminar')
+def ocr_worker(processes, once):
+    """Procesa la cola de trabajos OCR"""
+    from services.ocr_queue import run_worker
+
+    total = run_worker(processes=processes, once=once, log=click.echo)
+    click.echo(f'Worker OCR finalizado: {total} trabajo(s) procesados')
+
+
+@ocr_cli.command('backfill')
+@click.option('--processes', type=int, default=None, help='Procesos del pool (default: OCR_WORKER_PROCESSES)')
+@click.option('--batch-size', type=int, default=200, show_default=True, help='Gastos por commit')
+@click.option('--start-after', type=int, default=None, help='Continuar desde este id de gasto')
+@click.option('--checkpoint', type=click.Path(dir_okay=False), default=None,
+              help='Archivo con el último id confirmado (se lee al iniciar y se actualiza por lote)')
+@click.option('--limit', type=int, default=None, help='Máximo de gastos a procesar')
+@click.option('--retry-failed', is_flag=True, help='Reintentar también los resultados fallidos de la versión actual')
+def ocr_backfill(processes, batch_size, start_after, checkpoint, limit, retry_failed):
+    """Procesa recibos sin OCR o con una versión anterior del extractor"""
+    from services.ocr_backfill import run_backfill
+
+    stats = run_backfill(
+        processes=processes, batch_size=batch_size, start_after=start_after,
+        checkpoint=checkpoint, limit=limit, retry_failed=retry_failed, log=click.echo
+    )
+    click.echo(f'Backfill finalizado: {stats["processed"]} gasto(s), {stats["failed"]} fallido(s), '
+               f'{stats["cached"]} desde caché, último id {stats["last_id"]}')
+
+
+receipts_cli = AppGroup('receipts', help='Almacenamiento de recibos')
+
+
+@receipts_cli.command('relayout')
+@click.option('--batch-size', type=int, default=200, show_default=True, help='Recibos por commit')
+@click.option('--dry-run', is_flag=True, help='Solo informar cuántos recibos falta migrar')
+def receipts_relayout(batch_size, dry_run):
+    """Mueve los recibos al layout ab/cd/<sha256>.<ext>"""
+    from services.receipt_relayout import pending_counts, run_relayout
+
+    if dry_run:
+        blobs, legacy = pending_counts()
+        click.echo(f'{blobs} recibo(s) por mover y {legacy} gasto(s) con recibo sin hash')
+        return
+
+    started = time.perf_counter()
+    stats = run_relayout(batch_size=batch_size, log=click.echo)
+    click.echo(f'Relayout finalizado en {time.perf_counter() - started:.2f}s: {stats["moved"]} movido(s), '
+               f'{stats["hashed"]} registrado(s) por contenido, {stats["deduplicated"]} duplicado(s) '
+               f'eliminado(s), {stats["missing"]} faltante(s)')
+
+
+search_cli = AppGroup('search', help='Índice de búsqueda de gastos')
+
+
+@search_cli.command('rebuild')
+def search_rebuild():
+    """Reconstruye el índice de texto completo desde los gastos existentes"""
+    from services.search_index import rebuild
+
+    started = time.perf_counter()
+    count = rebuild()
+    click.echo(f'Índice de búsqueda reconstruido: {count} gasto(s) en {time.perf_counter() - started:.2f}s')
+
+
+def register_commands(app):
+    """Registrar grupos de comandos en la aplicación"""
+    app.cli.add_command(rollup_cli)
+    app.cli.add_command(hierarchy_cli)
+    app.cli.add_command(ocr_cli)
+    app.cli.add_command(receipts_cli)
+    app.cli.add_command(search_cli)
@@ -13,6 +13,18 @@ class Config:
     UPLOAD_FOLDER = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'static/uploads')
     MAX_CONTENT_LENGTH = 10 * 1024 * 1024  # 10MB max
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+    RECEIPT_CACHE_MAX_AGE = 30 * 24 * 3600  # Recibos servidos (nombrados por contenido)
+    # Con un servidor frontal que soporte X-Sendfile, el archivo lo envía él
+    USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE', 'false').lower() in ['true', 'on', '1']
+
+    # Almacenamiento de recibos (por defecto disco local en UPLOAD_FOLDER; con
+    # STORAGE_BACKEND='utils.storage.S3Storage' se comparten entre nodos)
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND') or 'utils.storage.LocalStorage'
+    STORAGE_OPTIONS = {
+        'bucket': os.environ['STORAGE_BUCKET'],
+        'prefix': os.environ.get('STORAGE_PREFIX', ''),
+        'endpoint_url': os.environ.get('STORAGE_ENDPOINT_URL'),
+    } if os.environ.get('STORAGE_BUCKET') else {}
     
     # Session
     PERMANENT_SESSION_LIFETIME = timedelta(hours=24)
@@ -28,4 +40,33 @@ class Config:
     EXPENSES_PER_PAGE = 20
     DEFAULT_CURRENCY = 'CLP'
     REQUIRE_GEOLOCATION = True
+    APPROVAL_BATCH_MAX = 500  # Gastos por solicitud de aprobación masiva
+    BULK_IMPORT_MAX_ROWS = 5000  # Gastos por solicitud de carga masiva
+    BULK_IMPORT_CHUNK_SIZE = 500  # Filas por INSERT (executemany)
+    IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
     AUTO_APPROVE_LIMIT = 50000  # Monto en CLP para aprobación automática
+
+    # Caché (por defecto en memoria del proceso; CACHE_BACKEND acepta una ruta
+    # de importación, p. ej. 'utils.cache.RedisCache' con CACHE_OPTIONS={'url': ...})
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND') or 'utils.cache.SimpleCache'
+    CACHE_OPTIONS = {'url': os.environ['CACHE_REDIS_URL']} if os.environ.get('CACHE_REDIS_URL') else {}
+    CACHE_DEFAULT_TTL = 300
+    REFERENCE_DATA_TTL = 300  # Clientes, categorías y áreas activas
+    USER_SESSION_TTL = 60  # Usuario autenticado (rol, área, supervisor)
+    BUDGET_WARNING_THRESHOLD = 80  # % del presupuesto mensual comprometido
+    CHART_CACHE_TTL = 600  # Series del dashboard (además se invalidan por versión)
+
+    # OCR en segundo plano
+    OCR_WORKER_PROCESSES = int(os.environ.get('OCR_WORKER_PROCESSES') or 2)
+    OCR_POLL_INTERVAL = 2  # Segundos de espera con la cola vacía
+    OCR_MAX_ATTEMPTS = 3
+    OCR_JOB_TIMEOUT = 300  # Segundos antes de reencolar un trabajo abandonado
+
+    # Preprocesamiento de imágenes antes de Tesseract
+    # (ver services/image_preprocessing.py para las opciones disponibles)
+    OCR_PREPROCESSING = {
+        'enabled': os.environ.get('OCR_PREPROCESSING', 'true').lower() in ['true', 'on', '1'],
+        'target_dpi': 300,
+        'binarize': True,
+        'crop': True,
+    }
@@ -3,6 +3,8 @@ from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from utils.cache import Cache
+from utils.storage import Storage
 
 db = SQLAlchemy()
 login_manager = LoginManager()
@@ -11,3 +13,5 @@ limiter = Limiter(
     key_func=get_remote_address,
     default_limits=["200 per day", "50 per hour"]
 )
+cache = Cache()
+storage = Storage()
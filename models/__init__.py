@@ -1,4 +1,9 @@
-from .user import User
+from .user import User, UserHierarchy
 from .expense import Expense
 from .approval import Approval
 from .company import Company, Area, ExpenseCategory
+from .report import ExpenseMonthlyRollup, AreaMonthlySpend
+from .job import OCRJob
+from .receipt import ReceiptBlob
+from .idempotency import IdempotencyKey
+from .table_version import TableVersion
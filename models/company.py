@@ -49,6 +49,7 @@ class ExpenseCategory(db.Model):
     requires_client = db.Column(db.Boolean, default=False)
     max_amount = db.Column(db.Numeric(10, 2))
     is_active = db.Column(db.Boolean, default=True)
+    keywords = db.Column(db.Text)  # Palabras clave para sugerir la categoría por OCR, separadas por coma
     
     # Índices para rendimiento
     __table_args__ = (
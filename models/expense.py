@@ -19,6 +19,7 @@ class Expense(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     ocr_data = db.Column(db.JSON)
+    receipt_sha256 = db.Column(db.String(64))  # Hash del recibo (detección de duplicados)
 
     approvals = db.relationship('Approval', backref='expense', lazy='dynamic')
     
@@ -28,6 +29,8 @@ class Expense(db.Model):
         db.Index('idx_expense_client_id', 'client_id'),
         db.Index('idx_expense_status', 'status'),
         db.Index('idx_expense_created_at', 'created_at'),
+        db.Index('idx_expense_created_id', 'created_at', 'id'),  # Paginación por cursor
         db.Index('idx_expense_date', 'expense_date'),
         db.Index('idx_expense_user_status', 'user_id', 'status'),
+        db.Index('idx_expense_receipt_sha256', 'receipt_sha256'),
     )
@@ -0,0 +1,25 @@
+from extensions import db
+from datetime import datetime
+
+class IdempotencyKey(db.Model):
+    """
+    Respuesta guardada de una solicitud con encabezado Idempotency-Key.
+    Un reintento con la misma clave (y el mismo cuerpo) recibe la respuesta
+    original en lugar de volver a ejecutar la operación.
+    """
+    __tablename__ = 'idempotency_keys'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    endpoint = db.Column(db.String(100), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False)  # SHA-256 del cuerpo
+    status_code = db.Column(db.Integer, nullable=False)
+    response = db.Column(db.JSON)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Índices para rendimiento
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'key', name='uq_idempotency_user_key'),
+        db.Index('idx_idempotency_created_at', 'created_at'),
+    )
@@ -0,0 +1,38 @@
+from extensions import db
+from datetime import datetime
+
+class OCRJob(db.Model):
+    """Cola de trabajos OCR procesados en segundo plano (ver services.ocr_queue)"""
+    __tablename__ = 'ocr_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    expense_id = db.Column(db.Integer, db.ForeignKey('expenses.id'), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    worker = db.Column(db.String(64))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    expense = db.relationship('Expense', backref=db.backref(
+        'ocr_jobs', lazy='dynamic', cascade='all, delete-orphan'
+    ))
+
+    # Índices para rendimiento
+    __table_args__ = (
+        db.Index('idx_ocr_job_status', 'status', 'id'),
+        db.Index('idx_ocr_job_expense_id', 'expense_id'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'expense_id': self.expense_id,
+            'status': self.status,
+            'attempts': self.attempts,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
@@ -0,0 +1,22 @@
+from extensions import db
+from datetime import datetime
+
+class ReceiptBlob(db.Model):
+    """
+    Índice de recibos almacenados por contenido (hash SHA-256 → archivo).
+    Permite reutilizar archivos idénticos y el resultado OCR ya calculado.
+    """
+    __tablename__ = 'receipt_blobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False)
+    stored_path = db.Column(db.String(255), nullable=False)
+    size = db.Column(db.Integer)
+    ocr_result = db.Column(db.JSON)
+    variants = db.Column(db.JSON)  # {'thumb'|'preview'|'full': archivo} (services.receipt_images)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Índices para rendimiento
+    __table_args__ = (
+        db.Index('idx_receipt_blob_sha256', 'sha256'),
+    )
@@ -0,0 +1,61 @@
+from extensions import db
+from datetime import datetime
+
+class ExpenseMonthlyRollup(db.Model):
+    """
+    Totales pre-agregados de gastos por (usuario, área, cliente, categoría,
+    estado, año, mes). Se mantiene incrementalmente desde services.rollup_service.
+    """
+    __tablename__ = 'expense_monthly_rollups'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    area_id = db.Column(db.Integer, db.ForeignKey('areas.id'))
+    client_id = db.Column(db.Integer, db.ForeignKey('clients.id'))
+    category = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)
+    expense_count = db.Column(db.Integer, nullable=False, default=0)
+    total_amount = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    min_amount = db.Column(db.Numeric(10, 2))
+    max_amount = db.Column(db.Numeric(10, 2))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Índices para rendimiento. area_id y client_id admiten NULL y dos NULL
+    # nunca son iguales en un índice único: se indexa coalesce(..., 0)
+    __table_args__ = (
+        db.Index('uq_rollup_bucket', 'user_id', db.func.coalesce(area_id, db.literal_column('0')),
+                 db.func.coalesce(client_id, db.literal_column('0')), 'category', 'status', 'year', 'month',
+                 unique=True),
+        db.Index('idx_rollup_period', 'year', 'month'),
+        db.Index('idx_rollup_user_period', 'user_id', 'year', 'month'),
+        db.Index('idx_rollup_area_period', 'area_id', 'year', 'month'),
+    )
+
+
+class AreaMonthlySpend(db.Model):
+    """
+    Gasto por (área, año, mes) para el control de presupuesto. Se mantiene
+    junto con el rollup (services.budget_service) en cada cambio de monto o
+    estado de un gasto. Aprobados incluye los reembolsados.
+    """
+    __tablename__ = 'area_monthly_spend'
+
+    id = db.Column(db.Integer, primary_key=True)
+    area_id = db.Column(db.Integer, db.ForeignKey('areas.id'), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)
+    expense_count = db.Column(db.Integer, nullable=False, default=0)
+    total_amount = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    pending_count = db.Column(db.Integer, nullable=False, default=0)
+    pending_amount = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    approved_count = db.Column(db.Integer, nullable=False, default=0)
+    approved_amount = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Índices para rendimiento
+    __table_args__ = (
+        db.UniqueConstraint('area_id', 'year', 'month', name='uq_area_spend_period'),
+        db.Index('idx_area_spend_period', 'year', 'month'),
+    )
@@ -0,0 +1,14 @@
+from extensions import db
+from datetime import datetime
+
+class TableVersion(db.Model):
+    """
+    Contador de cambios por tabla. Se incrementa en la misma transacción que
+    modifica la tabla (services.http_cache) y sirve para generar ETags de
+    listados sin recorrer sus filas.
+    """
+    __tablename__ = 'table_versions'
+
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
@@ -41,3 +41,21 @@ class User(UserMixin, db.Model):
         db.Index('idx_user_supervisor_id', 'supervisor_id'),
         db.Index('idx_user_is_active', 'is_active'),
     )
+
+
+class UserHierarchy(db.Model):
+    """
+    Tabla de clausura de la jerarquía de supervisión: una fila por cada par
+    (ancestro, descendiente) con la distancia entre ambos, incluida la fila
+    del propio usuario con depth=0. Se mantiene desde services.hierarchy_service.
+    """
+    __tablename__ = 'user_hierarchy'
+
+    ancestor_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    descendant_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    depth = db.Column(db.Integer, nullable=False)
+
+    # Índices para rendimiento
+    __table_args__ = (
+        db.Index('idx_hierarchy_descendant', 'descendant_id', 'depth'),
+    )
@@ -3,6 +3,7 @@ from flask_login import login_required, current_user
 from extensions import db
 from models.user import User
 from models.company import Area, Company
+from services.reference_data import active_areas
 from werkzeug.security import generate_password_hash
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
@@ -27,7 +28,7 @@ def users_list():
 
 @admin_bp.route('/users/new', methods=['GET', 'POST'])
 def users_new():
-    areas = Area.query.filter_by(is_active=True).all()
+    areas = active_areas()
     if request.method == 'POST':
         email = request.form.get('email')
         first_name = request.form.get('first_name')
@@ -51,7 +52,7 @@ def users_new():
 @admin_bp.route('/users/<int:id>/edit', methods=['GET', 'POST'])
 def users_edit(id):
     user = User.query.get_or_404(id)
-    areas = Area.query.filter_by(is_active=True).all()
+    areas = active_areas()
     
     if request.method == 'POST':
         user.email = request.form.get('email')
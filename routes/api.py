@@ -1,14 +1,29 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, abort
 from flask_login import login_required, current_user
 from functools import wraps
-from extensions import db, limiter
+from extensions import db, limiter, cache
 from models.expense import Expense
 from models.user import User
 from models.approval import Approval
-from models.company import Company, Area, ExpenseCategory
+from services import visibility
+from services.report_service import expense_summary
+from services.approval_service import review_batch
+from services.budget_service import budget_status
+from services import idempotency
+from services import http_cache
+from services import search_index
+from services.expense_export import EXPORT_FORMATS, export_response
+from services.expense_import import ExpenseImporter, iter_items
+from services.ocr_queue import latest_ocr_job
+from services.reference_data import active_clients, active_categories
+from services.serializers import expense_serializer, user_serializer, parse_list
+from utils.pagination import keyset_paginate, cursor_requested, count_requested
+from utils.exceptions import ValidationError
 from werkzeug.security import generate_password_hash
 from datetime import datetime
 from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+import hashlib
 
 api_bp = Blueprint('api', __name__, url_prefix='/api/v1')
 
@@ -39,73 +54,44 @@ def api_response(data=None, message=None, status=200, error=None):
     return jsonify(response), status
 
 
-def serialize_expense(expense):
-    """Serializar un objeto Expense a dict"""
-    return {
-        'id': expense.id,
-        'user_id': expense.user_id,
-        'user_name': expense.user.full_name if expense.user else None,
-        'client_id': expense.client_id,
-        'client_name': expense.client.name if expense.client else None,
-        'amount': float(expense.amount),
-        'expense_date': expense.expense_date.isoformat(),
-        'category': expense.category,
-        'reason': expense.reason,
-        'receipt_image': expense.receipt_image,
-        'latitude': float(expense.latitude) if expense.latitude else None,
-        'longitude': float(expense.longitude) if expense.longitude else None,
-        'address': expense.address,
-        'status': expense.status,
-        'created_at': expense.created_at.isoformat(),
-        'updated_at': expense.updated_at.isoformat() if expense.updated_at else None,
-        'ocr_data': expense.ocr_data
-    }
-
-
-def serialize_user(user):
-    """Serializar un objeto User a dict"""
-    return {
-        'id': user.id,
-        'email': user.email,
-        'first_name': user.first_name,
-        'last_name': user.last_name,
-        'full_name': user.full_name,
-        'role': user.role,
-        'area_id': user.area_id,
-        'area_name': user.area.name if user.area else None,
-        'supervisor_id': user.supervisor_id,
-        'is_active': user.is_active,
-        'created_at': user.created_at.isoformat(),
-        'last_login': user.last_login.isoformat() if user.last_login else None
-    }
+def conditional_response(etag, last_modified, build):
+    """
+    304 si el cliente ya tiene la versión etag; si no, la respuesta de
+    build() (que solo se ejecuta en ese caso) con ETag y Last-Modified.
+    """
+    response = http_cache.not_modified(etag, last_modified)
+    if response is not None:
+        return response
+    response, status = build()
+    return http_cache.set_validators(response, etag, last_modified), status
 
 
 # ============= EXPENSES ENDPOINTS =============
 
-@api_bp.route('/expenses', methods=['GET'])
-@api_login_required
-@limiter.limit("30 per minute")
-def get_expenses():
+def date_param(name):
+    """Fecha YYYY-MM-DD desde los query params (None si no viene)"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValidationError(f'Fecha inválida en {name} (formato YYYY-MM-DD)', field=name)
+
+
+def filtered_expenses_query(include_self=True):
     """
-    GET /api/v1/expenses
-    Query params: page, per_page, status, category, user_id
+    Gastos visibles para el usuario actual con los filtros del request.
+    Compartido por el listado y la exportación.
+    Query params: status, category, user_id, date_from, date_to (YYYY-MM-DD)
     """
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 20, type=int)
+    # Alcance según rol (admin: todo, supervisor: equipo y propios, usuario: propios)
+    query = visibility.for_user(current_user).expenses(include_self=include_self)
+
     status = request.args.get('status')
     category = request.args.get('category')
     user_id = request.args.get('user_id', type=int)
 
-    # Base query según rol
-    if current_user.role == 'admin':
-        query = Expense.query
-    elif current_user.role == 'supervisor':
-        subordinates = User.query.filter_by(supervisor_id=current_user.id).all()
-        subordinate_ids = [sub.id for sub in subordinates] + [current_user.id]
-        query = Expense.query.filter(Expense.user_id.in_(subordinate_ids))
-    else:
-        query = Expense.query.filter_by(user_id=current_user.id)
-
     # Aplicar filtros
     if status:
         query = query.filter_by(status=status)
@@ -114,13 +100,58 @@ def get_expenses():
     if user_id and current_user.role in ['admin', 'supervisor']:
         query = query.filter_by(user_id=user_id)
 
+    date_from = date_param('date_from')
+    date_to = date_param('date_to')
+    if date_from:
+        query = query.filter(Expense.expense_date >= date_from)
+    if date_to:
+        query = query.filter(Expense.expense_date <= date_to)
+
+    return query
+
+
+@api_bp.route('/expenses', methods=['GET'])
+@api_login_required
+@limiter.limit("30 per minute")
+def get_expenses():
+    """
+    GET /api/v1/expenses
+    Query params: page, per_page, status, category, user_id, date_from, date_to
+    Paginación por cursor (opcional): cursor (vacío para la primera página), count=false
+    Sparse fieldsets (opcional): fields=id,amount,status  include=user,client
+    """
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 20, type=int)
+    query = filtered_expenses_query()
+
+    fields = parse_list(request.args.get('fields'))
+    include = parse_list(request.args.get('include'))
+    if fields is not None or include:
+        # Solo las columnas pedidas, sin cargar entidades completas
+        query, dump = expense_serializer.project(query, fields, include)
+    else:
+        # Relaciones usadas por la serialización (evita consultas N+1)
+        query = expense_serializer.prepare(query)
+        dump = expense_serializer.dump
+
+    # Paginación por cursor: tiempo constante en páginas profundas
+    if cursor_requested(request.args):
+        result = keyset_paginate(
+            query, Expense, cursor=request.args.get('cursor'), per_page=per_page,
+            with_count=count_requested(request.args)
+        )
+        return api_response(data={
+            'expenses': [dump(e) for e in result.items],
+            **result.to_dict()
+        })
+
     # Paginación
     pagination = query.order_by(Expense.created_at.desc()).paginate(
         page=page, per_page=per_page, error_out=False
     )
 
     return api_response(data={
-        'expenses': [serialize_expense(e) for e in pagination.items],
+        'expenses': [dump(e) for e in pagination.items],
         'total': pagination.total,
         'pages': pagination.pages,
         'current_page': pagination.page,
@@ -128,17 +159,111 @@ def get_expenses():
     })
 
 
+@api_bp.route('/expenses/export', methods=['GET'])
+@api_login_required
+@limiter.limit("5 per minute")
+def export_expenses():
+    """
+    GET /api/v1/expenses/export?format=csv|ndjson
+    Mismos filtros y alcance que el listado; fields= e include= opcionales.
+    include_self=0 excluye los gastos propios de un supervisor (mismo alcance
+    que los reportes). La respuesta se genera en streaming.
+    """
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return api_response(error='Formato no soportado (csv o ndjson)', status=400)
+    include_self = request.args.get('include_self', '1').lower() not in ('0', 'false')
+
+    return export_response(
+        filtered_expenses_query(include_self),
+        export_format,
+        fields=parse_list(request.args.get('fields')),
+        include=parse_list(request.args.get('include'))
+    )
+
+
+@api_bp.route('/expenses/search', methods=['GET'])
+@api_login_required
+@limiter.limit("60 per minute")
+def search_expenses():
+    """
+    GET /api/v1/expenses/search?q=texto
+    Busca en motivo, cliente (nombre o RUT) y texto OCR del recibo; los
+    resultados vienen ordenados por relevancia. Mismo alcance por rol y
+    filtros que el listado (status, category, user_id, date_from, date_to).
+    Query params: page, per_page (máximo 100)
+    """
+    query_text = request.args.get('q', '').strip()
+    words = search_index.terms(query_text)
+    if not words:
+        raise ValidationError('Indica el texto a buscar', field='q')
+
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+
+    # Un elemento extra indica si hay otra página (sin contar todas las coincidencias)
+    expenses = search_index.search(
+        expense_serializer.prepare(filtered_expenses_query()), words,
+        offset=(page - 1) * per_page, limit=per_page + 1
+    )
+
+    return api_response(data={
+        'expenses': [expense_serializer.dump(e) for e in expenses[:per_page]],
+        'query': query_text,
+        'current_page': page,
+        'per_page': per_page,
+        'has_more': len(expenses) > per_page
+    })
+
+
 @api_bp.route('/expenses/<int:expense_id>', methods=['GET'])
 @api_login_required
 def get_expense(expense_id):
-    """GET /api/v1/expenses/<id>"""
-    expense = Expense.query.get_or_404(expense_id)
+    """GET /api/v1/expenses/<id> (admite If-None-Match / If-Modified-Since)"""
+    # La respuesta incluye nombres de usuario y cliente: sus tablas también cuentan
+    row = db.session.execute(
+        db.select(Expense.user_id, Expense.updated_at, *http_cache.stamp_columns('users', 'clients'))
+        .where(Expense.id == expense_id)
+    ).first()
+    if row is None:
+        abort(404)
 
     # Verificar permisos
+    if current_user.role == 'user' and row.user_id != current_user.id:
+        return api_response(error='No tienes permiso para ver este gasto', status=403)
+
+    etag = http_cache.make_etag('expense', expense_id, row.updated_at, row.tables_version)
+    last_modified = http_cache.last_modified_of(row.updated_at, row.tables_updated_at)
+    return conditional_response(
+        etag, last_modified,
+        lambda: api_response(data=expense_serializer.dump(expense_serializer.get_or_404(expense_id)))
+    )
+
+
+@api_bp.route('/expenses/<int:expense_id>/ocr', methods=['GET'])
+@api_login_required
+def get_expense_ocr(expense_id):
+    """
+    GET /api/v1/expenses/<id>/ocr
+    Estado del procesamiento OCR en segundo plano (para polling)
+    """
+    expense = Expense.query.get_or_404(expense_id)
+
     if current_user.role == 'user' and expense.user_id != current_user.id:
         return api_response(error='No tienes permiso para ver este gasto', status=403)
 
-    return api_response(data=serialize_expense(expense))
+    job = latest_ocr_job(expense.id)
+    if job:
+        status = job.status
+    else:
+        status = 'done' if expense.ocr_data else 'not_queued'
+
+    return api_response(data={
+        'expense_id': expense.id,
+        'status': status,
+        'job': job.to_dict() if job else None,
+        'ocr_data': expense.ocr_data
+    })
 
 
 @api_bp.route('/expenses', methods=['POST'])
@@ -175,7 +300,7 @@ def create_expense():
         db.session.commit()
 
         return api_response(
-            data=serialize_expense(expense),
+            data=expense_serializer.dump(expense),
             message='Gasto creado exitosamente',
             status=201
         )
@@ -184,6 +309,52 @@ def create_expense():
         return api_response(error=str(e), status=500)
 
 
+@api_bp.route('/expenses/bulk', methods=['POST'])
+@api_login_required
+@limiter.limit("10 per minute")
+def bulk_create_expenses():
+    """
+    POST /api/v1/expenses/bulk
+    Body: arreglo JSON de gastos (mismos campos que POST /expenses) o NDJSON
+    (Content-Type: application/x-ndjson). Encabezado opcional Idempotency-Key.
+    Inserta los gastos válidos en una transacción e informa los errores por fila.
+    """
+    key = idempotency.request_key()
+    digest = hashlib.sha256()
+
+    if key:
+        saved = idempotency.find_saved(current_user.id, key)
+        if saved:
+            digest.update(request.get_data())
+            if saved.request_hash != digest.hexdigest():
+                return api_response(error='La Idempotency-Key ya se usó con otro contenido', status=422)
+            return idempotency.replay(saved)
+
+    try:
+        result = ExpenseImporter(current_user).run(iter_items(request, digest))
+    except Exception:
+        db.session.rollback()
+        raise
+
+    created = len(result['created'])
+    response, status = api_response(
+        data=result,
+        message=f"{created} gasto(s) creado(s), {len(result['errors'])} con errores",
+        status=201 if created else 422
+    )
+
+    try:
+        if key:
+            idempotency.remember(current_user.id, key, digest.hexdigest(), response.get_json(), status)
+        db.session.commit()
+    except IntegrityError:
+        # Otra solicitud con la misma clave se confirmó primero
+        db.session.rollback()
+        return api_response(error='Solicitud con la misma Idempotency-Key en curso', status=409)
+
+    return response, status
+
+
 @api_bp.route('/expenses/<int:expense_id>', methods=['PUT'])
 @api_login_required
 def update_expense(expense_id):
@@ -214,7 +385,7 @@ def update_expense(expense_id):
 
     try:
         db.session.commit()
-        return api_response(data=serialize_expense(expense), message='Gasto actualizado')
+        return api_response(data=expense_serializer.dump(expense), message='Gasto actualizado')
     except Exception as e:
         db.session.rollback()
         return api_response(error=str(e), status=500)
@@ -275,7 +446,7 @@ def approve_expense(expense_id):
         db.session.commit()
 
         return api_response(
-            data=serialize_expense(expense),
+            data=expense_serializer.dump(expense),
             message='Gasto aprobado exitosamente'
         )
     except Exception as e:
@@ -316,7 +487,7 @@ def reject_expense(expense_id):
         db.session.commit()
 
         return api_response(
-            data=serialize_expense(expense),
+            data=expense_serializer.dump(expense),
             message='Gasto rechazado'
         )
     except Exception as e:
@@ -324,17 +495,52 @@ def reject_expense(expense_id):
         return api_response(error=str(e), status=500)
 
 
+@api_bp.route('/approvals/batch', methods=['POST'])
+@api_login_required
+def batch_approvals():
+    """
+    POST /api/v1/approvals/batch
+    Body: {"expense_ids": [1, 2, 3], "action": "approved" | "rejected", "comments": "..."}
+    Resultado por gasto; los que no se pueden procesar no afectan al resto.
+    """
+    if current_user.role not in ['supervisor', 'admin']:
+        return api_response(error='No tienes permisos para aprobar gastos', status=403)
+
+    data = request.get_json() or {}
+    results = review_batch(
+        current_user,
+        data.get('expense_ids'),
+        data.get('action'),
+        data.get('comments', '')
+    )
+
+    processed = sum(1 for r in results if r['success'])
+    return api_response(
+        data={'results': results, 'processed': processed, 'failed': len(results) - processed},
+        message=f'{processed} de {len(results)} gastos procesados'
+    )
+
+
 # ============= USERS ENDPOINTS (Admin only) =============
 
 @api_bp.route('/users', methods=['GET'])
 @api_login_required
 def get_users():
-    """GET /api/v1/users (Admin only)"""
+    """
+    GET /api/v1/users (Admin only)
+    Sparse fieldsets (opcional): fields=id,email,full_name  include=area
+    """
     if current_user.role != 'admin':
         return api_response(error='Acceso denegado', status=403)
 
-    users = User.query.all()
-    return api_response(data=[serialize_user(u) for u in users])
+    fields = parse_list(request.args.get('fields'))
+    include = parse_list(request.args.get('include'))
+    if fields is not None or include:
+        query, dump = user_serializer.project(User.query, fields, include)
+        return api_response(data=[dump(row) for row in query.all()])
+
+    users = user_serializer.prepare(User.query).all()
+    return api_response(data=user_serializer.dump_many(users))
 
 
 @api_bp.route('/users/<int:user_id>', methods=['GET'])
@@ -344,8 +550,8 @@ def get_user(user_id):
     if current_user.role != 'admin' and current_user.id != user_id:
         return api_response(error='Acceso denegado', status=403)
 
-    user = User.query.get_or_404(user_id)
-    return api_response(data=serialize_user(user))
+    user = user_serializer.get_or_404(user_id)
+    return api_response(data=user_serializer.dump(user))
 
 
 @api_bp.route('/users', methods=['POST'])
@@ -380,7 +586,7 @@ def create_user():
         db.session.commit()
 
         return api_response(
-            data=serialize_user(user),
+            data=user_serializer.dump(user),
             message='Usuario creado exitosamente',
             status=201
         )
@@ -394,32 +600,22 @@ def create_user():
 @api_bp.route('/stats/summary', methods=['GET'])
 @api_login_required
 def get_stats_summary():
-    """GET /api/v1/stats/summary"""
-    if current_user.role == 'admin':
-        query = Expense.query
-    elif current_user.role == 'supervisor':
-        subordinates = User.query.filter_by(supervisor_id=current_user.id).all()
-        subordinate_ids = [sub.id for sub in subordinates] + [current_user.id]
-        query = Expense.query.filter(Expense.user_id.in_(subordinate_ids))
-    else:
-        query = Expense.query.filter_by(user_id=current_user.id)
+    """GET /api/v1/stats/summary (admite If-None-Match / If-Modified-Since)"""
+    # Depende de los gastos y del alcance del usuario (jerarquía en users)
+    version, last_modified = http_cache.stamp('expenses', 'users')
+    etag = http_cache.make_etag('stats', current_user.id, current_user.role, version)
 
-    total = query.count()
-    pending = query.filter_by(status='pending').count()
-    approved = query.filter_by(status='approved').count()
-    rejected = query.filter_by(status='rejected').count()
+    def build():
+        summary = expense_summary(visibility.for_user(current_user).rollups(include_self=True))
+        return api_response(data={
+            'total_expenses': summary['total_count'],
+            'pending': summary['pending_count'],
+            'approved': summary['approved_count'],
+            'rejected': summary['rejected_count'],
+            'total_amount': float(summary['total_amount'])
+        })
 
-    total_amount = db.session.query(db.func.sum(Expense.amount)).filter(
-        Expense.id.in_([e.id for e in query.all()])
-    ).scalar() or 0
-
-    return api_response(data={
-        'total_expenses': total,
-        'pending': pending,
-        'approved': approved,
-        'rejected': rejected,
-        'total_amount': float(total_amount)
-    })
+    return conditional_response(etag, last_modified, build)
 
 
 # ============= COMPANIES/CLIENTS ENDPOINTS =============
@@ -427,15 +623,12 @@ def get_stats_summary():
 @api_bp.route('/clients', methods=['GET'])
 @api_login_required
 def get_clients():
-    """GET /api/v1/clients"""
-    clients = Company.query.filter_by(is_active=True).all()
-    return api_response(data=[{
-        'id': c.id,
-        'rut': c.rut,
-        'name': c.name,
-        'contact_email': c.contact_email,
-        'status': c.status
-    } for c in clients])
+    """GET /api/v1/clients (admite If-None-Match / If-Modified-Since)"""
+    version, last_modified = http_cache.stamp('clients')
+    return conditional_response(
+        http_cache.make_etag('clients', version), last_modified,
+        lambda: api_response(data=[client._asdict() for client in active_clients(version)])
+    )
 
 
 # ============= CATEGORIES ENDPOINTS =============
@@ -443,14 +636,52 @@ def get_clients():
 @api_bp.route('/categories', methods=['GET'])
 @api_login_required
 def get_categories():
-    """GET /api/v1/categories"""
-    categories = ExpenseCategory.query.filter_by(is_active=True).all()
-    return api_response(data=[{
-        'id': c.id,
-        'name': c.name,
-        'requires_client': c.requires_client,
-        'max_amount': float(c.max_amount) if c.max_amount else None
-    } for c in categories])
+    """GET /api/v1/categories (admite If-None-Match / If-Modified-Since)"""
+    version, last_modified = http_cache.stamp('expense_categories')
+    return conditional_response(
+        http_cache.make_etag('categories', version), last_modified,
+        lambda: api_response(data=[{
+            'id': c.id,
+            'name': c.name,
+            'requires_client': c.requires_client,
+            'max_amount': float(c.max_amount) if c.max_amount else None
+        } for c in active_categories(version)])
+    )
+
+
+# ============= AREAS ENDPOINTS =============
+
+@api_bp.route('/areas/budget', methods=['GET'])
+@api_login_required
+def get_areas_budget():
+    """
+    GET /api/v1/areas/budget (Admin only)
+    Estado del presupuesto mensual por área. Parámetros: year, month (default: mes actual)
+    """
+    if current_user.role != 'admin':
+        return api_response(error='Acceso denegado', status=403)
+
+    year = request.args.get('year', type=int)
+    month = request.args.get('month', type=int)
+    if month is not None and not 1 <= month <= 12:
+        raise ValidationError('Mes inválido (1-12)', field='month')
+
+    return api_response(data=budget_status(year, month))
+
+
+# ============= CACHE ENDPOINTS =============
+
+@api_bp.route('/cache/stats', methods=['GET'])
+@api_login_required
+def get_cache_stats():
+    """GET /api/v1/cache/stats (Admin only) - aciertos/fallos por espacio de nombres"""
+    if current_user.role != 'admin':
+        return api_response(error='Acceso denegado', status=403)
+
+    return api_response(data={
+        'backend': type(cache.backend).__name__,
+        'namespaces': cache.stats(),
+    })
 
 
 # ============= HEALTH CHECK =============
@@ -3,35 +3,18 @@ from flask_login import login_required, current_user
 from extensions import db
 from models.expense import Expense
 from models.approval import Approval
-from models.user import User
 from datetime import datetime
 from sqlalchemy.orm import joinedload
+from services.approval_service import can_approve_expense, client_block_reason, review_batch
+from services import visibility
+from services.ocr_queue import latest_ocr_job
+from services.receipt_store import possible_duplicates, duplicate_receipt_ids
+from utils.exceptions import ValidationError
+from utils.pagination import keyset_paginate, cursor_requested, count_requested
 
 approvals_bp = Blueprint('approvals', __name__, url_prefix='/approvals')
 
 
-def can_approve_expense(user, expense):
-    """
-    Verifica si un usuario puede aprobar un gasto
-    - Admins pueden aprobar todo
-    - Supervisores pueden aprobar gastos de sus subordinados
-    - No se puede aprobar gastos propios
-    """
-    if user.id == expense.user_id:
-        return False
-
-    if user.role == 'admin':
-        return True
-
-    if user.role == 'supervisor':
-        # Verificar si el creador del gasto es subordinado
-        expense_owner = User.query.get(expense.user_id)
-        if expense_owner and expense_owner.supervisor_id == user.id:
-            return True
-
-    return False
-
-
 @approvals_bp.route('/pending')
 @login_required
 def pending():
@@ -47,33 +30,28 @@ def pending():
     per_page = current_app.config.get('EXPENSES_PER_PAGE', 20)
 
     # Obtener gastos pendientes que el usuario puede aprobar
-    if current_user.role == 'admin':
-        # Admin ve todos los gastos pendientes
-        query = Expense.query.options(
-            joinedload(Expense.user),
-            joinedload(Expense.client)
-        ).filter_by(status='pending')
-    else:
-        # Supervisor ve solo gastos de sus subordinados
-        subordinates = User.query.filter_by(supervisor_id=current_user.id).all()
-        subordinate_ids = [sub.id for sub in subordinates]
-        query = Expense.query.options(
-            joinedload(Expense.user),
-            joinedload(Expense.client)
-        ).filter(
-            Expense.user_id.in_(subordinate_ids),
-            Expense.status == 'pending'
-        )
-
-    pagination = query.order_by(Expense.created_at.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
+    # (admin: todos, supervisor: subordinados de todos los niveles; nunca los propios)
+    query = visibility.for_user(current_user).expenses(Expense.query.options(
+        joinedload(Expense.user),
+        joinedload(Expense.client)
+    )).filter(
+        Expense.status == 'pending',
+        Expense.user_id != current_user.id
     )
 
-    # Filtrar gastos que el usuario puede aprobar
-    approvable_expenses = [exp for exp in pagination.items if can_approve_expense(current_user, exp)]
+    if cursor_requested(request.args):
+        pagination = keyset_paginate(
+            query, Expense, cursor=request.args.get('cursor'), per_page=per_page,
+            with_count=count_requested(request.args)
+        )
+    else:
+        pagination = query.order_by(Expense.created_at.desc()).paginate(
+            page=page, per_page=per_page, error_out=False
+        )
 
     return render_template('approvals/pending.html',
-                         expenses=approvable_expenses,
+                         expenses=pagination.items,
+                         duplicate_ids=duplicate_receipt_ids(pagination.items),
                          pagination=pagination)
 
 
@@ -112,13 +90,10 @@ def approve(expense_id):
         flash('Este gasto ya fue procesado.', 'warning')
         return redirect(url_for('approvals.pending'))
 
-    # NUEVO: Verificar estado del cliente
-    if expense.client and expense.client.status == 'pending':
-        flash(f'No se puede aprobar este gasto. El cliente "{expense.client.name}" aún está pendiente de aprobación.', 'error')
-        return redirect(url_for('approvals.pending'))
-
-    if expense.client and expense.client.status == 'rejected':
-        flash(f'No se puede aprobar este gasto. El cliente "{expense.client.name}" fue rechazado.', 'error')
+    # Verificar estado del cliente
+    client_error = client_block_reason(expense)
+    if client_error:
+        flash(f'No se puede aprobar este gasto. {client_error}.', 'error')
         return redirect(url_for('approvals.pending'))
 
     comments = request.form.get('comments', '')
@@ -185,6 +160,39 @@ def reject(expense_id):
     return redirect(url_for('approvals.pending'))
 
 
+@approvals_bp.route('/batch', methods=['POST'])
+@login_required
+def batch():
+    """
+    Aprobar o rechazar varios gastos seleccionados en la lista de pendientes
+    """
+    if current_user.role not in ['supervisor', 'admin']:
+        flash('No tienes permisos para aprobar gastos.', 'error')
+        return redirect(url_for('index'))
+
+    expense_ids = request.form.getlist('expense_ids')
+    if not expense_ids:
+        flash('Selecciona al menos un gasto.', 'warning')
+        return redirect(url_for('approvals.pending'))
+
+    action = request.form.get('action')
+    try:
+        results = review_batch(current_user, expense_ids, action, request.form.get('comments', ''))
+    except ValidationError as e:
+        flash(e.message, 'error')
+        return redirect(url_for('approvals.pending'))
+
+    done = [r['expense_id'] for r in results if r['success']]
+    failed = [r for r in results if not r['success']]
+    if done:
+        verb = 'aprobado(s)' if action == 'approved' else 'rechazado(s)'
+        flash(f'{len(done)} gasto(s) {verb} exitosamente.', 'success')
+    for result in failed:
+        flash(f'Gasto #{result["expense_id"]}: {result["error"]}.', 'warning')
+
+    return redirect(url_for('approvals.pending'))
+
+
 @approvals_bp.route('/<int:expense_id>/detail')
 @login_required
 def detail(expense_id):
@@ -198,7 +206,12 @@ def detail(expense_id):
         flash('No tienes permisos para ver este gasto.', 'error')
         return redirect(url_for('index'))
 
-    return render_template('approvals/detail.html', expense=expense)
+    ocr_job = None if expense.ocr_data else latest_ocr_job(expense.id)
+
+    return render_template('approvals/detail.html',
+                         expense=expense,
+                         ocr_job=ocr_job,
+                         duplicates=possible_duplicates(expense))
 
 
 @approvals_bp.route('/all')
@@ -217,22 +230,22 @@ def all_expenses():
     from flask import current_app
     per_page = current_app.config.get('EXPENSES_PER_PAGE', 20)
 
-    if current_user.role == 'admin':
-        # Admin ve todos los gastos
-        query = Expense.query
-    else:
-        # Supervisor ve solo gastos de sus subordinados
-        subordinates = User.query.filter_by(supervisor_id=current_user.id).all()
-        subordinate_ids = [sub.id for sub in subordinates]
-        query = Expense.query.filter(Expense.user_id.in_(subordinate_ids))
+    # Admin ve todos los gastos; supervisor, los de sus subordinados (todos los niveles)
+    query = visibility.for_user(current_user).expenses()
 
     # Aplicar filtro de estado
     if status_filter != 'all':
         query = query.filter_by(status=status_filter)
 
-    pagination = query.order_by(Expense.created_at.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
-    )
+    if cursor_requested(request.args):
+        pagination = keyset_paginate(
+            query, Expense, cursor=request.args.get('cursor'), per_page=per_page,
+            with_count=count_requested(request.args)
+        )
+    else:
+        pagination = query.order_by(Expense.created_at.desc()).paginate(
+            page=page, per_page=per_page, error_out=False
+        )
 
     return render_template('approvals/all.html',
                          expenses=pagination.items,
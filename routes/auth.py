@@ -2,12 +2,14 @@ from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, login_required, current_user
 from extensions import db, login_manager
 from models.user import User
+from services import user_session
 
 auth_bp = Blueprint('auth', __name__)
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Copia en caché (SessionUser): sin consulta a la base de datos por request
+    return user_session.load_user(user_id)
 
 @auth_bp.route('/login', methods=['GET', 'POST'])
 def login():
@@ -1,14 +1,14 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
 from flask_login import login_required, current_user
-from werkzeug.utils import secure_filename
 from extensions import db
 from models.expense import Expense
 from models.company import Company
-from services.ocr_service import process_receipt
-from utils.file_validators import validate_file_upload, generate_unique_filename, scan_file_for_malware, FileValidationError
+from services.ocr_queue import enqueue_ocr_job
+from services.receipt_store import store_receipt
+from services.reference_data import active_clients
+from utils.file_validators import FileValidationError
+from utils.pagination import keyset_paginate, cursor_requested, count_requested
 from datetime import datetime
-import os
-import json
 
 expenses_bp = Blueprint('expenses', __name__)
 
@@ -91,81 +91,60 @@ def new():
         file = request.files['receipt']
         
         try:
-            # Validación completa del archivo
-            file_info = validate_file_upload(file)
-            filename = generate_unique_filename(file.filename, current_user.id)
-            
-            filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            
-            # Escaneo de malware
-            is_clean, threat_info = scan_file_for_malware(filepath)
-            if not is_clean:
-                os.remove(filepath)  # Eliminar archivo sospechoso
-                flash(f'Archivo rechazado por seguridad: {threat_info}', 'error')
-                return redirect(request.url)
-                
+            # Validación (una sola lectura) y almacenamiento por contenido:
+            # un recibo idéntico reutiliza el archivo
+            receipt, _ = store_receipt(file)
+
         except FileValidationError as e:
             flash(str(e), 'error')
             return redirect(request.url)
 
-            # Procesar imagen con OCR
-            ocr_data = None
-            try:
-                ocr_result = process_receipt(filepath)
-                if ocr_result['success']:
-                    ocr_data = ocr_result
-                    # Si no se ingresó monto y OCR encontró uno, sugerir
-                    if not request.form.get('amount') and ocr_result.get('suggested_amount'):
-                        flash(f'OCR detectó monto sugerido: ${ocr_result["suggested_amount"]:,.0f}', 'info')
-            except Exception as e:
-                print(f"Error procesando OCR: {str(e)}")
-                # Continuar sin OCR si falla
-
-            # Create expense
-            try:
-                # Verificar estado del cliente
-                client = Company.query.get(client_id)
-                expense_status = 'pending'
-
-                # Si el cliente está pendiente, el gasto también queda en estado especial
-                if client and client.status == 'pending':
-                    expense_status = 'pending'  # Quedará pendiente hasta que se apruebe el cliente
-                    flash('El gasto quedará pendiente hasta que el cliente sea aprobado.', 'warning')
-
-                expense = Expense(
-                    user_id=current_user.id,
-                    amount=float(request.form.get('amount')),
-                    category=request.form.get('category'),
-                    reason=request.form.get('reason'),
-                    client_id=client_id,  # Ahora obligatorio
-                    latitude=request.form.get('latitude') if request.form.get('latitude') else None,
-                    longitude=request.form.get('longitude') if request.form.get('longitude') else None,
-                    receipt_image=filename,
-                    expense_date=datetime.now(),
-                    ocr_data=ocr_data,
-                    status=expense_status
-                )
-
-                db.session.add(expense)
-                db.session.commit()
-
-                flash('Expense submitted successfully!', 'success')
-                if ocr_data and ocr_data.get('confidence') == 'high':
-                    flash('Datos extraídos automáticamente con alta confianza.', 'success')
-
-                return redirect(url_for('index'))
-
-            except Exception as e:
-                db.session.rollback()
-                flash(f'Error creating expense: {str(e)}', 'error')
-                return redirect(request.url)
-        else:
-            flash('Invalid file type', 'error')
+        # Create expense
+        try:
+            # Verificar estado del cliente
+            client = Company.query.get(client_id)
+            expense_status = 'pending'
+
+            # Si el cliente está pendiente, el gasto también queda en estado especial
+            if client and client.status == 'pending':
+                expense_status = 'pending'  # Quedará pendiente hasta que se apruebe el cliente
+                flash('El gasto quedará pendiente hasta que el cliente sea aprobado.', 'warning')
+
+            expense = Expense(
+                user_id=current_user.id,
+                amount=float(request.form.get('amount')),
+                category=request.form.get('category'),
+                reason=request.form.get('reason'),
+                client_id=client_id,  # Ahora obligatorio
+                latitude=request.form.get('latitude') if request.form.get('latitude') else None,
+                longitude=request.form.get('longitude') if request.form.get('longitude') else None,
+                receipt_image=receipt.stored_path,
+                receipt_sha256=receipt.sha256,
+                expense_date=datetime.now(),
+                ocr_data=receipt.ocr_result,
+                status=expense_status
+            )
+
+            db.session.add(expense)
+
+            # El OCR se procesa en segundo plano (flask ocr worker), salvo que
+            # el mismo recibo ya haya sido procesado
+            if not receipt.ocr_result:
+                enqueue_ocr_job(expense)
+            db.session.commit()
+
+            flash('Expense submitted successfully!', 'success')
+            if not receipt.ocr_result:
+                flash('El recibo se está procesando con OCR.', 'info')
+
+            return redirect(url_for('index'))
+
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error creating expense: {str(e)}', 'error')
             return redirect(request.url)
 
-    clients = Company.query.filter_by(is_active=True).all()
-    return render_template('expenses/new.html', clients=clients)
+    return render_template('expenses/new.html', clients=active_clients())
 
 @expenses_bp.route('/expenses/my')
 @login_required
@@ -173,9 +152,16 @@ def my_expenses():
     page = request.args.get('page', 1, type=int)
     per_page = current_app.config.get('EXPENSES_PER_PAGE', 20)
 
-    pagination = Expense.query.filter_by(user_id=current_user.id).order_by(
-        Expense.created_at.desc()
-    ).paginate(page=page, per_page=per_page, error_out=False)
+    query = Expense.query.filter_by(user_id=current_user.id)
+    if cursor_requested(request.args):
+        pagination = keyset_paginate(
+            query, Expense, cursor=request.args.get('cursor'), per_page=per_page,
+            with_count=count_requested(request.args)
+        )
+    else:
+        pagination = query.order_by(
+            Expense.created_at.desc()
+        ).paginate(page=page, per_page=per_page, error_out=False)
 
     expenses = pagination.items
 
@@ -0,0 +1,62 @@
+from flask import Blueprint, abort, current_app, request
+from flask_login import login_required, current_user
+from extensions import db, storage
+from models.expense import Expense
+from services import visibility
+from services.receipt_images import RECEIPT_VARIANTS, ensure_variant
+from utils.storage import StorageNotFound
+
+receipts_bp = Blueprint('receipts', __name__, url_prefix='/receipts')
+
+SIZES = (*RECEIPT_VARIANTS, 'original')
+
+
+def _cache_headers(response, etag):
+    # El recibo de un gasto nunca cambia: el navegador puede guardarlo sin
+    # revalidar, pero solo en su caché (requiere sesión)
+    response.set_etag(etag)
+    response.cache_control.public = False
+    response.cache_control.no_cache = None
+    response.cache_control.private = True
+    response.cache_control.max_age = _max_age()
+    response.cache_control.immutable = True
+    return response
+
+
+def _max_age():
+    return current_app.config.get('RECEIPT_CACHE_MAX_AGE', 2592000)
+
+
+@receipts_bp.route('/<int:expense_id>/<size>')
+@login_required
+def show(expense_id, size):
+    """
+    Recibo de un gasto en el tamaño pedido (thumb, preview, full u original).
+    Las versiones que falten se regeneran en el momento. Se sirven en streaming
+    desde el almacenamiento configurado, con soporte de Range e If-Range.
+
+    El ETag es fuerte (hash del contenido más el tamaño pedido) y se compara
+    después del permiso pero antes de tocar el almacenamiento.
+    """
+    if size not in SIZES:
+        abort(404)
+
+    row = db.session.execute(
+        db.select(Expense.user_id, Expense.receipt_image, Expense.receipt_sha256).where(Expense.id == expense_id)
+    ).first()
+    if row is None or not row.receipt_image or not visibility.for_user(current_user).can_view(row.user_id):
+        abort(404)
+
+    etag = f'{row.receipt_sha256 or row.receipt_image.replace("/", "-")}-{size}'
+    if request.if_none_match.contains(etag):
+        return _cache_headers(current_app.response_class(status=304), etag)
+
+    name = row.receipt_image if size == 'original' else ensure_variant(row.receipt_image, row.receipt_sha256, size)
+    if name is None:
+        abort(404)
+
+    try:
+        response = storage.send(name, max_age=_max_age(), etag=etag)
+    except StorageNotFound:
+        abort(404)
+    return _cache_headers(response, etag)
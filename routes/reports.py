@@ -1,12 +1,18 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from flask_login import login_required, current_user
-from extensions import db
 from models.expense import Expense
-from models.user import User
-from models.company import Area, ExpenseCategory
+from models.company import ExpenseCategory
 from models.approval import Approval
-from sqlalchemy import func, extract
-from datetime import datetime, timedelta
+from services import http_cache, visibility
+from services.budget_service import budget_status
+from services.report_charts import CHART_TYPES, ChartSeries
+from services.report_service import (
+    expense_summary, totals_by_category,
+    monthly_totals as report_monthly_totals, month_bounds,
+    top_users, available_years as report_available_years
+)
+from sqlalchemy.orm import joinedload
+from datetime import datetime, date, timedelta
 import calendar
 
 reports_bp = Blueprint('reports', __name__, url_prefix='/reports')
@@ -30,80 +36,36 @@ def dashboard():
     if redirect_result:
         return redirect_result
 
-    # Determinar qué gastos puede ver el usuario
-    if current_user.role == 'admin':
-        expense_query = Expense.query
-        user_query = User.query
-    else:
-        # Supervisor ve solo gastos de sus subordinados
-        subordinates = User.query.filter_by(supervisor_id=current_user.id).all()
-        subordinate_ids = [sub.id for sub in subordinates]
-        expense_query = Expense.query.filter(Expense.user_id.in_(subordinate_ids))
-        user_query = User.query.filter(User.id.in_(subordinate_ids))
-
-    # Métricas generales
-    total_expenses = expense_query.count()
-    pending_expenses = expense_query.filter_by(status='pending').count()
-    approved_expenses = expense_query.filter_by(status='approved').count()
-    rejected_expenses = expense_query.filter_by(status='rejected').count()
-
-    # Montos totales
-    total_amount = db.session.query(func.sum(Expense.amount)).filter(
-        Expense.id.in_([e.id for e in expense_query.all()])
-    ).scalar() or 0
-
-    approved_amount = db.session.query(func.sum(Expense.amount)).filter(
-        Expense.id.in_([e.id for e in expense_query.filter_by(status='approved').all()])
-    ).scalar() or 0
-
-    # Gastos del mes actual
-    current_month = datetime.now().month
-    current_year = datetime.now().year
-    month_expenses = expense_query.filter(
-        extract('month', Expense.expense_date) == current_month,
-        extract('year', Expense.expense_date) == current_year
-    ).count()
-
-    month_amount = db.session.query(func.sum(Expense.amount)).filter(
-        Expense.id.in_([e.id for e in expense_query.filter(
-            extract('month', Expense.expense_date) == current_month,
-            extract('year', Expense.expense_date) == current_year
-        ).all()])
-    ).scalar() or 0
+    # Alcance de visibilidad como subconsulta (sin materializar IDs)
+    scope = visibility.for_user(current_user)
+    rollup_scope = scope.rollups()
+
+    # Métricas generales y del mes actual desde el rollup mensual
+    now = datetime.now()
+    summary = expense_summary(rollup_scope, year=now.year, month=now.month)
 
     # Top 5 usuarios con más gastos (solo para admin)
-    top_users = []
+    top_users_data = []
     if current_user.role == 'admin':
-        top_users = db.session.query(
-            User.first_name, User.last_name,
-            func.count(Expense.id).label('count'),
-            func.sum(Expense.amount).label('total')
-        ).join(Expense).group_by(User.id).order_by(
-            func.sum(Expense.amount).desc()
-        ).limit(5).all()
+        top_users_data = top_users(limit=5)
 
     # Gastos por categoría
-    expenses_by_category = db.session.query(
-        Expense.category,
-        func.count(Expense.id).label('count'),
-        func.sum(Expense.amount).label('total')
-    ).filter(
-        Expense.id.in_([e.id for e in expense_query.all()])
-    ).group_by(Expense.category).all()
+    expenses_by_category = totals_by_category(rollup_scope)
 
     # Gastos recientes
-    recent_expenses = expense_query.order_by(Expense.created_at.desc()).limit(10).all()
+    recent_query = scope.expenses(Expense.query.options(joinedload(Expense.user)))
+    recent_expenses = recent_query.order_by(Expense.created_at.desc()).limit(10).all()
 
     return render_template('reports/dashboard.html',
-                         total_expenses=total_expenses,
-                         pending_expenses=pending_expenses,
-                         approved_expenses=approved_expenses,
-                         rejected_expenses=rejected_expenses,
-                         total_amount=total_amount,
-                         approved_amount=approved_amount,
-                         month_expenses=month_expenses,
-                         month_amount=month_amount,
-                         top_users=top_users,
+                         total_expenses=summary['total_count'],
+                         pending_expenses=summary['pending_count'],
+                         approved_expenses=summary['approved_count'],
+                         rejected_expenses=summary['rejected_count'],
+                         total_amount=summary['total_amount'],
+                         approved_amount=summary['approved_amount'],
+                         month_expenses=summary['month_count'],
+                         month_amount=summary['month_amount'],
+                         top_users=top_users_data,
                          expenses_by_category=expenses_by_category,
                          recent_expenses=recent_expenses)
 
@@ -122,32 +84,24 @@ def by_period():
     year = request.args.get('year', datetime.now().year, type=int)
     month = request.args.get('month', type=int)
 
-    # Determinar qué gastos puede ver el usuario
-    if current_user.role == 'admin':
-        query = Expense.query
-    else:
-        subordinates = User.query.filter_by(supervisor_id=current_user.id).all()
-        subordinate_ids = [sub.id for sub in subordinates]
-        query = Expense.query.filter(Expense.user_id.in_(subordinate_ids))
-
-    # Filtrar por año
-    query = query.filter(extract('year', Expense.expense_date) == year)
-
-    # Filtrar por mes si se especifica
+    # Período como rango de fechas
     if month:
-        query = query.filter(extract('month', Expense.expense_date) == month)
+        start, end = month_bounds(year, month)
+    else:
+        start, end = date(year, 1, 1), date(year + 1, 1, 1)
 
-    expenses = query.order_by(Expense.expense_date.desc()).all()
+    # Totales desde el rollup mensual (sin cargar las filas del período);
+    # el detalle se descarga con la exportación en streaming de la API
+    scope = visibility.for_user(current_user).rollups()
+    totals = report_monthly_totals(scope, start, end)
+    total_count = sum(count for count, _ in totals.values())
+    total_amount = sum(total for _, total in totals.values())
 
     # Calcular totales por mes si no hay mes específico
     monthly_totals = []
     if not month:
         for m in range(1, 13):
-            month_query = query.filter(extract('month', Expense.expense_date) == m)
-            count = month_query.count()
-            total = db.session.query(func.sum(Expense.amount)).filter(
-                Expense.id.in_([e.id for e in month_query.all()])
-            ).scalar() or 0
+            count, total = totals.get((year, m), (0, 0))
             monthly_totals.append({
                 'month': m,
                 'month_name': calendar.month_name[m],
@@ -155,19 +109,13 @@ def by_period():
                 'total': total
             })
 
-    # Totales generales
-    total_amount = sum(e.amount for e in expenses)
-    total_count = len(expenses)
-
     # Años disponibles
-    available_years = db.session.query(
-        extract('year', Expense.expense_date).label('year')
-    ).distinct().order_by('year').all()
-    available_years = [y[0] for y in available_years if y[0]]
+    available_years = report_available_years(scope)
 
     return render_template('reports/by_period.html',
-                         expenses=expenses,
                          year=year,
+                         date_from=start.isoformat(),
+                         date_to=(end - timedelta(days=1)).isoformat(),
                          month=month,
                          monthly_totals=monthly_totals,
                          total_amount=total_amount,
@@ -185,25 +133,8 @@ def by_category():
     if redirect_result:
         return redirect_result
 
-    # Determinar qué gastos puede ver el usuario
-    if current_user.role == 'admin':
-        query = Expense.query
-    else:
-        subordinates = User.query.filter_by(supervisor_id=current_user.id).all()
-        subordinate_ids = [sub.id for sub in subordinates]
-        query = Expense.query.filter(Expense.user_id.in_(subordinate_ids))
-
     # Agrupar por categoría
-    category_stats = db.session.query(
-        Expense.category,
-        func.count(Expense.id).label('count'),
-        func.sum(Expense.amount).label('total'),
-        func.avg(Expense.amount).label('average'),
-        func.min(Expense.amount).label('min_amount'),
-        func.max(Expense.amount).label('max_amount')
-    ).filter(
-        Expense.id.in_([e.id for e in query.all()])
-    ).group_by(Expense.category).order_by(func.sum(Expense.amount).desc()).all()
+    category_stats = totals_by_category(visibility.for_user(current_user).rollups(), with_stats=True)
 
     return render_template('reports/by_category.html',
                          category_stats=category_stats)
@@ -219,90 +150,38 @@ def by_area():
         flash('Solo administradores pueden ver este reporte.', 'error')
         return redirect(url_for('reports.dashboard'))
 
-    # Obtener todas las áreas
-    areas = Area.query.filter_by(is_active=True).all()
+    # Contadores mensuales por área (O(áreas), sin recorrer gastos)
+    today = date.today()
+    year = request.args.get('year', today.year, type=int)
+    month = request.args.get('month', today.month, type=int)
+    if not 1 <= month <= 12:
+        month = today.month
+    area_stats = budget_status(year, month)
 
-    area_stats = []
-    for area in areas:
-        # Usuarios en esta área
-        users_in_area = User.query.filter_by(area_id=area.id).all()
-        user_ids = [u.id for u in users_in_area]
-
-        # Gastos del área
-        expenses = Expense.query.filter(Expense.user_id.in_(user_ids)).all()
-        total_amount = sum(e.amount for e in expenses)
-        count = len(expenses)
-
-        # Gastos por estado
-        pending = len([e for e in expenses if e.status == 'pending'])
-        approved = len([e for e in expenses if e.status == 'approved'])
-
-        area_stats.append({
-            'area': area,
-            'user_count': len(users_in_area),
-            'expense_count': count,
-            'total_amount': total_amount,
-            'pending': pending,
-            'approved': approved,
-            'budget_usage': (total_amount / area.budget_monthly * 100) if area.budget_monthly else 0
-        })
-
-    return render_template('reports/by_area.html', area_stats=area_stats)
+    return render_template('reports/by_area.html', area_stats=area_stats, year=year, month=month)
 
 
 @reports_bp.route('/api/chart-data')
 @login_required
 def chart_data():
     """
-    API endpoint para datos de gráficos
+    API endpoint para datos de gráficos (una serie: type=monthly|category|status)
     """
     chart_type = request.args.get('type', 'monthly')
+    if chart_type not in CHART_TYPES:
+        return jsonify([])
 
-    if current_user.role == 'admin':
-        query = Expense.query
-    else:
-        subordinates = User.query.filter_by(supervisor_id=current_user.id).all()
-        subordinate_ids = [sub.id for sub in subordinates]
-        query = Expense.query.filter(Expense.user_id.in_(subordinate_ids))
-
-    if chart_type == 'monthly':
-        # Últimos 12 meses
-        data = []
-        for i in range(11, -1, -1):
-            date = datetime.now() - timedelta(days=30*i)
-            month_expenses = query.filter(
-                extract('month', Expense.expense_date) == date.month,
-                extract('year', Expense.expense_date) == date.year
-            ).all()
-            total = sum(e.amount for e in month_expenses)
-            data.append({
-                'label': date.strftime('%b %Y'),
-                'value': float(total)
-            })
-        return jsonify(data)
-
-    elif chart_type == 'category':
-        # Por categoría
-        category_data = db.session.query(
-            Expense.category,
-            func.sum(Expense.amount).label('total')
-        ).filter(
-            Expense.id.in_([e.id for e in query.all()])
-        ).group_by(Expense.category).all()
-
-        data = [{'label': cat, 'value': float(total)} for cat, total in category_data]
-        return jsonify(data)
-
-    elif chart_type == 'status':
-        # Por estado
-        status_data = db.session.query(
-            Expense.status,
-            func.count(Expense.id).label('count')
-        ).filter(
-            Expense.id.in_([e.id for e in query.all()])
-        ).group_by(Expense.status).all()
-
-        data = [{'label': status, 'value': count} for status, count in status_data]
-        return jsonify(data)
-
-    return jsonify([])
+    return jsonify(ChartSeries(current_user).get(chart_type))
+
+
+@reports_bp.route('/api/chart-data/all')
+@login_required
+def chart_data_all():
+    """
+    Las tres series del dashboard en una respuesta (admite If-None-Match)
+    """
+    series = ChartSeries(current_user)
+    response = http_cache.not_modified(series.etag, series.last_modified)
+    if response is None:
+        response = http_cache.set_validators(jsonify(series.all()), series.etag, series.last_modified)
+    return response
@@ -0,0 +1,161 @@
+"""
+Aprobación y rechazo de gastos
+
+review_batch() procesa una lista de gastos con una consulta de carga
+(gasto + cliente) y el conjunto de subordinados del aprobador (en caché
+durante el request, ver services.visibility), valida los estados en
+memoria, inserta todas las filas de Approval en una sola sentencia y
+confirma una vez.
+Los cambios de estado se hacen sobre las entidades ORM para que el rollup
+mensual se actualice con los mismos eventos de flush que el flujo individual.
+"""
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import insert
+from sqlalchemy.orm import joinedload
+from extensions import db
+from models.approval import Approval
+from models.expense import Expense
+from services import visibility
+from utils.exceptions import ValidationError
+
+
+ACTIONS = ('approved', 'rejected')
+
+
+def can_approve_expense(user, expense):
+    """
+    Verifica si un usuario puede aprobar un gasto
+    - Admins pueden aprobar todo
+    - Supervisores pueden aprobar gastos de sus subordinados (cualquier nivel)
+    - No se puede aprobar gastos propios
+
+    Solo usa user.id y user.role: acepta el SessionUser de la sesión sin
+    cargar la entidad User.
+    """
+    if user.id == expense.user_id:
+        return False
+
+    if user.role == 'admin':
+        return True
+
+    if user.role == 'supervisor':
+        return expense.user_id in visibility.for_user(user).subordinates()
+
+    return False
+
+
+def approvable_owner_ids(user, owner_ids):
+    """Subconjunto de owner_ids cuyos gastos puede aprobar el usuario (para un lote)"""
+    owner_ids = set(owner_ids) - {user.id}
+    if user.role == 'admin':
+        return owner_ids
+    if user.role != 'supervisor':
+        return set()
+    return owner_ids & visibility.for_user(user).subordinates()
+
+
+def client_block_reason(expense):
+    """Motivo por el que el cliente impide aprobar el gasto (None si no lo impide)"""
+    if expense.client and expense.client.status == 'pending':
+        return f'El cliente "{expense.client.name}" aún está pendiente de aprobación'
+    if expense.client and expense.client.status == 'rejected':
+        return f'El cliente "{expense.client.name}" fue rechazado'
+    return None
+
+
+def parse_expense_ids(values):
+    """
+    Normaliza la lista de IDs (sin duplicados, en el orden recibido).
+
+    Raises:
+        ValidationError: Si la lista está vacía, es demasiado larga o tiene valores no numéricos
+    """
+    if not isinstance(values, (list, tuple)) or not values:
+        raise ValidationError('Debes indicar al menos un gasto', field='expense_ids')
+    try:
+        ids = list(dict.fromkeys(int(value) for value in values))
+    except (TypeError, ValueError):
+        raise ValidationError('IDs de gasto inválidos', field='expense_ids')
+
+    limit = current_app.config.get('APPROVAL_BATCH_MAX', 500)
+    if len(ids) > limit:
+        raise ValidationError(f'Máximo {limit} gastos por solicitud', field='expense_ids')
+    return ids
+
+
+def review_batch(approver, expense_ids, action, comments=''):
+    """
+    Aprueba o rechaza varios gastos en una transacción.
+
+    Cada gasto se valida por separado: los que no cumplen (inexistente, sin
+    permiso, ya procesado, cliente no aprobado) se informan con su error y no
+    impiden procesar el resto.
+
+    Args:
+        approver: Usuario que aprueba
+        expense_ids: IDs de los gastos
+        action: 'approved' o 'rejected'
+        comments: Comentario común (obligatorio para rechazar)
+
+    Returns:
+        list: [{'expense_id', 'success', 'status' | 'error'}] en el orden recibido
+
+    Raises:
+        ValidationError: Si la acción o los IDs no son válidos
+    """
+    if action not in ACTIONS:
+        raise ValidationError('Acción inválida', field='action')
+    if action == 'rejected' and not comments:
+        raise ValidationError('Debes proporcionar un motivo para rechazar', field='comments')
+    ids = parse_expense_ids(expense_ids)
+
+    expenses = {
+        expense.id: expense
+        for expense in Expense.query.options(
+            joinedload(Expense.client)
+        ).filter(Expense.id.in_(ids)).with_for_update(of=Expense)
+    }
+
+    allowed_owners = approvable_owner_ids(approver, {expense.user_id for expense in expenses.values()})
+
+    now = datetime.utcnow()
+    results = []
+    approvals = []
+    for expense_id in ids:
+        expense = expenses.get(expense_id)
+        error = None
+        if expense is None:
+            error = 'Gasto no encontrado'
+        elif expense.user_id not in allowed_owners:
+            error = 'No tienes permisos para procesar este gasto'
+        elif expense.status != 'pending':
+            error = 'Este gasto ya fue procesado'
+        elif action == 'approved':
+            error = client_block_reason(expense)
+
+        if error:
+            results.append({'expense_id': expense_id, 'success': False, 'error': error})
+            continue
+
+        expense.status = action
+        expense.updated_at = now
+        approvals.append({
+            'expense_id': expense_id,
+            'approver_id': approver.id,
+            'action': action,
+            'comments': comments,
+            'created_at': now,
+        })
+        results.append({'expense_id': expense_id, 'success': True, 'status': action})
+
+    if approvals:
+        try:
+            # El autoflush previo emite los UPDATE de estado (y el rollup)
+            db.session.execute(insert(Approval), approvals)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    return results
@@ -0,0 +1,193 @@
+"""
+Control de presupuesto mensual por área
+
+area_monthly_spend guarda, por (área, año, mes), la cantidad y el monto de
+gastos en total, pendientes y aprobados (incluye reembolsados). Los contadores
+se actualizan desde rollup_service.apply_deltas, es decir en el mismo flush
+que crea, edita, aprueba, rechaza o elimina un gasto (y en la carga masiva),
+y pasan de un área a otra cuando cambia el área de un usuario.
+
+El uso del presupuesto considera el monto comprometido: pendientes más
+aprobados. Los rechazados cuentan en el total pero no consumen presupuesto.
+Leer el estado de todas las áreas es O(áreas), sin recorrer gastos.
+"""
+from collections import defaultdict
+from datetime import date, datetime
+from flask import current_app
+from sqlalchemy import select, insert, delete, func, case, extract, and_
+from extensions import db
+from models.company import Area
+from models.expense import Expense
+from models.user import User
+from models.report import AreaMonthlySpend
+from utils.upsert import insert_for
+
+
+APPROVED_STATUSES = ('approved', 'reimbursed')
+
+COUNTER_COLUMNS = (
+    'expense_count', 'total_amount', 'pending_count', 'pending_amount', 'approved_count', 'approved_amount'
+)
+
+
+def _counter_deltas(status, count, amount):
+    """Deltas por columna de un gasto que entra (count=1) o sale (count=-1)"""
+    deltas = {'expense_count': count, 'total_amount': amount}
+    if status == 'pending':
+        deltas.update(pending_count=count, pending_amount=amount)
+    elif status in APPROVED_STATUSES:
+        deltas.update(approved_count=count, approved_amount=amount)
+    return deltas
+
+
+def apply_area_deltas(connection, added, removed, areas):
+    """
+    Aplica a area_monthly_spend los mismos movimientos que recibe el rollup.
+
+    Args:
+        connection: Conexión dentro de la transacción activa
+        added / removed: Iterables de (bucket, monto) con el formato de rollup_service
+        areas: {user_id: area_id}
+    """
+    def rows(items):
+        for (user_id, _, _, status, year, month), amount in items:
+            yield areas.get(user_id), year, month, status, 1, amount
+
+    apply_area_totals(connection, added=rows(added), removed=rows(removed))
+
+
+def apply_area_totals(connection, added=(), removed=()):
+    """
+    Aplica totales ya agrupados, p. ej. los de un usuario que cambia de área.
+
+    Args:
+        connection: Conexión dentro de la transacción activa
+        added / removed: Iterables de (area_id, año, mes, estado, cantidad, monto)
+    """
+    periods = defaultdict(lambda: dict.fromkeys(COUNTER_COLUMNS, 0))
+    for rows, sign in ((added, 1), (removed, -1)):
+        for area_id, year, month, status, count, amount in rows:
+            if area_id is None:
+                continue
+            totals = periods[(area_id, year, month)]
+            for column, delta in _counter_deltas(status, sign * count, sign * float(amount)).items():
+                totals[column] += delta
+
+    A = AreaMonthlySpend
+    now = datetime.utcnow()
+    for (area_id, year, month), deltas in periods.items():
+        if not any(deltas.values()):
+            continue
+        # Upsert: la fila se crea con cualquier delta (también un cambio de estado
+        # sobre un período sin fila) y se suma en una sola sentencia
+        statement = insert_for(connection, A).values(area_id=area_id, year=year, month=month, updated_at=now, **deltas)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=['area_id', 'year', 'month'],
+            set_={
+                **{column: getattr(A, column) + getattr(statement.excluded, column) for column in COUNTER_COLUMNS},
+                'updated_at': statement.excluded.updated_at,
+            }
+        ))
+        if deltas['expense_count'] < 0:
+            connection.execute(delete(A).where(
+                A.area_id == area_id, A.year == year, A.month == month, A.expense_count <= 0
+            ))
+
+
+def rebuild_area_spend():
+    """
+    Recalcula area_monthly_spend con una sola consulta agrupada.
+    No confirma la transacción (lo hace rollup_service.rebuild_rollups).
+    """
+    A = AreaMonthlySpend
+    year_col = extract('year', Expense.expense_date)
+    month_col = extract('month', Expense.expense_date)
+    status = func.coalesce(Expense.status, 'pending')
+    pending = status == 'pending'
+    approved = status.in_(APPROVED_STATUSES)
+
+    source = select(
+        User.area_id,
+        year_col,
+        month_col,
+        func.count(Expense.id),
+        func.sum(Expense.amount),
+        func.sum(case((pending, 1), else_=0)),
+        func.sum(case((pending, Expense.amount), else_=0)),
+        func.sum(case((approved, 1), else_=0)),
+        func.sum(case((approved, Expense.amount), else_=0)),
+        func.current_timestamp(),
+    ).join(User, User.id == Expense.user_id).where(
+        User.area_id.isnot(None)
+    ).group_by(User.area_id, year_col, month_col)
+
+    db.session.execute(delete(A))
+    db.session.execute(insert(A).from_select(
+        ['area_id', 'year', 'month', *COUNTER_COLUMNS, 'updated_at'], source
+    ))
+
+
+def _status(usage_pct, threshold):
+    if usage_pct is None:
+        return None
+    if usage_pct >= 100:
+        return 'over'
+    if usage_pct >= threshold:
+        return 'warning'
+    return 'ok'
+
+
+def budget_status(year=None, month=None):
+    """
+    Estado del presupuesto de cada área activa en el mes (por defecto el actual).
+
+    Returns:
+        list[dict]: Una fila por área con contadores, monto comprometido,
+            saldo, porcentaje de uso y estado ('ok', 'warning', 'over' o
+            None si el área no tiene presupuesto)
+    """
+    today = date.today()
+    year = year or today.year
+    month = month or today.month
+    threshold = current_app.config.get('BUDGET_WARNING_THRESHOLD', 80)
+
+    A = AreaMonthlySpend
+    rows = db.session.execute(
+        select(Area.id, Area.name, Area.budget_monthly, *(getattr(A, column) for column in COUNTER_COLUMNS))
+        .outerjoin(A, and_(A.area_id == Area.id, A.year == year, A.month == month))
+        .where(Area.is_active.is_(True))
+        .order_by(Area.name)
+    ).all()
+
+    user_counts = dict(db.session.execute(
+        select(User.area_id, func.count(User.id))
+        .where(User.area_id.in_([row.id for row in rows]))
+        .group_by(User.area_id)
+    ).all()) if rows else {}
+
+    result = []
+    for row in rows:
+        budget = float(row.budget_monthly) if row.budget_monthly else None
+        pending_amount = float(row.pending_amount or 0)
+        approved_amount = float(row.approved_amount or 0)
+        committed = pending_amount + approved_amount
+        usage_pct = round(committed / budget * 100, 1) if budget else None
+        result.append({
+            'area_id': row.id,
+            'name': row.name,
+            'year': year,
+            'month': month,
+            'budget_monthly': budget,
+            'user_count': user_counts.get(row.id, 0),
+            'expense_count': row.expense_count or 0,
+            'total_amount': float(row.total_amount or 0),
+            'pending_count': row.pending_count or 0,
+            'pending_amount': pending_amount,
+            'approved_count': row.approved_count or 0,
+            'approved_amount': approved_amount,
+            'committed_amount': committed,
+            'remaining': budget - committed if budget else None,
+            'usage_pct': usage_pct,
+            'status': _status(usage_pct, threshold),
+        })
+    return result
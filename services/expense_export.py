@@ -0,0 +1,118 @@
+"""
+Exportación de gastos en streaming (CSV / NDJSON)
+
+Las filas se leen con yield_per (cursor del lado del servidor en PostgreSQL)
+como tuplas de columnas, sin entidades ORM ni identity map, y se envían al
+cliente a medida que llegan. La memoria usada es constante sin importar el
+número de filas exportadas.
+"""
+import csv
+import json
+from datetime import datetime
+from flask import Response, stream_with_context
+from models.expense import Expense
+from services.serializers import expense_serializer
+
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Filas leídas de la base de datos por lote
+FETCH_SIZE = 1000
+# Filas acumuladas antes de enviar un bloque al cliente
+CHUNK_ROWS = 500
+
+# Por defecto se exporta todo salvo el resultado OCR (JSON potencialmente grande)
+DEFAULT_FIELDS = [name for name in expense_serializer.fields if name != 'ocr_data']
+
+
+class _Echo:
+    """Pseudo-archivo para csv.writer: devuelve la línea en vez de guardarla"""
+
+    def write(self, value):
+        return value
+
+
+def _flatten(item):
+    """{'user': {'id': 1}} -> {'user.id': 1} para columnas CSV"""
+    flat = {}
+    for key, value in item.items():
+        if isinstance(value, dict):
+            for subkey, subvalue in value.items():
+                flat[f'{key}.{subkey}'] = subvalue
+        else:
+            flat[key] = value
+    return flat
+
+
+def _csv_header(fields, include):
+    header = list(fields)
+    if 'id' not in header:
+        header.insert(0, 'id')
+    for name in include:
+        header += [f'{name}.{subkey}' for subkey in expense_serializer.includes[name]]
+    return header
+
+
+def _csv_value(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return '' if value is None else value
+
+
+def generate_csv(rows, dump, header):
+    writer = csv.writer(_Echo())
+    chunk = [writer.writerow(header)]
+    for row in rows:
+        item = _flatten(dump(row))
+        chunk.append(writer.writerow([_csv_value(item.get(column)) for column in header]))
+        if len(chunk) >= CHUNK_ROWS:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def generate_ndjson(rows, dump):
+    chunk = []
+    for row in rows:
+        chunk.append(json.dumps(dump(row), ensure_ascii=False, default=str) + '\n')
+        if len(chunk) >= CHUNK_ROWS:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def export_response(query, export_format, fields=None, include=None):
+    """
+    Respuesta en streaming con los gastos de la consulta (ya filtrada por rol).
+
+    Args:
+        query: Consulta de Expense
+        export_format: 'csv' o 'ndjson'
+        fields: Campos a exportar (default: DEFAULT_FIELDS)
+        include: Objetos relacionados a incluir (user, client)
+    """
+    fields = DEFAULT_FIELDS if fields is None else fields
+    include = include or []
+    query, dump = expense_serializer.project(query, fields, include)
+    rows = query.order_by(Expense.id).yield_per(FETCH_SIZE)
+
+    if export_format == 'csv':
+        body = generate_csv(rows, dump, _csv_header(fields, include))
+    else:
+        body = generate_ndjson(rows, dump)
+
+    filename = f"gastos_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    return Response(
+        stream_with_context(body),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            # Evitar que un proxy (nginx) acumule la respuesta completa
+            'X-Accel-Buffering': 'no',
+        }
+    )
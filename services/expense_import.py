@@ -0,0 +1,213 @@
+"""
+Carga masiva de gastos (integraciones con tarjetas corporativas)
+
+Los gastos llegan como arreglo JSON o NDJSON (uno por línea, leído en
+streaming). Se validan contra las categorías activas (en caché, ver
+services.reference_data) y los clientes precargados por bloque (sin una
+consulta por fila) y los válidos se insertan por bloques con un
+INSERT executemany. Como los INSERT masivos no pasan por los eventos de
+flush del ORM, el rollup mensual (rollup_service.apply_deltas), la versión
+de la tabla para ETags (http_cache.bump) y el índice de búsqueda
+(search_index.reindex) se actualizan explícitamente en la misma transacción.
+"""
+import json
+from datetime import date, datetime
+from flask import current_app
+from sqlalchemy import insert
+from extensions import db
+from models.company import Company
+from models.expense import Expense
+from services import http_cache, rollup_service, search_index
+from services.reference_data import active_categories
+from utils.exceptions import ValidationError
+
+
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/jsonl', 'application/json-seq')
+
+REQUIRED_FIELDS = ('amount', 'category', 'reason', 'client_id', 'receipt_image')
+
+
+class RowError(Exception):
+    """Error de validación de una fila (no detiene la carga)"""
+
+    def __init__(self, message, field=None):
+        super().__init__(message)
+        self.message = message
+        self.field = field
+
+
+def iter_items(req, digest):
+    """
+    Items del cuerpo del request como (índice, dict | RowError).
+    digest se actualiza con el cuerpo leído (para Idempotency-Key).
+
+    Raises:
+        ValidationError: Si el cuerpo JSON no es un arreglo de gastos
+    """
+    if req.mimetype in NDJSON_MIMETYPES:
+        index = 0
+        for line in req.stream:
+            digest.update(line)
+            if not line.strip():
+                continue
+            try:
+                yield index, json.loads(line)
+            except ValueError:
+                yield index, RowError('JSON inválido')
+            index += 1
+        return
+
+    body = req.get_data()
+    digest.update(body)
+    try:
+        payload = json.loads(body or b'null')
+    except ValueError:
+        raise ValidationError('JSON inválido')
+    if isinstance(payload, dict):
+        payload = payload.get('expenses')
+    if not isinstance(payload, list):
+        raise ValidationError('Se esperaba un arreglo de gastos (o NDJSON)', field='expenses')
+    yield from enumerate(payload)
+
+
+class ExpenseImporter:
+    """Valida e inserta gastos de un usuario por bloques"""
+
+    def __init__(self, user):
+        self.user = user
+        self.chunk_size = current_app.config.get('BULK_IMPORT_CHUNK_SIZE', 500)
+        self.max_rows = current_app.config.get('BULK_IMPORT_MAX_ROWS', 5000)
+        # Categorías activas: {nombre: monto máximo}
+        self.categories = {c.name: c.max_amount for c in active_categories()}
+        # Clientes ya consultados: {id: estado}
+        self.clients = {}
+        self.created = []
+        self.errors = []
+
+    def run(self, items):
+        """
+        Procesa todos los items. No confirma la transacción.
+
+        Returns:
+            dict: {'created': [{'index', 'id'}], 'errors': [{'index', 'error', 'field'}]}
+
+        Raises:
+            ValidationError: Si se supera BULK_IMPORT_MAX_ROWS
+        """
+        chunk = []
+        for count, item in enumerate(items, 1):
+            if count > self.max_rows:
+                raise ValidationError(f'Máximo {self.max_rows} gastos por solicitud', field='expenses')
+            chunk.append(item)
+            if len(chunk) >= self.chunk_size:
+                self._process(chunk)
+                chunk = []
+        if chunk:
+            self._process(chunk)
+
+        return {'created': self.created, 'errors': self.errors}
+
+    def _load_clients(self, chunk):
+        """Consulta en una sola vez los clientes del bloque aún no vistos"""
+        ids = set()
+        for _, data in chunk:
+            if isinstance(data, dict):
+                try:
+                    ids.add(int(data.get('client_id')))
+                except (TypeError, ValueError):
+                    pass
+        missing = ids - self.clients.keys()
+        if missing:
+            self.clients.update(db.session.query(Company.id, Company.status).filter(Company.id.in_(missing)).all())
+
+    def _process(self, chunk):
+        self._load_clients(chunk)
+
+        rows = []
+        indexes = []
+        for index, data in chunk:
+            try:
+                if isinstance(data, RowError):
+                    raise data
+                rows.append(self._row(data))
+                indexes.append(index)
+            except RowError as e:
+                self.errors.append({'index': index, 'error': e.message, 'field': e.field})
+
+        if not rows:
+            return
+
+        ids = db.session.execute(
+            insert(Expense).returning(Expense.id, sort_by_parameter_order=True), rows
+        ).scalars().all()
+        self.created.extend({'index': index, 'id': expense_id} for index, expense_id in zip(indexes, ids))
+
+        rollup_service.apply_deltas(db.session.connection(), added=[
+            ((row['user_id'], row['client_id'], row['category'], row['status'],
+              row['expense_date'].year, row['expense_date'].month), row['amount'])
+            for row in rows
+        ])
+        http_cache.bump(db.session.connection(), ['expenses'])
+        search_index.reindex(db.session.connection(), ids)
+
+    def _row(self, data):
+        """Convierte y valida un gasto; lanza RowError si no es válido"""
+        if not isinstance(data, dict):
+            raise RowError('Se esperaba un objeto')
+        for field in REQUIRED_FIELDS:
+            if data.get(field) in (None, ''):
+                raise RowError(f'Campo requerido: {field}', field=field)
+
+        try:
+            amount = float(data['amount'])
+        except (TypeError, ValueError):
+            raise RowError('Monto inválido', field='amount')
+        if amount <= 0:
+            raise RowError('El monto debe ser mayor a 0', field='amount')
+
+        category = data['category']
+        if category not in self.categories:
+            raise RowError(f'Categoría desconocida: {category}', field='category')
+        max_amount = self.categories[category]
+        if max_amount is not None and amount > float(max_amount):
+            raise RowError(f'El monto supera el máximo de la categoría ({max_amount:,.0f})', field='amount')
+
+        try:
+            client_id = int(data['client_id'])
+        except (TypeError, ValueError):
+            raise RowError('client_id inválido', field='client_id')
+        client_status = self.clients.get(client_id)
+        if client_status is None:
+            raise RowError('Cliente no encontrado', field='client_id')
+        if client_status == 'rejected':
+            raise RowError('El cliente fue rechazado', field='client_id')
+
+        expense_date = date.today()
+        if data.get('expense_date'):
+            try:
+                expense_date = datetime.fromisoformat(str(data['expense_date'])).date()
+            except ValueError:
+                raise RowError('Fecha inválida (formato YYYY-MM-DD)', field='expense_date')
+
+        try:
+            latitude = float(data['latitude']) if data.get('latitude') is not None else None
+            longitude = float(data['longitude']) if data.get('longitude') is not None else None
+        except (TypeError, ValueError):
+            raise RowError('Coordenadas inválidas', field='latitude')
+
+        now = datetime.utcnow()
+        return {
+            'user_id': self.user.id,
+            'client_id': client_id,
+            'amount': amount,
+            'expense_date': expense_date,
+            'category': category,
+            'reason': str(data['reason']),
+            'receipt_image': str(data['receipt_image']),
+            'latitude': latitude,
+            'longitude': longitude,
+            'address': data.get('address'),
+            'status': 'pending',
+            'created_at': now,
+            'updated_at': now,
+        }
@@ -0,0 +1,194 @@
+"""
+Mantenimiento de la jerarquía de supervisión (tabla de clausura)
+
+user_hierarchy guarda todos los pares (ancestro, descendiente) de la cadena
+User.supervisor_id, de modo que "todos los subordinados de X, directos o
+indirectos" es una sola subconsulta indexada en lugar de una lista de IDs
+armada en Python. La tabla se actualiza en el mismo flush que crea, elimina
+o cambia el supervisor de un usuario.
+"""
+from sqlalchemy import event, inspect, select, insert, delete, func, literal, or_, true
+from sqlalchemy.orm import aliased
+from extensions import db
+from models.user import User, UserHierarchy
+from utils.exceptions import ValidationError
+
+
+# Límite de profundidad al reconstruir (protege contra ciclos en datos antiguos)
+MAX_DEPTH = 32
+
+_PENDING_KEY = 'hierarchy_changes'
+
+
+def subordinate_ids(user_id, include_self=False):
+    """Subconsulta con los IDs de los subordinados directos e indirectos"""
+    H = UserHierarchy
+    query = select(H.descendant_id).where(H.ancestor_id == user_id)
+    if not include_self:
+        query = query.where(H.depth > 0)
+    return query
+
+
+def _collect_changes(session, flush_context, instances):
+    """before_flush: usuarios nuevos, eliminados o con otro supervisor"""
+    changes = session.info.setdefault(_PENDING_KEY, {'new': [], 'moved': [], 'deleted': []})
+
+    for obj in session.new:
+        if isinstance(obj, User):
+            changes['new'].append(obj)
+
+    for obj in session.dirty:
+        if isinstance(obj, User) and (
+            inspect(obj).attrs.supervisor_id.history.has_changes()
+            or inspect(obj).attrs.supervisor.history.has_changes()
+        ):
+            changes['moved'].append(obj)
+
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            changes['deleted'].append(obj.id)
+
+
+def _supervisor_target(user):
+    """Supervisor que tendrá el usuario después del flush (por supervisor_id o por la relación)"""
+    state = inspect(user)
+    if state.attrs.supervisor.history.has_changes():
+        return user.supervisor.id if user.supervisor is not None else None
+    return user.supervisor_id
+
+
+def _check_cycles(session, flush_context, instances):
+    """
+    before_flush (antes que los demás listeners): rechaza un cambio de
+    supervisor que deje a un usuario bajo sí mismo. Se valida antes de
+    ejecutar SQL, así la sesión sigue usable después del error.
+
+    Raises:
+        ValidationError: Si el nuevo supervisor es el propio usuario o uno de sus subordinados
+    """
+    targets = {
+        obj.id: _supervisor_target(obj) for obj in session.dirty
+        if isinstance(obj, User) and obj.id is not None and (
+            inspect(obj).attrs.supervisor_id.history.has_changes()
+            or inspect(obj).attrs.supervisor.history.has_changes()
+        )
+    }
+    if not targets:
+        return
+
+    connection = session.connection()
+    for user_id, supervisor_id in targets.items():
+        # Subir por la cadena de supervisores (con los cambios pendientes de este flush)
+        current, depth = supervisor_id, 0
+        while current is not None and depth <= MAX_DEPTH:
+            if current == user_id:
+                raise ValidationError('El supervisor no puede ser el propio usuario ni uno de sus subordinados',
+                                      field='supervisor_id')
+            if current in targets:
+                current = targets[current]
+            else:
+                current = connection.execute(select(User.supervisor_id).where(User.id == current)).scalar()
+            depth += 1
+
+
+def _insert_user(connection, user_id, supervisor_id):
+    """Fila propia + una fila por cada ancestro del supervisor"""
+    H = UserHierarchy
+    connection.execute(insert(H).values(ancestor_id=user_id, descendant_id=user_id, depth=0))
+    if supervisor_id is not None:
+        connection.execute(insert(H).from_select(
+            ['ancestor_id', 'descendant_id', 'depth'],
+            select(H.ancestor_id, literal(user_id), H.depth + 1).where(H.descendant_id == supervisor_id)
+        ))
+
+
+def _move_subtree(connection, user_id, supervisor_id):
+    """Cuelga el subárbol de user_id bajo supervisor_id (None: sin supervisor; ciclos ya rechazados)"""
+    H = UserHierarchy
+    subtree = select(H.descendant_id).where(H.ancestor_id == user_id)
+    old_ancestors = select(H.ancestor_id).where(H.descendant_id == user_id, H.depth > 0)
+    connection.execute(delete(H).where(
+        H.descendant_id.in_(subtree),
+        H.ancestor_id.in_(old_ancestors)
+    ))
+
+    if supervisor_id is not None:
+        above = aliased(H)
+        below = aliased(H)
+        connection.execute(insert(H).from_select(
+            ['ancestor_id', 'descendant_id', 'depth'],
+            # Producto cruzado: ancestros del supervisor × subárbol del usuario
+            select(above.ancestor_id, below.descendant_id, above.depth + below.depth + 1)
+            .select_from(above).join(below, true())
+            .where(above.descendant_id == supervisor_id, below.ancestor_id == user_id)
+        ))
+
+
+def _apply_changes(session, flush_context):
+    """after_flush: aplica los cambios acumulados sobre la tabla de clausura"""
+    changes = session.info.pop(_PENDING_KEY, None)
+    if not changes or not any(changes.values()):
+        return
+
+    connection = session.connection()
+    H = UserHierarchy
+
+    if changes['deleted']:
+        connection.execute(delete(H).where(or_(
+            H.ancestor_id.in_(changes['deleted']),
+            H.descendant_id.in_(changes['deleted'])
+        )))
+
+    # Usuarios nuevos: primero los que no dependen de otro usuario nuevo
+    pending = list(changes['new'])
+    while pending:
+        pending_ids = {user.id for user in pending}
+        ready = [user for user in pending if user.supervisor_id not in pending_ids] or pending
+        for user in ready:
+            _insert_user(connection, user.id, user.supervisor_id)
+        pending = [user for user in pending if user not in ready]
+
+    for user in changes['moved']:
+        _move_subtree(connection, user.id, user.supervisor_id)
+
+
+def rebuild_hierarchy():
+    """
+    Reconstruye la tabla de clausura desde users.supervisor_id con una sola
+    consulta recursiva. Retorna la cantidad de filas generadas.
+    """
+    H = UserHierarchy
+    tree = select(
+        User.id.label('ancestor_id'),
+        User.id.label('descendant_id'),
+        literal(0).label('depth')
+    ).cte('tree', recursive=True)
+    child = aliased(User)
+    tree = tree.union_all(
+        select(tree.c.ancestor_id, child.id, tree.c.depth + 1)
+        .join(child, child.supervisor_id == tree.c.descendant_id)
+        .where(tree.c.depth < MAX_DEPTH)
+    )
+
+    db.session.execute(delete(H))
+    # min(depth): un ciclo en los datos no genera pares duplicados
+    db.session.execute(insert(H).from_select(
+        ['ancestor_id', 'descendant_id', 'depth'],
+        select(tree.c.ancestor_id, tree.c.descendant_id, func.min(tree.c.depth))
+        .group_by(tree.c.ancestor_id, tree.c.descendant_id)
+    ))
+    db.session.commit()
+
+    return db.session.query(H).count()
+
+
+def init_app(app):
+    """Registrar listeners de sesión (una sola vez por proceso)"""
+    if event.contains(db.session, 'before_flush', _collect_changes):
+        return
+
+    # insert=True: si hay un ciclo, el error llega antes de que otros
+    # listeners registren cambios pendientes de este flush
+    event.listen(db.session, 'before_flush', _check_cycles, insert=True)
+    event.listen(db.session, 'before_flush', _collect_changes)
+    event.listen(db.session, 'after_flush', _apply_changes)
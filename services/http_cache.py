@@ -0,0 +1,157 @@
+"""
+Validación HTTP (ETag / Last-Modified) para lecturas de la API
+
+Los clientes que consultan periódicamente (la app móvil) reenvían el ETag
+recibido en If-None-Match; si nada cambió se responde 304 sin cargar ni
+serializar los datos. Los ETags se arman con datos baratos de consultar:
+
+- Un registro: su updated_at (más las versiones de las tablas de las que
+  toma nombres, p. ej. usuario y cliente de un gasto).
+- Un listado o agregado: la versión de cada tabla involucrada.
+
+Las versiones viven en la tabla table_versions (no en el caché del proceso),
+así todos los workers generan el mismo ETag. Se incrementan en el mismo
+flush que modifica una tabla de TRACKED_TABLES; las escrituras masivas con
+Core (sin pasar por la sesión) deben llamar a bump() explícitamente.
+
+Los cambios que solo tocan columnas de IGNORED_COLUMNS no incrementan la
+versión: no aparecen en listados ni agregados (el ETag de un registro ya
+cambia con su updated_at). Así el worker OCR o el backfill, que escriben
+ocr_data continuamente, no invalidan todos los ETags ni el caché de gráficos.
+"""
+import hashlib
+from datetime import datetime
+from flask import current_app, request
+from sqlalchemy import event, func, inspect, select
+from extensions import db
+from models.table_version import TableVersion
+from utils.upsert import insert_for
+
+
+TRACKED_TABLES = ('expenses', 'clients', 'expense_categories', 'users')
+
+# Columnas que no afectan las representaciones versionadas por tabla
+IGNORED_COLUMNS = {
+    'expenses': frozenset(('ocr_data', 'updated_at', 'receipt_image', 'receipt_sha256')),
+    'users': frozenset(('last_login', 'password_hash')),
+}
+
+_PENDING_KEY = 'table_version_changes'
+
+
+def stamp_columns(*tables):
+    """
+    Columnas (versión, última modificación) del conjunto de tablas, como
+    subconsultas escalares para agregarlas a otra consulta. La suma de
+    versiones cambia con cada cambio en cualquiera de las tablas.
+    """
+    where = TableVersion.name.in_(tables)
+    return (
+        select(func.coalesce(func.sum(TableVersion.version), 0)).where(where).scalar_subquery().label('tables_version'),
+        select(func.max(TableVersion.updated_at)).where(where).scalar_subquery().label('tables_updated_at'),
+    )
+
+
+def stamp(*tables):
+    """(versión, última modificación) del conjunto de tablas en una consulta"""
+    return tuple(db.session.execute(select(*stamp_columns(*tables))).one())
+
+
+def bump(connection, tables):
+    """
+    Incrementa la versión de las tablas (dentro de la transacción actual).
+
+    Es un upsert: la primera escritura en una tabla crea su fila sin la carrera
+    de UPDATE seguido de INSERT. La fila de cada tabla queda bloqueada hasta el
+    commit, así que las transacciones que escriben gastos se serializan sobre
+    table_versions('expenses'); la importación masiva la retiene durante toda
+    la importación.
+    """
+    now = datetime.utcnow()
+    for table in tables:
+        statement = insert_for(connection, TableVersion).values(name=table, version=1, updated_at=now)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=['name'],
+            set_={'version': TableVersion.version + 1, 'updated_at': statement.excluded.updated_at},
+        ))
+
+
+def make_etag(*parts):
+    """ETag opaco a partir de valores que cambian cuando cambia la respuesta"""
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:20]
+
+
+def last_modified_of(*values):
+    """El más reciente de los datetimes dados (ignora None)"""
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+
+def set_validators(response, etag, last_modified=None):
+    """ETag, Last-Modified y Cache-Control (el cliente siempre revalida)"""
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def not_modified(etag, last_modified=None):
+    """
+    Respuesta 304 si el cliente ya tiene esta versión, None si no.
+    If-None-Match tiene precedencia sobre If-Modified-Since.
+    """
+    if request.if_none_match:
+        fresh = request.if_none_match.contains_weak(etag)
+    elif last_modified is not None and request.if_modified_since is not None:
+        # HTTP trabaja con segundos; nuestras fechas son UTC sin zona horaria
+        fresh = last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)
+    else:
+        fresh = False
+
+    if not fresh:
+        return None
+    return set_validators(current_app.response_class(status=304), etag, last_modified)
+
+
+def _relevant_change(obj, table):
+    """Si un objeto modificado cambió alguna columna que no está en IGNORED_COLUMNS"""
+    ignored = IGNORED_COLUMNS.get(table, ())
+    return any(
+        attr.history.has_changes() for attr in inspect(obj).attrs if attr.key not in ignored
+    )
+
+
+def _collect_changes(session, flush_context, instances):
+    """before_flush: tablas versionadas que se modifican en este flush"""
+    touched = session.info.setdefault(_PENDING_KEY, set())
+    for obj in list(session.new) + list(session.deleted):
+        table = getattr(obj, '__tablename__', None)
+        if table in TRACKED_TABLES:
+            touched.add(table)
+
+    for obj in session.dirty:
+        table = getattr(obj, '__tablename__', None)
+        if table in TRACKED_TABLES and table not in touched and _relevant_change(obj, table):
+            touched.add(table)
+
+
+def _apply_changes(session, flush_context):
+    touched = session.info.pop(_PENDING_KEY, None)
+    if touched:
+        bump(session.connection(), sorted(touched))
+
+
+def _after_rollback(session, previous_transaction):
+    session.info.pop(_PENDING_KEY, None)
+
+
+def init_app(app):
+    """Registrar listeners de sesión (una sola vez por proceso)"""
+    if event.contains(db.session, 'before_flush', _collect_changes):
+        return
+
+    event.listen(db.session, 'before_flush', _collect_changes)
+    event.listen(db.session, 'after_flush', _apply_changes)
+    event.listen(db.session, 'after_soft_rollback', _after_rollback)
@@ -0,0 +1,64 @@
+"""
+Solicitudes idempotentes (encabezado Idempotency-Key)
+
+El cliente envía una clave única por operación. La respuesta se guarda junto
+con el hash del cuerpo en la misma transacción que la operación; un reintento
+con la misma clave recibe esa respuesta sin volver a ejecutarla.
+"""
+from datetime import datetime
+from flask import current_app, jsonify, request
+from extensions import db
+from models.idempotency import IdempotencyKey
+from utils.exceptions import ValidationError
+
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def request_key():
+    """
+    Clave enviada en el request (None si no viene).
+
+    Raises:
+        ValidationError: Si la clave es demasiado larga
+    """
+    key = (request.headers.get(HEADER) or '').strip()
+    if not key:
+        return None
+    if len(key) > MAX_KEY_LENGTH:
+        raise ValidationError(f'{HEADER} no puede superar {MAX_KEY_LENGTH} caracteres', field=HEADER)
+    return key
+
+
+def find_saved(user_id, key):
+    """Respuesta guardada para la clave (las vencidas se descartan)"""
+    saved = IdempotencyKey.query.filter_by(user_id=user_id, key=key).first()
+    if saved is None:
+        return None
+
+    ttl = current_app.config.get('IDEMPOTENCY_KEY_TTL')
+    if ttl and saved.created_at < datetime.utcnow() - ttl:
+        db.session.delete(saved)
+        db.session.flush()
+        return None
+    return saved
+
+
+def remember(user_id, key, request_hash, response, status_code):
+    """Guarda la respuesta (se confirma junto con la operación)"""
+    db.session.add(IdempotencyKey(
+        user_id=user_id,
+        key=key,
+        endpoint=request.endpoint,
+        request_hash=request_hash,
+        status_code=status_code,
+        response=response
+    ))
+
+
+def replay(saved):
+    """Respuesta HTTP a partir de la guardada"""
+    response = jsonify(saved.response)
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response, saved.status_code
@@ -0,0 +1,150 @@
+"""
+Preprocesamiento de imágenes de boletas antes del OCR
+
+Las fotos de teléfono (~12 MP) son lentas para Tesseract y el fondo, la
+rotación y la iluminación reducen la precisión. Este módulo normaliza la imagen
+con Pillow: rotación según EXIF, escala de grises, recorte de la boleta,
+reducción a la resolución objetivo y binarización.
+"""
+from PIL import Image, ImageOps
+
+
+DEFAULT_OPTIONS = {
+    'enabled': True,
+    'exif_transpose': True,
+    'grayscale': True,
+    'crop': True,
+    'target_dpi': 300,
+    'receipt_width_mm': 80,   # Ancho típico de una boleta térmica
+    'binarize': True,
+    'threshold': None,        # None = umbral automático (Otsu)
+}
+
+# Tamaño de la miniatura usada para detectar el área de la boleta
+_DETECTION_SIZE = 512
+# Un recorte menor a esta fracción del área se considera una detección fallida
+_MIN_CROP_FRACTION = 0.15
+_CROP_MARGIN = 0.02
+
+
+def resolve_options(options=None):
+    """Combina las opciones entregadas con los valores por defecto"""
+    resolved = dict(DEFAULT_OPTIONS)
+    if options:
+        resolved.update(options)
+    return resolved
+
+
+def otsu_threshold(image):
+    """Umbral de Otsu a partir del histograma de una imagen en escala de grises"""
+    histogram = image.histogram()[:256]
+    total = sum(histogram)
+    if not total:
+        return 128
+
+    sum_all = sum(i * count for i, count in enumerate(histogram))
+    sum_background = 0
+    weight_background = 0
+    best_threshold, best_variance = 0, 0.0
+
+    for level, count in enumerate(histogram):
+        weight_background += count
+        if weight_background == 0:
+            continue
+        weight_foreground = total - weight_background
+        if weight_foreground == 0:
+            break
+        sum_background += level * count
+        mean_background = sum_background / weight_background
+        mean_foreground = (sum_all - sum_background) / weight_foreground
+        variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = level, variance
+
+    return best_threshold
+
+
+def detect_receipt_box(image):
+    """
+    Detecta el área clara (papel) sobre un fondo más oscuro.
+    Trabaja sobre una miniatura y retorna la caja en coordenadas de la imagen
+    original, o None si no se encontró un recorte confiable.
+    """
+    small = image.copy()
+    small.thumbnail((_DETECTION_SIZE, _DETECTION_SIZE))
+    threshold = otsu_threshold(small)
+    mask = small.point([255 if level > threshold else 0 for level in range(256)])
+    box = mask.getbbox()
+    if not box:
+        return None
+
+    left, top, right, bottom = box
+    if (right - left) * (bottom - top) < _MIN_CROP_FRACTION * small.width * small.height:
+        return None
+
+    scale_x = image.width / small.width
+    scale_y = image.height / small.height
+    margin_x = int(image.width * _CROP_MARGIN)
+    margin_y = int(image.height * _CROP_MARGIN)
+    return (
+        max(0, int(left * scale_x) - margin_x),
+        max(0, int(top * scale_y) - margin_y),
+        min(image.width, int(right * scale_x) + margin_x),
+        min(image.height, int(bottom * scale_y) + margin_y),
+    )
+
+
+def target_width(options):
+    """Ancho en píxeles de la boleta a la resolución objetivo"""
+    return int(options['receipt_width_mm'] / 25.4 * options['target_dpi'])
+
+
+def downscale(image, options):
+    """Reduce la imagen para que la boleta quede a la resolución objetivo"""
+    width = target_width(options)
+    if image.width <= width:
+        return image
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def binarize(image, threshold=None):
+    """Convierte a blanco y negro con un umbral fijo o automático"""
+    if threshold is None:
+        threshold = otsu_threshold(image)
+    return image.point([255 if level > threshold else 0 for level in range(256)])
+
+
+def preprocess_image(image, options=None):
+    """
+    Aplica el pipeline configurado a una imagen PIL.
+    Retorna una nueva imagen lista para Tesseract.
+    """
+    options = resolve_options(options)
+    if not options['enabled']:
+        return image
+
+    # Un JPEG puede decodificarse directamente a escala reducida (1/2, 1/4,
+    # 1/8). Se deja holgura para que la boleta siga sobre el ancho objetivo
+    # después del recorte.
+    if image.format == 'JPEG':
+        size = target_width(options) * (2 if options['crop'] else 1)
+        image.draft('L' if options['grayscale'] else 'RGB', (size, size))
+
+    if options['exif_transpose']:
+        image = ImageOps.exif_transpose(image)
+
+    if options['grayscale'] or options['binarize'] or options['crop']:
+        image = image.convert('L')
+
+    if options['crop']:
+        box = detect_receipt_box(image)
+        if box:
+            image = image.crop(box)
+
+    image = downscale(image, options)
+
+    if options['binarize']:
+        image = binarize(image, options['threshold'])
+
+    return image
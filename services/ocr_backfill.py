@@ -0,0 +1,201 @@
+"""
+Reprocesamiento masivo de recibos (flask ocr backfill)
+
+Recorre los gastos sin ocr_data o con un resultado de una versión anterior del
+extractor (OCR_VERSION), en páginas por id (keyset), procesa cada página en un
+pool de procesos y confirma los resultados con un UPDATE masivo por página.
+
+Como los gastos ya procesados dejan de ser candidatos, una ejecución
+interrumpida puede relanzarse sin perder trabajo; el checkpoint (último id
+confirmado) permite además saltar directamente a donde se quedó.
+"""
+import os
+import time
+from datetime import datetime
+from multiprocessing import Pool
+from flask import current_app
+from sqlalchemy import bindparam, func, or_, update
+from extensions import db, storage
+from models.expense import Expense
+from models.receipt import ReceiptBlob
+from services import search_index
+from services.ocr_queue import ocr_task_options, run_ocr_task
+from services.ocr_service import OCR_VERSION
+
+
+def _version_column(column):
+    return func.coalesce(column['version'].as_integer(), 0)
+
+
+def backfill_filter(retry_failed=False):
+    """Condición SQL de los gastos que necesitan (re)procesarse"""
+    conditions = [_version_column(Expense.ocr_data) < OCR_VERSION]
+    if retry_failed:
+        conditions.append(Expense.ocr_data['success'].as_boolean().is_not(True))
+    return (Expense.receipt_image.is_not(None)) & (Expense.receipt_image != '') & or_(*conditions)
+
+
+def count_candidates(start_after=0, retry_failed=False):
+    """Cantidad de gastos pendientes de procesar"""
+    return db.session.query(func.count(Expense.id)).filter(
+        backfill_filter(retry_failed), Expense.id > start_after
+    ).scalar()
+
+
+def next_page(after_id, size, retry_failed=False):
+    """
+    Siguiente página de candidatos con id > after_id.
+    Retorna lista de (expense_id, receipt_image, sha256, resultado_en_caché)
+    donde el caché solo se usa si es de la versión actual.
+    """
+    rows = db.session.query(
+        Expense.id, Expense.receipt_image, Expense.receipt_sha256, ReceiptBlob.ocr_result
+    ).outerjoin(
+        ReceiptBlob, ReceiptBlob.sha256 == Expense.receipt_sha256
+    ).filter(
+        backfill_filter(retry_failed), Expense.id > after_id
+    ).order_by(Expense.id).limit(size).all()
+
+    return [
+        (expense_id, filename, sha256,
+         cached if cached and cached.get('version') == OCR_VERSION else None)
+        for expense_id, filename, sha256, cached in rows
+    ]
+
+
+def save_results(results):
+    """
+    Escribe una página de resultados con UPDATE masivos (executemany)
+    y actualiza el caché por contenido con los resultados exitosos.
+
+    Args:
+        results: lista de (expense_id, sha256, ocr_result)
+    """
+    if not results:
+        return
+
+    # updated_at explícito: cambia el ETag de GET /api/v1/expenses/<id>
+    now = datetime.utcnow()
+    db.session.execute(
+        update(Expense),
+        [{'id': expense_id, 'ocr_data': ocr_result, 'updated_at': now} for expense_id, _, ocr_result in results]
+    )
+
+    # El texto OCR forma parte del índice de búsqueda
+    search_index.reindex(db.session.connection(), [expense_id for expense_id, _, _ in results])
+
+    cached = {sha256: ocr_result for _, sha256, ocr_result in results if sha256 and ocr_result.get('success')}
+    if cached:
+        db.session.execute(
+            ReceiptBlob.__table__.update().where(
+                ReceiptBlob.sha256 == bindparam('b_sha256')
+            ).values(ocr_result=bindparam('b_ocr_result')),
+            [{'b_sha256': sha256, 'b_ocr_result': result} for sha256, result in cached.items()]
+        )
+
+
+def read_checkpoint(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            content = f.read().strip()
+        return int(content) if content else 0
+    return 0
+
+
+def write_checkpoint(path, last_id):
+    if not path:
+        return
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w') as f:
+        f.write(str(last_id))
+    os.replace(temp_path, path)
+
+
+def _format_eta(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours:d}:{minutes:02d}:{seconds:02d}'
+
+
+def run_backfill(processes=None, batch_size=200, start_after=None, checkpoint=None,
+                 limit=None, retry_failed=False, log=print):
+    """
+    Procesa los recibos pendientes (requiere contexto de aplicación).
+
+    Args:
+        processes: Procesos del pool (default: OCR_WORKER_PROCESSES)
+        batch_size: Gastos por página; cada página se confirma en un commit
+        start_after: Id desde el cual continuar (default: el del checkpoint)
+        checkpoint: Archivo donde se guarda el último id confirmado
+        limit: Máximo de gastos a procesar
+        retry_failed: Incluir resultados de la versión actual sin éxito
+        log: Función para reportar progreso
+
+    Returns:
+        dict: processed, failed, cached, last_id
+    """
+    config = current_app.config
+    processes = processes or config.get('OCR_WORKER_PROCESSES', 2)
+    options = ocr_task_options()
+    storage_spec = storage.spec()
+    last_id = start_after if start_after is not None else read_checkpoint(checkpoint)
+
+    total = count_candidates(last_id, retry_failed)
+    if limit:
+        total = min(total, limit)
+    log(f'{total} gasto(s) por procesar (desde id > {last_id}) con {processes} proceso(s)')
+
+    stats = {'processed': 0, 'failed': 0, 'cached': 0, 'last_id': last_id}
+    started = time.perf_counter()
+
+    with Pool(processes=processes) as pool:
+        while stats['processed'] < total:
+            size = min(batch_size, total - stats['processed'])
+            page = next_page(last_id, size, retry_failed)
+            if not page:
+                break
+
+            results = []
+            tasks = []
+            # Gastos con el mismo recibo dentro de la página se procesan una vez
+            owners = {}
+            sharing = {}
+            for expense_id, filename, sha256, cached in page:
+                if cached:
+                    results.append((expense_id, sha256, cached))
+                    stats['cached'] += 1
+                elif sha256 and sha256 in owners:
+                    sharing[owners[sha256]].append(expense_id)
+                    stats['cached'] += 1
+                else:
+                    if sha256:
+                        owners[sha256] = expense_id
+                    sharing[expense_id] = [expense_id]
+                    tasks.append((expense_id, filename, options, storage_spec))
+
+            hashes = {expense_id: sha256 for expense_id, _, sha256, _ in page}
+            chunksize = max(1, len(tasks) // (processes * 4))
+            for task_id, ocr_result, error in pool.imap_unordered(run_ocr_task, tasks, chunksize):
+                if error:
+                    ocr_result = {'success': False, 'error': error, 'version': OCR_VERSION}
+                if not ocr_result.get('success'):
+                    stats['failed'] += 1
+                for expense_id in sharing[task_id]:
+                    results.append((expense_id, hashes[expense_id], ocr_result))
+
+            save_results(results)
+            db.session.commit()
+
+            last_id = page[-1][0]
+            write_checkpoint(checkpoint, last_id)
+            stats['processed'] += len(page)
+            stats['last_id'] = last_id
+
+            elapsed = time.perf_counter() - started
+            rate = stats['processed'] / elapsed if elapsed else 0
+            eta = (total - stats['processed']) / rate if rate else 0
+            log(f'{stats["processed"]}/{total} ({stats["processed"] / total:.1%}) '
+                f'{rate:.1f} img/s, ETA {_format_eta(eta)}, '
+                f'fallidos {stats["failed"]}, caché {stats["cached"]}, último id {last_id}')
+
+    return stats
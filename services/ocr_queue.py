@@ -0,0 +1,216 @@
+"""
+Cola de trabajos OCR respaldada en base de datos
+
+El request de subida solo guarda el archivo y encola un OCRJob. Un proceso
+worker (flask ocr worker) reclama trabajos de la tabla y ejecuta
+process_receipt en un pool de procesos, escribiendo el resultado en
+Expense.ocr_data. En la misma tarea se generan las versiones reducidas del
+recibo (services.receipt_images).
+
+Cada tarea lleva el nombre del recibo y storage.spec(): el proceso del pool
+obtiene una copia local desde el almacenamiento configurado, así el worker
+puede correr en un nodo distinto al que recibió la subida.
+"""
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+from flask import current_app
+from sqlalchemy import update
+from extensions import db, storage
+from models.expense import Expense
+from models.job import OCRJob
+from models.receipt import ReceiptBlob
+from services.ocr_service import process_receipt
+from services.receipt_extractor import load_category_keywords
+from services.receipt_images import generate_variants, record_variants
+from services.receipt_store import cache_ocr_result
+from utils.storage import build_backend
+
+
+def enqueue_ocr_job(expense):
+    """
+    Encola el procesamiento OCR del recibo de un gasto.
+    No hace commit: el trabajo se confirma junto con el gasto.
+    """
+    job = OCRJob(expense=expense, status='queued')
+    db.session.add(job)
+    return job
+
+
+def latest_ocr_job(expense_id):
+    """Último trabajo OCR de un gasto (o None)"""
+    return OCRJob.query.filter_by(expense_id=expense_id).order_by(OCRJob.id.desc()).first()
+
+
+def claim_jobs(limit, worker_id):
+    """
+    Reclama hasta `limit` trabajos en cola de forma atómica.
+    Un UPDATE condicionado a status='queued' garantiza que dos workers no
+    procesen el mismo trabajo. Los recibos cuyo contenido ya fue procesado se
+    completan desde el caché sin pasar por Tesseract.
+    Retorna lista de (job_id, nombre_recibo) a procesar.
+    """
+    candidates = db.session.query(OCRJob.id, Expense.receipt_image, ReceiptBlob.ocr_result).join(
+        Expense, Expense.id == OCRJob.expense_id
+    ).outerjoin(
+        ReceiptBlob, ReceiptBlob.sha256 == Expense.receipt_sha256
+    ).filter(OCRJob.status == 'queued').order_by(OCRJob.id).limit(limit).all()
+
+    claimed = []
+    for job_id, filename, cached_result in candidates:
+        result = db.session.execute(
+            update(OCRJob).where(OCRJob.id == job_id, OCRJob.status == 'queued').values(
+                status='running',
+                worker=worker_id,
+                started_at=datetime.utcnow(),
+                attempts=OCRJob.attempts + 1
+            )
+        )
+        if result.rowcount != 1:
+            continue
+        if cached_result:
+            complete_job(job_id, cached_result)
+        else:
+            claimed.append((job_id, filename))
+
+    db.session.commit()
+    return claimed
+
+
+def requeue_stale_jobs(timeout_seconds, max_attempts):
+    """Devuelve a la cola trabajos 'running' abandonados por un worker caído"""
+    cutoff = datetime.utcnow() - timedelta(seconds=timeout_seconds)
+    stale = (OCRJob.status == 'running') & (OCRJob.started_at < cutoff)
+
+    db.session.execute(
+        update(OCRJob).where(stale, OCRJob.attempts >= max_attempts).values(
+            status='failed', error='Tiempo de procesamiento agotado', finished_at=datetime.utcnow()
+        )
+    )
+    result = db.session.execute(
+        update(OCRJob).where(stale).values(status='queued', worker=None)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def complete_job(job_id, ocr_result, variants=None):
+    """Guarda el resultado OCR (y las versiones generadas) y marca el trabajo como terminado"""
+    job = db.session.get(OCRJob, job_id)
+    job.expense.ocr_data = ocr_result
+    if ocr_result.get('success'):
+        cache_ocr_result(job.expense.receipt_sha256, ocr_result)
+    record_variants(job.expense.receipt_sha256, variants)
+    job.status = 'done'
+    job.error = None
+    job.finished_at = datetime.utcnow()
+
+
+def fail_job(job_id, error, max_attempts):
+    """Registra un error; reintenta mientras no se agoten los intentos"""
+    job = db.session.get(OCRJob, job_id)
+    job.error = error
+    if job.attempts >= max_attempts:
+        job.status = 'failed'
+        job.finished_at = datetime.utcnow()
+    else:
+        job.status = 'queued'
+        job.worker = None
+
+
+def ocr_task_options():
+    """
+    Opciones de process_receipt que se envían con cada tarea al pool
+    (los procesos del pool no tienen contexto de aplicación ni base de datos)
+    """
+    return {
+        'preprocessing': current_app.config.get('OCR_PREPROCESSING'),
+        'category_keywords': load_category_keywords(),
+    }
+
+
+def _run_task(task, with_variants):
+    # Ejecutado en los procesos del pool: no accede a la base de datos
+    job_id, name, options, storage_spec = task
+    backend = build_backend(storage_spec)
+    variants = None
+    try:
+        with backend.local_copy(name) as image_path:
+            ocr_result = process_receipt(image_path, **options)
+            if with_variants:
+                # Un error en las versiones no hace fallar el OCR (se regeneran al servirlas)
+                try:
+                    variants = generate_variants(image_path, backend, name)
+                except Exception:
+                    variants = None
+    except Exception as e:
+        return job_id, None, None, str(e)
+    return job_id, ocr_result, variants, None
+
+
+def run_ocr_task(task):
+    """Tarea (job_id, nombre, opciones, storage_spec) -> (job_id, resultado, error)"""
+    job_id, ocr_result, _, error = _run_task(task, with_variants=False)
+    return job_id, ocr_result, error
+
+
+def run_receipt_task(task):
+    """Tarea del worker: OCR más versiones reducidas del recibo (una sola descarga)"""
+    return _run_task(task, with_variants=True)
+
+
+def process_batch(pool, tasks, max_attempts):
+    """Ejecuta un lote de trabajos en el pool y confirma los resultados"""
+    processed = 0
+    for job_id, ocr_result, variants, error in pool.imap_unordered(run_receipt_task, tasks):
+        if error:
+            fail_job(job_id, error, max_attempts)
+        else:
+            complete_job(job_id, ocr_result, variants)
+        processed += 1
+    db.session.commit()
+    return processed
+
+
+def run_worker(processes=None, poll_interval=None, once=False, log=print):
+    """
+    Loop principal del worker OCR (requiere contexto de aplicación).
+
+    Args:
+        processes: Procesos del pool (default: OCR_WORKER_PROCESSES)
+        poll_interval: Segundos de espera cuando la cola está vacía
+        once: Procesar lo que haya en cola y terminar
+        log: Función para reportar progreso
+    """
+    config = current_app.config
+    processes = processes or config.get('OCR_WORKER_PROCESSES', 2)
+    poll_interval = poll_interval if poll_interval is not None else config.get('OCR_POLL_INTERVAL', 2)
+    max_attempts = config.get('OCR_MAX_ATTEMPTS', 3)
+    timeout = config.get('OCR_JOB_TIMEOUT', 300)
+    worker_id = f'{socket.gethostname()}:{os.getpid()}'
+
+    total = 0
+    with Pool(processes=processes) as pool:
+        while True:
+            requeue_stale_jobs(timeout, max_attempts)
+            options = ocr_task_options()
+            storage_spec = storage.spec()
+            tasks = [
+                (job_id, name, options, storage_spec)
+                for job_id, name in claim_jobs(processes * 4, worker_id)
+            ]
+
+            if not tasks:
+                if once:
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            started = time.perf_counter()
+            processed = process_batch(pool, tasks, max_attempts)
+            total += processed
+            log(f'{processed} trabajo(s) OCR procesados en {time.perf_counter() - started:.2f}s')
+
+    return total
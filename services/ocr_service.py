@@ -5,15 +5,30 @@ import re
 from PIL import Image
 import pytesseract
 from datetime import datetime
+from services.image_preprocessing import preprocess_image, resolve_options
+from services.receipt_extractor import extract_fields
 
 
-def extract_text_from_image(image_path):
+# Versión del extractor. Incrementar al cambiar el preprocesamiento o los
+# patrones para que `flask ocr backfill` reprocese los resultados antiguos.
+OCR_VERSION = 2
+
+
+def extract_text_from_image(image_path, preprocessing=None):
     """
     Extrae texto de una imagen usando Tesseract OCR
+
+    Args:
+        image_path: Ruta de la imagen
+        preprocessing: Opciones del preprocesamiento (ver OCR_PREPROCESSING);
+            None usa los valores por defecto
     """
     try:
-        image = Image.open(image_path)
-        text = pytesseract.image_to_string(image, lang='spa')
+        options = resolve_options(preprocessing)
+        with Image.open(image_path) as image:
+            image = preprocess_image(image, options)
+            config = f"--dpi {options['target_dpi']}" if options['enabled'] else ''
+            text = pytesseract.image_to_string(image, lang='spa', config=config)
         return text
     except Exception as e:
         print(f"Error al procesar imagen con OCR: {str(e)}")
@@ -55,8 +70,8 @@ def extract_date(text):
     Formatos: DD/MM/YYYY, DD-MM-YYYY, DD.MM.YYYY
     """
     patterns = [
-        r'(\d{1,2})[/-.](\d{1,2})[/-.](\d{4})',  # DD/MM/YYYY
-        r'(\d{1,2})[/-.](\d{1,2})[/-.](\d{2})',  # DD/MM/YY
+        r'(\d{1,2})[/.-](\d{1,2})[/.-](\d{4})',  # DD/MM/YYYY
+        r'(\d{1,2})[/.-](\d{1,2})[/.-](\d{2})',  # DD/MM/YY
     ]
 
     for pattern in patterns:
@@ -123,12 +138,12 @@ def extract_keywords(text):
     return found_categories
 
 
-def process_receipt(image_path):
+def process_receipt(image_path, preprocessing=None, category_keywords=None):
     """
     Procesa una imagen de boleta y extrae toda la información posible
     Retorna: dict con datos extraídos
     """
-    text = extract_text_from_image(image_path)
+    text = extract_text_from_image(image_path, preprocessing)
 
     if not text:
         return {
@@ -138,13 +153,15 @@ def process_receipt(image_path):
             'date': None,
             'ruts': [],
             'suggested_categories': [],
-            'confidence': 'low'
+            'confidence': 'low',
+            'version': OCR_VERSION
         }
 
-    amounts = extract_amounts(text)
-    date = extract_date(text)
-    ruts = extract_rut(text)
-    categories = extract_keywords(text)
+    fields = extract_fields(text, category_keywords)
+    amounts = fields['amounts']
+    date = fields['date']
+    ruts = fields['ruts']
+    categories = fields['categories']
 
     # Determinar confianza basada en datos encontrados
     confidence = 'low'
@@ -161,5 +178,6 @@ def process_receipt(image_path):
         'date': date,
         'ruts': ruts,
         'suggested_categories': categories,
-        'confidence': confidence
+        'confidence': confidence,
+        'version': OCR_VERSION
     }
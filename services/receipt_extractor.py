@@ -0,0 +1,258 @@
+"""
+Extractor de campos de boletas en una sola pasada
+
+Equivalente a extract_amounts / extract_date / extract_rut / extract_keywords
+de ocr_service, pero el texto se recorre una sola vez:
+
+- Los montos, fechas y RUTs solo pueden aparecer dentro de secuencias de
+  dígitos y separadores (`12.345`, `15/03/2024`, `76.123.456-7`). El texto se
+  tokeniza una vez en esas secuencias y los patrones precompilados se aplican
+  solo sobre cada token, con los mismos resultados que recorrer el texto.
+- Las palabras clave se buscan con un autómata: todas las palabras se
+  compilan en un trie expresado como una única expresión regular.
+
+Los resultados por token se memorizan: en las boletas se repiten mucho
+(`1.990`, `19%`, fechas y RUT del emisor).
+"""
+import re
+from datetime import datetime
+from functools import lru_cache
+
+
+# Todo carácter que puede formar parte de un monto, fecha o RUT
+_TOKEN = re.compile(r'\d[\d.,/\-kK]*')
+
+_AMOUNT_PATTERNS = (
+    re.compile(r'(\d{1,3}(?:\.\d{3})*(?:,\d{2})?)'),  # 12.345 o 12.345,00
+    re.compile(r'(\d{1,3}(?:,\d{3})*(?:\.\d{2})?)'),  # 12,345 o 12,345.00 (formato US)
+)
+_DATE_PATTERNS = (
+    re.compile(r'(\d{1,2})[/.-](\d{1,2})[/.-](\d{4})'),  # DD/MM/YYYY
+    re.compile(r'(\d{1,2})[/.-](\d{1,2})[/.-](\d{2})'),  # DD/MM/YY
+)
+_RUT_PATTERN = re.compile(r'(\d{1,2}\.?\d{3}\.?\d{3}[-]?[0-9kK])')
+_RUT_CLEAN = re.compile(r'[^0-9kK]')
+
+# Largo mínimo de un token que puede contener una fecha (1/1/24) o un RUT
+_MIN_DATE_LENGTH = 6
+_MIN_RUT_LENGTH = 8
+
+DEFAULT_CATEGORY_KEYWORDS = {
+    'Transporte': ['taxi', 'uber', 'cabify', 'bus', 'metro', 'peaje', 'combustible', 'bencina', 'estacionamiento'],
+    'Alimentación': ['restaurant', 'almuerzo', 'cena', 'comida', 'cafe', 'cafetería'],
+    'Hospedaje': ['hotel', 'hostal', 'alojamiento', 'hospedaje'],
+    'Materiales': ['ferretería', 'materiales', 'insumos', 'equipamiento'],
+}
+
+
+def _parse_amount(amount_str):
+    amount_str = amount_str.replace('.', '').replace(',', '.')
+    try:
+        amount = float(amount_str)
+    except ValueError:
+        return None
+    if 0 < amount < 100000000:  # Filtrar montos razonables
+        return amount
+    return None
+
+
+def _parse_date(day, month, year):
+    try:
+        day, month, year = int(day), int(month), int(year)
+        # Ajustar año de 2 dígitos
+        if year < 100:
+            year += 2000 if year < 50 else 1900
+        if 1 <= day <= 31 and 1 <= month <= 12 and 1900 <= year <= 2100:
+            return datetime(year, month, day).strftime('%Y-%m-%d')
+    except ValueError:
+        pass
+    return None
+
+
+class KeywordMatcher:
+    """
+    Autómata de palabras clave → categorías.
+
+    Las palabras se organizan en un trie que se traduce a una expresión
+    regular con un grupo vacío por cada palabra terminal, de modo que una
+    coincidencia informa todas las palabras que terminan en su recorrido
+    (incluso las que son prefijo de otra) en una sola pasada sobre el texto.
+    """
+
+    def __init__(self, category_keywords):
+        self.categories = list(category_keywords)
+        trie = {}
+        for category, keywords in category_keywords.items():
+            for keyword in keywords:
+                keyword = keyword.strip().lower()
+                if not keyword:
+                    continue
+                node = trie
+                for char in keyword:
+                    node = node.setdefault(char, {})
+                node.setdefault(None, set()).add(category)
+
+        self._groups = []
+        # Cada rama de primer nivel consume su primer carácter y el resto se
+        # evalúa con un lookahead: el motor de `re` puede saltar directamente
+        # a las posiciones que empiezan con una letra de alguna palabra, y al
+        # consumir un solo carácter no se pierden coincidencias superpuestas.
+        branches = []
+        for char, child in trie.items():
+            suffix = self._terminal_group(child)
+            rest = self._compile_node(child)
+            if rest:
+                rest = f'(?=(?:{rest}))' + ('?' if suffix else '')
+            branches.append(re.escape(char) + suffix + rest)
+        self._pattern = re.compile('|'.join(branches)) if branches else None
+
+    def _terminal_group(self, node):
+        """Grupo vacío que marca una palabra terminada en este nodo"""
+        if None not in node:
+            return ''
+        self._groups.append(frozenset(node[None]))
+        return '()'
+
+    def _compile_node(self, node):
+        branches = []
+        for char, child in node.items():
+            if char is None:
+                continue
+            suffix = self._terminal_group(child)
+            rest = self._compile_node(child)
+            if rest:
+                rest = f'(?:{rest})' + ('?' if suffix else '')
+            branches.append(re.escape(char) + suffix + rest)
+        return '|'.join(branches)
+
+    def match(self, text_lower):
+        """Categorías cuyas palabras aparecen en el texto (en minúsculas), en orden de definición"""
+        if not self._pattern:
+            return []
+        found = set()
+        for match in self._pattern.finditer(text_lower):
+            # lastindex es None cuando solo coincidió el primer carácter
+            if match.lastindex is None:
+                continue
+            for index, value in enumerate(match.groups()):
+                if value is not None:
+                    found.update(self._groups[index])
+            if len(found) == len(self.categories):
+                break
+        return [category for category in self.categories if category in found]
+
+
+# Matchers compilados por mapa de palabras clave; el mapa cambia solo al editar
+# categorías, así que unas pocas entradas bastan y la memoria queda acotada
+_MATCHER_CACHE_SIZE = 8
+
+
+@lru_cache(maxsize=_MATCHER_CACHE_SIZE)
+def _compiled_matcher(key):
+    return KeywordMatcher({category: list(keywords) for category, keywords in key})
+
+
+def keyword_matcher(category_keywords=None):
+    """Matcher compilado (y reutilizado) para un mapa de palabras clave"""
+    category_keywords = category_keywords or DEFAULT_CATEGORY_KEYWORDS
+    return _compiled_matcher(tuple((category, tuple(keywords)) for category, keywords in category_keywords.items()))
+
+
+def load_category_keywords():
+    """
+    Palabras clave por categoría: las categorías activas de ExpenseCategory
+    (su nombre más las palabras de `keywords`) sobre el mapa por defecto.
+    Las categorías salen de services.reference_data (en caché, invalidada al
+    confirmar cambios), así consultarlas en cada ciclo del worker no va a la
+    base de datos. Requiere contexto de aplicación.
+    """
+    from services.reference_data import active_categories
+
+    category_keywords = {category: list(words) for category, words in DEFAULT_CATEGORY_KEYWORDS.items()}
+    for category in sorted(active_categories(), key=lambda ref: ref.id):
+        words = category_keywords.setdefault(category.name, [])
+        extra = [category.name.lower()]
+        if category.keywords:
+            extra += [word.strip().lower() for word in category.keywords.split(',')]
+        words.extend(word for word in extra if word and word not in words)
+    return category_keywords
+
+
+# Resultados ya calculados por token: {token: (montos, montos_us, fecha, fecha_aa, ruts)}
+_token_cache = {}
+_TOKEN_CACHE_SIZE = 20000
+
+
+def _scan_token(token):
+    """Aplica los patrones precompilados a un token"""
+    if len(token) < _MIN_RUT_LENGTH and token.isdecimal():
+        # Solo dígitos: ambos patrones de monto lo cortan en grupos de 3
+        # y no puede contener fecha ni RUT
+        amounts = []
+        for start in range(0, len(token), 3):
+            amount = float(token[start:start + 3])
+            if amount > 0:
+                amounts.append(amount)
+        return amounts, amounts, None, None, ()
+
+    amounts, us_amounts = [], []
+    for amount_str in _AMOUNT_PATTERNS[0].findall(token):
+        amount = _parse_amount(amount_str)
+        if amount is not None:
+            amounts.append(amount)
+    for amount_str in _AMOUNT_PATTERNS[1].findall(token):
+        amount = _parse_amount(amount_str)
+        if amount is not None:
+            us_amounts.append(amount)
+
+    dates = [None, None]
+    ruts = []
+    if len(token) >= _MIN_DATE_LENGTH:
+        for index, pattern in enumerate(_DATE_PATTERNS):
+            for groups in pattern.findall(token):
+                dates[index] = _parse_date(*groups)
+                if dates[index]:
+                    break
+
+        if len(token) >= _MIN_RUT_LENGTH:
+            for rut in _RUT_PATTERN.findall(token):
+                if len(_RUT_CLEAN.sub('', rut)) >= 8:
+                    ruts.append(rut)
+
+    return amounts, us_amounts, dates[0], dates[1], ruts
+
+
+def extract_fields(text, category_keywords=None):
+    """
+    Extrae montos, fecha, RUTs y categorías sugeridas en una sola pasada.
+
+    Returns:
+        dict: amounts, date, ruts, categories (mismo orden y valores que los
+        extractores individuales de ocr_service)
+    """
+    amounts, us_amounts, ruts = [], [], []
+    date = us_date = None
+
+    for token in _TOKEN.findall(text):
+        scanned = _token_cache.get(token)
+        if scanned is None:
+            if len(_token_cache) >= _TOKEN_CACHE_SIZE:
+                _token_cache.clear()
+            scanned = _token_cache[token] = _scan_token(token)
+
+        token_amounts, token_us_amounts, token_date, token_us_date, token_ruts = scanned
+        amounts.extend(token_amounts)
+        us_amounts.extend(token_us_amounts)
+        if token_ruts:
+            ruts.extend(token_ruts)
+        if date is None:
+            date = token_date
+        if us_date is None:
+            us_date = token_us_date
+
+    return {
+        'amounts': amounts + us_amounts,
+        'date': date or us_date,
+        'ruts': ruts,
+        'categories': keyword_matcher(category_keywords).match(text.lower()),
+    }
@@ -0,0 +1,124 @@
+"""
+Versiones reducidas de los recibos (miniatura, vista previa y completa)
+
+Las pantallas de aprobación no necesitan el archivo original (varios MB desde
+el celular): se sirven versiones WebP (JPEG si Pillow no soporta WebP) con el
+lado mayor acotado según RECEIPT_VARIANTS.
+
+Las versiones se generan en segundo plano junto con el OCR (el worker ya
+decodifica la imagen) y se registran en ReceiptBlob.variants, así un recibo
+repetido las reutiliza. Si al servir una versión falta (recibos antiguos,
+archivo borrado), se regenera en el momento. Las versiones se guardan en el
+mismo almacenamiento que el original (utils.storage).
+"""
+import os
+import tempfile
+from flask import current_app
+from PIL import Image, ImageOps, features
+from sqlalchemy import select, update
+from extensions import db, storage
+from models.receipt import ReceiptBlob
+from utils.storage import StorageNotFound
+
+
+# Lado mayor en píxeles de cada versión (nunca se amplía la imagen)
+RECEIPT_VARIANTS = {'thumb': 240, 'preview': 1024, 'full': 2048}
+
+QUALITY = 80
+
+
+def variant_format():
+    return 'WEBP' if features.check('webp') else 'JPEG'
+
+
+def variant_name(stored_path, size, fmt=None):
+    """Nombre de una versión junto al original: <sha256>.<size>.webp"""
+    fmt = fmt or variant_format()
+    base = stored_path.rsplit('.', 1)[0] if '.' in os.path.basename(stored_path) else stored_path
+    return f'{base}.{size}.{"webp" if fmt == "WEBP" else "jpg"}'
+
+
+def generate_variants(source_path, backend, stored_path, sizes=None):
+    """
+    Genera las versiones de un recibo con una sola decodificación y las guarda
+    en `backend` (utils.storage). No accede a la base de datos ni al contexto
+    de aplicación (se ejecuta en los procesos del pool OCR).
+
+    Returns:
+        dict: {size: nombre en el almacenamiento}
+    """
+    sizes = sizes or list(RECEIPT_VARIANTS)
+    fmt = variant_format()
+    variants = {}
+
+    with Image.open(source_path) as img:
+        # Decodificar JPEG directamente a una escala reducida cuando alcanza
+        largest = max(RECEIPT_VARIANTS[size] for size in sizes)
+        img.draft('RGB', (largest, largest))
+        img = ImageOps.exif_transpose(img).convert('RGB')
+
+        # De mayor a menor: cada versión se reduce desde la anterior
+        for size in sorted(sizes, key=RECEIPT_VARIANTS.get, reverse=True):
+            max_side = RECEIPT_VARIANTS[size]
+            img.thumbnail((max_side, max_side), Image.LANCZOS)
+            name = variant_name(stored_path, size, fmt)
+            fd, temp_path = tempfile.mkstemp(dir=backend.staging_dir(), prefix='.variant-')
+            with os.fdopen(fd, 'wb') as out:
+                img.save(out, fmt, quality=QUALITY)
+            backend.save_file(name, temp_path)
+            variants[size] = name
+
+    return variants
+
+
+def record_variants(sha256, variants):
+    """Registra las versiones generadas en el índice de contenido (sin commit)"""
+    if sha256 and variants:
+        ReceiptBlob.query.filter_by(sha256=sha256).update({'variants': variants})
+
+
+def _record_variants(sha256, variants):
+    """Registra versiones en el ReceiptBlob en su propia transacción (no confirma la sesión del request)"""
+    with db.engine.begin() as connection:
+        current = connection.execute(
+            select(ReceiptBlob.variants).where(ReceiptBlob.sha256 == sha256)
+        ).scalar_one_or_none()
+        connection.execute(
+            update(ReceiptBlob).where(ReceiptBlob.sha256 == sha256)
+            .values(variants=dict(current or {}, **variants))
+        )
+
+
+def ensure_variant(receipt_image, sha256, size):
+    """
+    Nombre de la versión `size` de un recibo, regenerando las versiones solo
+    si falta el archivo. Retorna None si el original no existe o no se puede
+    decodificar.
+    """
+    backend = storage.backend
+    blob = ReceiptBlob.query.filter_by(sha256=sha256).first() if sha256 else None
+
+    # Los recibos sin hash (legados) no registran sus versiones: el nombre es
+    # determinista y basta con comprobar que el archivo exista
+    name = (blob.variants or {}).get(size) if blob else None
+    if name and backend.exists(name):
+        return name
+    name = variant_name(receipt_image, size)
+    if backend.exists(name):
+        if blob:
+            _record_variants(sha256, {size: name})
+        return name
+
+    try:
+        with backend.local_copy(receipt_image) as source:
+            variants = generate_variants(source, backend, receipt_image)
+    except StorageNotFound:
+        return None
+    except OSError:
+        # Archivo truncado o que no es una imagen (incluye UnidentifiedImageError)
+        current_app.logger.warning(f'No se pudieron generar las versiones de {receipt_image}', exc_info=True)
+        return None
+
+    if blob:
+        _record_variants(sha256, variants)
+    return variants[size]
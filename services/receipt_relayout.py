@@ -0,0 +1,223 @@
+"""
+Migración de recibos al layout por hash (flask receipts relayout)
+
+Dos casos:
+
+- Recibos con ReceiptBlob guardados como <sha256>.<ext> en la raíz: se mueven
+  (junto con sus versiones reducidas) a ab/cd/<sha256>.<ext>.
+- Recibos antiguos sin hash (nombre_YYYYmmdd_HHMMSS_uid.ext): se calcula el
+  SHA-256 leyendo el archivo en streaming, se registran en receipt_blobs y se
+  mueven a su nombre por contenido (junto con las versiones ya generadas con
+  el nombre antiguo). Si el contenido ya existía, el archivo repetido se
+  elimina y el gasto apunta al existente.
+
+Cada lote se confirma en un commit y los gastos se actualizan con UPDATE
+masivos. Los archivos se copian a su nueva clave antes del commit y los
+anteriores se eliminan después: si el proceso se interrumpe, ningún gasto
+queda apuntando a un archivo inexistente. Como los recibos ya migrados dejan
+de ser candidatos y las copias previas se reutilizan, el comando puede
+relanzarse.
+"""
+import hashlib
+from datetime import datetime
+from sqlalchemy import func, update
+from extensions import db, storage
+from models.expense import Expense
+from models.receipt import ReceiptBlob
+from services.receipt_images import RECEIPT_VARIANTS, variant_name
+from services.receipt_store import receipt_key
+from utils.storage import CHUNK_SIZE
+
+
+def _extension(name):
+    extension = name.rsplit('.', 1)[1].lower() if '.' in name else 'bin'
+    return 'jpg' if extension == 'jpeg' else extension
+
+
+def _hash_stored(backend, name):
+    digest = hashlib.sha256()
+    size = 0
+    stream = backend.open(name)
+    try:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    finally:
+        stream.close()
+    return digest.hexdigest(), size
+
+
+def _repoint_expenses(renames):
+    """Actualiza receipt_image (y receipt_sha256) de los gastos: {nombre_anterior: (nombre, sha256)}"""
+    if not renames:
+        return
+    now = datetime.utcnow()
+    for old_name, (new_name, sha256) in renames.items():
+        db.session.execute(
+            update(Expense).where(Expense.receipt_image == old_name)
+            .values(receipt_image=new_name, receipt_sha256=sha256, updated_at=now)
+        )
+    # Sin http_cache.bump: el archivo del recibo no forma parte de listados ni
+    # agregados (IGNORED_COLUMNS) y el ETag de cada gasto cambia con updated_at
+
+
+def _copy_blob(backend, blob, stats, stale):
+    """
+    Copia el recibo y sus versiones a las claves por hash y apunta el blob a
+    ellas; los archivos anteriores se agregan a `stale` para eliminarlos
+    después del commit. Si una copia ya existe (ejecución interrumpida) se
+    reutiliza.
+    """
+    new_path = receipt_key(blob.sha256, _extension(blob.stored_path))
+    if backend.exists(new_path):
+        stats['moved'] += 1
+    elif backend.exists(blob.stored_path):
+        backend.copy(blob.stored_path, new_path)
+        stats['moved'] += 1
+    else:
+        stats['missing'] += 1
+    stale.append(blob.stored_path)
+
+    variants = {}
+    for size, name in (blob.variants or {}).items():
+        new_name = variant_name(new_path, size)
+        if not backend.exists(new_name):
+            if not backend.exists(name):
+                continue
+            backend.copy(name, new_name)
+        variants[size] = new_name
+        if name != new_name:
+            stale.append(name)
+    # Las versiones que faltaban se regeneran al servirlas
+    blob.variants = variants or None
+
+    old_path = blob.stored_path
+    blob.stored_path = new_path
+    return old_path, (new_path, blob.sha256)
+
+
+def _adopt_legacy_variants(backend, name, blob, stale):
+    """
+    Versiones ya generadas con el nombre antiguo (variant_name es determinista):
+    se copian junto al recibo por hash y se registran en el blob, salvo las que
+    el blob ya tenía. Las anteriores se agregan a `stale`.
+    """
+    variants = dict(blob.variants or {})
+    for size in RECEIPT_VARIANTS:
+        old_name = variant_name(name, size)
+        new_name = variant_name(blob.stored_path, size)
+        if old_name == new_name or not backend.exists(old_name):
+            continue
+        if size not in variants:
+            if not backend.exists(new_name):
+                backend.copy(old_name, new_name)
+            variants[size] = new_name
+        stale.append(old_name)
+    if variants != (blob.variants or {}):
+        blob.variants = variants
+
+
+def _delete_stale(backend, names):
+    # Solo después del commit: si el proceso se interrumpe antes, los gastos
+    # siguen apuntando a archivos que existen
+    for name in names:
+        backend.delete(name)
+
+
+def relayout_blobs(batch_size=200, log=print):
+    """Mueve al layout ab/cd/ los recibos con ReceiptBlob; retorna estadísticas"""
+    backend = storage.backend
+    stats = {'moved': 0, 'missing': 0}
+    last_id = 0
+    while True:
+        blobs = ReceiptBlob.query.filter(ReceiptBlob.id > last_id).order_by(ReceiptBlob.id).limit(batch_size).all()
+        if not blobs:
+            break
+        last_id = blobs[-1].id
+
+        stale = []
+        renames = dict(
+            _copy_blob(backend, blob, stats, stale)
+            for blob in blobs if blob.stored_path != receipt_key(blob.sha256, _extension(blob.stored_path))
+        )
+        _repoint_expenses(renames)
+        db.session.commit()
+        _delete_stale(backend, stale)
+        if renames:
+            log(f'{len(renames)} recibo(s) movidos (hasta receipt_blob id {last_id})')
+    return stats
+
+
+def relayout_legacy(batch_size=200, log=print):
+    """Registra por contenido y mueve los recibos sin hash; retorna estadísticas"""
+    backend = storage.backend
+    stats = {'hashed': 0, 'deduplicated': 0, 'missing': 0}
+    last_id = 0
+    while True:
+        page = db.session.query(Expense.id, Expense.receipt_image).filter(
+            Expense.id > last_id,
+            Expense.receipt_sha256.is_(None),
+            Expense.receipt_image.is_not(None),
+            Expense.receipt_image != '',
+        ).order_by(Expense.id).limit(batch_size).all()
+        if not page:
+            break
+        last_id = page[-1].id
+
+        renames = {}
+        stale = []
+        for name in dict.fromkeys(row.receipt_image for row in page):
+            if not backend.exists(name):
+                stats['missing'] += 1
+                continue
+
+            sha256, size = _hash_stored(backend, name)
+            blob = ReceiptBlob.query.filter_by(sha256=sha256).first()
+            if blob and blob.stored_path != name and backend.exists(blob.stored_path):
+                # Contenido ya almacenado: se conserva un solo archivo
+                stats['deduplicated'] += 1
+            else:
+                new_path = receipt_key(sha256, _extension(name))
+                # Una copia previa con el mismo hash (ejecución interrumpida) se reutiliza
+                if new_path != name and not backend.exists(new_path):
+                    backend.copy(name, new_path)
+                if blob:
+                    blob.stored_path = new_path
+                else:
+                    blob = ReceiptBlob(sha256=sha256, stored_path=new_path, size=size)
+                    db.session.add(blob)
+                    db.session.flush()
+                stats['hashed'] += 1
+            if blob.stored_path != name:
+                stale.append(name)
+                _adopt_legacy_variants(backend, name, blob, stale)
+            renames[name] = (blob.stored_path, sha256)
+
+        _repoint_expenses(renames)
+        db.session.commit()
+        _delete_stale(backend, stale)
+        log(f'{len(renames)} recibo(s) antiguos registrados (hasta gasto id {last_id})')
+    return stats
+
+
+def pending_counts():
+    """(recibos con ReceiptBlob por mover, gastos sin hash) para --dry-run"""
+    blobs = sum(
+        1 for sha256, stored_path in db.session.query(ReceiptBlob.sha256, ReceiptBlob.stored_path)
+        if stored_path != receipt_key(sha256, _extension(stored_path))
+    )
+    legacy = db.session.query(func.count(Expense.id)).filter(
+        Expense.receipt_sha256.is_(None),
+        Expense.receipt_image.is_not(None),
+        Expense.receipt_image != '',
+    ).scalar()
+    return blobs, legacy
+
+
+def run_relayout(batch_size=200, log=print):
+    """Migra todos los recibos (requiere contexto de aplicación)"""
+    stats = relayout_blobs(batch_size, log)
+    legacy = relayout_legacy(batch_size, log)
+    stats['missing'] += legacy.pop('missing')
+    stats.update(legacy)
+    return stats
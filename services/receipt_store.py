@@ -0,0 +1,159 @@
+"""
+Almacenamiento de recibos direccionado por contenido
+
+Los archivos se guardan como ab/cd/<sha256>.<ext> (los dos primeros pares del
+hash como subdirectorios) en el almacenamiento configurado (utils.storage).
+El nombre depende solo del contenido, así dos subidas no pueden pisarse, y
+ningún directorio acumula más de unos pocos miles de archivos. El hash se
+calcula mientras el archivo se copia a un temporal, y si el contenido ya
+existe se reutiliza el archivo (y su resultado OCR) sin volver a escribirlo
+ni procesarlo. `flask receipts relayout` migra los archivos existentes.
+
+El archivo se escribe antes del commit que registra el ReceiptBlob: si la
+transacción se revierte, el archivo recién escrito se elimina (salvo que otro
+ReceiptBlob ya confirmado lo use).
+"""
+import os
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import event
+from extensions import db, storage
+from models.expense import Expense
+from models.receipt import ReceiptBlob
+from utils.file_validators import receive_upload
+from utils.upsert import insert_for
+
+
+_NEW_FILES_KEY = 'receipt_new_files'
+
+
+def receipt_key(sha256, extension):
+    """Nombre en el almacenamiento de un recibo: ab/cd/<sha256>.<ext>"""
+    return f'{sha256[:2]}/{sha256[2:4]}/{sha256}.{extension}'
+
+
+def store_receipt(file):
+    """
+    Valida y guarda un recibo subido en una sola lectura del stream
+    (ver utils.file_validators.receive_upload).
+
+    Returns:
+        tuple: (ReceiptBlob, created) donde created es False si el contenido
+        ya existía y se reutilizó el archivo almacenado
+
+    Raises:
+        FileValidationError: Si el archivo no es una imagen válida o es sospechoso
+    """
+    backend = storage.backend
+    upload = receive_upload(file, backend.staging_dir())
+
+    blob = ReceiptBlob.query.filter_by(sha256=upload.sha256).first()
+    if blob and backend.exists(blob.stored_path):
+        os.remove(upload.path)
+        return blob, False
+
+    # La extensión sale del tipo detectado, no del nombre enviado por el cliente
+    stored_path = receipt_key(upload.sha256, upload.extension)
+
+    if blob:
+        # El índice existía pero el archivo se había perdido
+        blob.stored_path = stored_path
+    else:
+        blob, created = _register_blob(upload, stored_path)
+        if not created:
+            # Otra subida del mismo contenido ganó la carrera: su archivo es el mismo
+            if backend.exists(blob.stored_path):
+                os.remove(upload.path)
+            else:
+                backend.save_file(blob.stored_path, upload.path)
+            return blob, False
+        db.session.info.setdefault(_NEW_FILES_KEY, set()).add(stored_path)
+
+    backend.save_file(stored_path, upload.path)
+    return blob, True
+
+
+def _register_blob(upload, stored_path):
+    """
+    Registra el ReceiptBlob; retorna (blob, created). Si otra subida del
+    mismo contenido lo registró al mismo tiempo, el INSERT ... ON CONFLICT
+    DO NOTHING no inserta nada y se usa la fila existente (sin IntegrityError
+    y sin afectar el resto de la transacción).
+    """
+    connection = db.session.connection()
+    statement = insert_for(connection, ReceiptBlob.__table__).values(
+        sha256=upload.sha256, stored_path=stored_path, size=upload.size, created_at=datetime.utcnow()
+    ).on_conflict_do_nothing(index_elements=['sha256'])
+    created = connection.execute(statement).rowcount == 1
+    return ReceiptBlob.query.filter_by(sha256=upload.sha256).one(), created
+
+
+def cached_ocr_result(sha256):
+    """Resultado OCR ya calculado para un contenido (o None)"""
+    if not sha256:
+        return None
+    return db.session.query(ReceiptBlob.ocr_result).filter_by(sha256=sha256).scalar()
+
+
+def cache_ocr_result(sha256, ocr_result):
+    """Guarda el resultado OCR en el índice de contenido"""
+    if sha256:
+        ReceiptBlob.query.filter_by(sha256=sha256).update({'ocr_result': ocr_result})
+
+
+def possible_duplicates(expense):
+    """Otros gastos que usan exactamente el mismo recibo"""
+    if not expense.receipt_sha256:
+        return []
+    return Expense.query.filter(
+        Expense.receipt_sha256 == expense.receipt_sha256,
+        Expense.id != expense.id
+    ).order_by(Expense.created_at).all()
+
+
+def duplicate_receipt_ids(expenses):
+    """
+    IDs de los gastos (de una página) cuyo recibo aparece en otro gasto.
+    Una sola consulta agrupada para toda la página.
+    """
+    hashes = {e.receipt_sha256 for e in expenses if e.receipt_sha256}
+    if not hashes:
+        return set()
+
+    repeated = {
+        sha256 for sha256, in db.session.query(Expense.receipt_sha256).filter(
+            Expense.receipt_sha256.in_(hashes)
+        ).group_by(Expense.receipt_sha256).having(db.func.count(Expense.id) > 1)
+    }
+    return {e.id for e in expenses if e.receipt_sha256 in repeated}
+
+
+def _discard_new_files(session, previous_transaction):
+    """after_soft_rollback: elimina los archivos escritos por la transacción revertida"""
+    if previous_transaction.nested:
+        return
+    names = session.info.pop(_NEW_FILES_KEY, None)
+    if not names or not session.is_active:
+        return
+    # Un ReceiptBlob confirmado por otra transacción puede usar el mismo nombre
+    in_use = {
+        path for path, in session.query(ReceiptBlob.stored_path).filter(ReceiptBlob.stored_path.in_(names))
+    }
+    for name in names - in_use:
+        try:
+            storage.backend.delete(name)
+        except Exception:
+            current_app.logger.exception(f'No se pudo eliminar el recibo huérfano {name}')
+
+
+def _forget_new_files(session):
+    session.info.pop(_NEW_FILES_KEY, None)
+
+
+def init_app(app):
+    """Registrar listeners de sesión (una sola vez por proceso)"""
+    if event.contains(db.session, 'after_soft_rollback', _discard_new_files):
+        return
+
+    event.listen(db.session, 'after_soft_rollback', _discard_new_files)
+    event.listen(db.session, 'after_commit', _forget_new_files)
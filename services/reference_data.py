@@ -0,0 +1,111 @@
+"""
+Datos de referencia en caché (clientes, categorías y áreas activas)
+
+Son tablas que cambian poco pero se leen en cada formulario y en varios
+endpoints de la API. Se guardan como tuplas inmutables (no entidades ORM,
+que quedarían ligadas a una sesión) con el TTL de REFERENCE_DATA_TTL.
+
+Cualquier commit que cree, modifique o elimine un Company, ExpenseCategory o
+Area invalida la entrada correspondiente, sea cual sea la ruta que lo haga.
+Las actualizaciones masivas con Core (sin pasar por la sesión) deben llamar
+a invalidate() explícitamente.
+
+El caché es local a cada proceso y solo se invalida en el worker que hizo el
+commit. Los endpoints que generan el ETag con la versión de la tabla
+(services.http_cache) la pasan como `version`: forma parte de la clave, así
+otro worker nunca sirve un ETag nuevo con la lista anterior.
+"""
+from collections import namedtuple
+from flask import current_app
+from sqlalchemy import event
+from extensions import db, cache
+from models.company import Area, Company, ExpenseCategory
+
+
+ClientRef = namedtuple('ClientRef', 'id rut name contact_email status')
+CategoryRef = namedtuple('CategoryRef', 'id name requires_client max_amount keywords')
+AreaRef = namedtuple('AreaRef', 'id name budget_monthly')
+
+# Modelo -> clave de caché
+_KEYS = {
+    Company: 'reference:clients',
+    ExpenseCategory: 'reference:categories',
+    Area: 'reference:areas',
+}
+
+_PENDING_KEY = 'reference_data_changes'
+
+
+def _ttl():
+    return current_app.config.get('REFERENCE_DATA_TTL', 300)
+
+
+def _load_clients():
+    return tuple(ClientRef(*row) for row in db.session.query(
+        Company.id, Company.rut, Company.name, Company.contact_email, Company.status
+    ).filter(Company.is_active.is_(True)).order_by(Company.name))
+
+
+def _load_categories():
+    return tuple(CategoryRef(*row) for row in db.session.query(
+        ExpenseCategory.id, ExpenseCategory.name, ExpenseCategory.requires_client,
+        ExpenseCategory.max_amount, ExpenseCategory.keywords
+    ).filter(ExpenseCategory.is_active.is_(True)).order_by(ExpenseCategory.name))
+
+
+def _load_areas():
+    return tuple(AreaRef(*row) for row in db.session.query(
+        Area.id, Area.name, Area.budget_monthly
+    ).filter(Area.is_active.is_(True)).order_by(Area.name))
+
+
+def _key(model, version=None):
+    return _KEYS[model] if version is None else f'{_KEYS[model]}:{version}'
+
+
+def active_clients(version=None):
+    """Clientes activos (aprobados)"""
+    return cache.get_or_set(_key(Company, version), _load_clients, _ttl())
+
+
+def active_categories(version=None):
+    """Categorías de gasto activas"""
+    return cache.get_or_set(_key(ExpenseCategory, version), _load_categories, _ttl())
+
+
+def active_areas():
+    """Áreas activas"""
+    return cache.get_or_set(_KEYS[Area], _load_areas, _ttl())
+
+
+def invalidate(*models):
+    """Descarta las entradas de los modelos indicados (todas si no se indica ninguno)"""
+    cache.delete(*(_KEYS[model] for model in (models or _KEYS)))
+
+
+def _collect_changes(session, flush_context, instances):
+    """before_flush: modelos de referencia afectados por el flush"""
+    touched = session.info.setdefault(_PENDING_KEY, set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if type(obj) in _KEYS:
+            touched.add(type(obj))
+
+
+def _after_commit(session):
+    touched = session.info.pop(_PENDING_KEY, None)
+    if touched:
+        invalidate(*touched)
+
+
+def _after_rollback(session, previous_transaction):
+    session.info.pop(_PENDING_KEY, None)
+
+
+def init_app(app):
+    """Registrar listeners de sesión (una sola vez por proceso)"""
+    if event.contains(db.session, 'before_flush', _collect_changes):
+        return
+
+    event.listen(db.session, 'before_flush', _collect_changes)
+    event.listen(db.session, 'after_commit', _after_commit)
+    event.listen(db.session, 'after_soft_rollback', _after_rollback)
@@ -0,0 +1,79 @@
+"""
+Series de los gráficos del dashboard, en caché
+
+Cada serie se guarda bajo la clave (alcance, tipo, período, versión):
+
+- alcance: 'all' para admins (comparten entrada) o rol+id del usuario
+- período: mes actual para 'monthly' (ventana de 12 meses), 'all' para el resto
+- versión: suma de versiones de expenses y users (services.http_cache)
+
+Como la versión cambia en el mismo commit que crea, modifica o elimina un
+gasto (o cambia la jerarquía), las entradas viejas simplemente dejan de
+leerse: no hace falta invalidarlas y todos los workers ven el cambio a la
+vez. Con el caché caliente, el dashboard cuesta una consulta (la versión).
+"""
+from datetime import date
+from flask import current_app
+from extensions import cache
+from services import http_cache, visibility
+from services.report_service import (
+    last_months, month_bounds, monthly_totals, totals_by_category, totals_by_status
+)
+
+
+CHART_TYPES = ('monthly', 'category', 'status')
+
+# Tablas de las que dependen las series
+SOURCE_TABLES = ('expenses', 'users')
+
+
+def _monthly(scope):
+    # Últimos 12 meses desde el rollup mensual
+    months = last_months(12)
+    start = date(*months[0], 1)
+    end = month_bounds(*months[-1])[1]
+    totals = monthly_totals(scope, start, end)
+    return [{
+        'label': date(y, m, 1).strftime('%b %Y'),
+        'value': float(totals.get((y, m), (0, 0))[1])
+    } for y, m in months]
+
+
+def _category(scope):
+    return [{'label': row.category, 'value': float(row.total)} for row in totals_by_category(scope)]
+
+
+def _status(scope):
+    return [{'label': status, 'value': count} for status, count in totals_by_status(scope)]
+
+
+_BUILDERS = {'monthly': _monthly, 'category': _category, 'status': _status}
+
+
+class ChartSeries:
+    """Series de un usuario; version/etag permiten responder 304 sin calcularlas"""
+
+    def __init__(self, user):
+        self.scope = visibility.for_user(user)
+        self.scope_key = 'all' if self.scope.is_global else f'{user.role}{user.id}'
+        self.month = date.today().strftime('%Y-%m')
+        self.version, self.last_modified = http_cache.stamp(*SOURCE_TABLES)
+
+    @property
+    def etag(self):
+        return http_cache.make_etag('charts', self.scope_key, self.month, self.version)
+
+    def key(self, chart_type):
+        period = self.month if chart_type == 'monthly' else 'all'
+        return f'charts:{self.scope_key}:{chart_type}:{period}:{self.version}'
+
+    def get(self, chart_type):
+        """Serie [{'label', 'value'}] de un tipo de CHART_TYPES"""
+        return cache.get_or_set(
+            self.key(chart_type),
+            lambda: _BUILDERS[chart_type](self.scope.rollups()),
+            current_app.config.get('CHART_CACHE_TTL', 600)
+        )
+
+    def all(self):
+        return {chart_type: self.get(chart_type) for chart_type in CHART_TYPES}
@@ -0,0 +1,164 @@
+"""
+Servicio de consultas agregadas para reportes y estadísticas
+
+Las métricas se leen desde la tabla de rollups mensuales (ver
+services.rollup_service), por lo que su costo depende de la cantidad de buckets
+y no de la cantidad de gastos. La visibilidad se aplica como subconsulta SQL en
+vez de listas de IDs materializadas en Python.
+"""
+from datetime import date
+from sqlalchemy import func, case
+from extensions import db
+from models.expense import Expense
+from models.user import User
+from models.report import ExpenseMonthlyRollup
+from services import visibility
+
+
+EXPENSE_STATUSES = ('pending', 'approved', 'rejected', 'reimbursed')
+
+
+def expense_scope_filter(user, include_self=False):
+    """Filtro de visibilidad sobre Expense (ver services.visibility)"""
+    return visibility.for_user(user).filter(Expense.user_id, include_self)
+
+
+def rollup_scope_filter(user, include_self=False):
+    """Mismo filtro que expense_scope_filter, aplicado sobre la tabla de rollups"""
+    return visibility.for_user(user).rollups(include_self)
+
+
+def month_bounds(year, month):
+    """Retorna (inicio, fin) del mes como fechas, fin exclusivo"""
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return start, end
+
+
+def _apply_scope(query, scope):
+    if scope is not None:
+        query = query.filter(scope)
+    return query
+
+
+def _period(year, month):
+    return year * 100 + month
+
+
+def expense_summary(scope=None, year=None, month=None):
+    """
+    Métricas generales en una sola consulta: cantidad y monto total, cantidades
+    por estado, monto aprobado y, si se indica año/mes, cifras de ese mes.
+    """
+    R = ExpenseMonthlyRollup
+    columns = [
+        func.coalesce(func.sum(R.expense_count), 0).label('total_count'),
+        func.coalesce(func.sum(R.total_amount), 0).label('total_amount'),
+        func.coalesce(func.sum(
+            case((R.status == 'approved', R.total_amount), else_=0)
+        ), 0).label('approved_amount'),
+    ]
+    for status in EXPENSE_STATUSES:
+        columns.append(func.coalesce(func.sum(
+            case((R.status == status, R.expense_count), else_=0)
+        ), 0).label(f'{status}_count'))
+
+    if year and month:
+        in_month = (R.year == year) & (R.month == month)
+        columns.append(func.coalesce(func.sum(
+            case((in_month, R.expense_count), else_=0)
+        ), 0).label('month_count'))
+        columns.append(func.coalesce(func.sum(
+            case((in_month, R.total_amount), else_=0)
+        ), 0).label('month_amount'))
+
+    row = _apply_scope(db.session.query(*columns), scope).one()
+    return dict(row._mapping)
+
+
+def totals_by_category(scope=None, with_stats=False):
+    """Cantidad y monto por categoría (con promedio/mín/máx si with_stats)"""
+    R = ExpenseMonthlyRollup
+    columns = [
+        R.category,
+        func.sum(R.expense_count).label('count'),
+        func.sum(R.total_amount).label('total'),
+    ]
+    if with_stats:
+        columns += [
+            (func.sum(R.total_amount) / func.sum(R.expense_count)).label('average'),
+            func.min(R.min_amount).label('min_amount'),
+            func.max(R.max_amount).label('max_amount'),
+        ]
+
+    query = _apply_scope(db.session.query(*columns), scope)
+    return query.group_by(R.category).order_by(func.sum(R.total_amount).desc()).all()
+
+
+def totals_by_status(scope=None):
+    """Cantidad de gastos por estado"""
+    R = ExpenseMonthlyRollup
+    query = _apply_scope(db.session.query(
+        R.status,
+        func.sum(R.expense_count).label('count')
+    ), scope)
+    return query.group_by(R.status).all()
+
+
+def monthly_totals(scope, start, end):
+    """
+    Cantidad y monto por (año, mes) entre dos fechas (fin exclusivo).
+    Retorna dict {(año, mes): (count, total)}
+    """
+    R = ExpenseMonthlyRollup
+    period = R.year * 100 + R.month
+    last = date.fromordinal(end.toordinal() - 1)
+
+    query = db.session.query(
+        R.year, R.month,
+        func.sum(R.expense_count).label('count'),
+        func.sum(R.total_amount).label('total')
+    ).filter(
+        period >= _period(start.year, start.month),
+        period <= _period(last.year, last.month)
+    )
+    query = _apply_scope(query, scope)
+
+    return {
+        (row.year, row.month): (row.count, row.total or 0)
+        for row in query.group_by(R.year, R.month).all()
+    }
+
+
+def available_years(scope=None):
+    """Años con gastos registrados"""
+    R = ExpenseMonthlyRollup
+    query = _apply_scope(db.session.query(R.year).distinct(), scope)
+    return [row.year for row in query.order_by(R.year).all()]
+
+
+def last_months(count, today=None):
+    """Lista de (año, mes) de los últimos `count` meses, del más antiguo al actual"""
+    today = today or date.today()
+    year, month = today.year, today.month
+    months = []
+    for _ in range(count):
+        months.append((year, month))
+        month -= 1
+        if month == 0:
+            year, month = year - 1, 12
+    return list(reversed(months))
+
+
+def top_users(scope=None, limit=5):
+    """Usuarios con mayor monto total de gastos"""
+    R = ExpenseMonthlyRollup
+    query = db.session.query(
+        User.first_name, User.last_name,
+        func.sum(R.expense_count).label('count'),
+        func.sum(R.total_amount).label('total')
+    ).join(R, R.user_id == User.id)
+    query = _apply_scope(query, scope)
+    return query.group_by(User.id, User.first_name, User.last_name).order_by(
+        func.sum(R.total_amount).desc()
+    ).limit(limit).all()
@@ -0,0 +1,326 @@
+"""
+Mantenimiento incremental de la tabla de rollups mensuales de gastos
+
+Cada flush de la sesión que crea, edita, aprueba, rechaza o elimina un Expense
+se traduce en deltas sobre los buckets (usuario, área, cliente, categoría,
+estado, año, mes) afectados y sobre los contadores de presupuesto por área
+(services.budget_service). Los deltas se aplican dentro de la misma
+transacción, por lo que el rollup nunca queda desfasado respecto de los datos.
+
+El área de un bucket es la del usuario: si cambia User.area_id, los buckets
+del usuario se recalculan desde sus gastos en el mismo flush.
+"""
+from collections import defaultdict
+from datetime import date, datetime
+from sqlalchemy import event, inspect, select, insert, update, delete, func, case, extract, and_
+from extensions import db
+from models.expense import Expense
+from models.user import User
+from models.report import ExpenseMonthlyRollup
+from services.budget_service import apply_area_deltas, apply_area_totals, rebuild_area_spend
+from utils.upsert import insert_for
+
+
+# Campos de Expense que determinan el bucket o el monto agregado
+TRACKED_FIELDS = ('user_id', 'client_id', 'category', 'status', 'amount', 'expense_date')
+
+_PENDING_KEY = 'rollup_changes'
+_MOVED_KEY = 'rollup_area_moves'
+
+# Expresiones del índice único del bucket (destino del ON CONFLICT)
+BUCKET_KEY = next(
+    index for index in ExpenseMonthlyRollup.__table__.indexes if index.name == 'uq_rollup_bucket'
+).expressions
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    return value
+
+
+def _snapshot(values):
+    """Convierte valores de un gasto en (bucket_sin_area, monto)"""
+    if values['expense_date'] is None or values['amount'] is None:
+        return None
+    expense_date = _as_date(values['expense_date'])
+    key = (
+        values['user_id'],
+        values['client_id'],
+        values['category'],
+        values['status'] or 'pending',
+        expense_date.year,
+        expense_date.month,
+    )
+    return key, float(values['amount'])
+
+
+def _current_values(obj):
+    return {field: getattr(obj, field) for field in TRACKED_FIELDS}
+
+
+def _previous_values(obj):
+    state = inspect(obj)
+    values = {}
+    for field in TRACKED_FIELDS:
+        history = state.attrs[field].history
+        if history.deleted:
+            values[field] = history.deleted[0]
+        else:
+            values[field] = getattr(obj, field)
+    return values
+
+
+def _collect_changes(session, flush_context, instances):
+    """before_flush: registra el estado anterior/nuevo de cada gasto modificado"""
+    changes = session.info.setdefault(_PENDING_KEY, [])
+
+    for obj in session.new:
+        if isinstance(obj, Expense):
+            changes.append((None, _current_values(obj)))
+
+    for obj in session.dirty:
+        if isinstance(obj, Expense) and session.is_modified(obj, include_collections=False):
+            state = inspect(obj)
+            if any(state.attrs[field].history.has_changes() for field in TRACKED_FIELDS):
+                changes.append((_previous_values(obj), _current_values(obj)))
+
+    for obj in session.deleted:
+        if isinstance(obj, Expense):
+            changes.append((_previous_values(obj), None))
+
+    moved = session.info.setdefault(_MOVED_KEY, set())
+    for obj in session.dirty:
+        if isinstance(obj, User) and inspect(obj).attrs['area_id'].history.has_changes():
+            moved.add(obj.id)
+
+
+def _apply_changes(session, flush_context):
+    """after_flush: aplica los deltas acumulados sobre la tabla de rollups"""
+    changes = session.info.pop(_PENDING_KEY, None)
+    moved = session.info.pop(_MOVED_KEY, None)
+    if not changes and not moved:
+        return
+    moved = moved or set()
+
+    removed = []
+    added = []
+    for before, after in changes or ():
+        before = _snapshot(before) if before else None
+        after = _snapshot(after) if after else None
+        if before == after:
+            continue
+        # Los gastos de usuarios que cambian de área se recalculan completos
+        if before and before[0][0] not in moved:
+            removed.append(before)
+        if after and after[0][0] not in moved:
+            added.append(after)
+
+    apply_deltas(session.connection(), added=added, removed=removed)
+    if moved:
+        move_users(session.connection(), moved)
+
+
+def _after_rollback(session, previous_transaction):
+    session.info.pop(_PENDING_KEY, None)
+    session.info.pop(_MOVED_KEY, None)
+
+
+def apply_deltas(connection, added=(), removed=()):
+    """
+    Aplica altas y bajas de montos a los buckets del rollup.
+
+    Args:
+        connection: Conexión SQLAlchemy dentro de la transacción activa
+        added: Iterable de (bucket, monto) con bucket = (user_id, client_id,
+            category, status, year, month)
+        removed: Iterable con el mismo formato para montos que salen del bucket
+    """
+    added = list(added)
+    removed = list(removed)
+    if not added and not removed:
+        return
+
+    user_ids = {key[0] for key, _ in added + removed}
+    areas = dict(connection.execute(
+        select(User.id, User.area_id).where(User.id.in_(user_ids))
+    ).all())
+
+    buckets = defaultdict(lambda: {'added': [], 'removed': []})
+    for key, amount in added:
+        buckets[(key[0], areas.get(key[0])) + key[1:]]['added'].append(amount)
+    for key, amount in removed:
+        buckets[(key[0], areas.get(key[0])) + key[1:]]['removed'].append(amount)
+
+    for bucket, delta in buckets.items():
+        _apply_bucket(connection, bucket, delta['added'], delta['removed'])
+
+    # Contadores de presupuesto por área (mismos movimientos, agrupados por área y mes)
+    apply_area_deltas(connection, added, removed, areas)
+
+
+def _bucket_filter(bucket):
+    user_id, area_id, client_id, category, status, year, month = bucket
+    R = ExpenseMonthlyRollup
+    return and_(
+        R.user_id == user_id,
+        R.area_id == area_id,
+        R.client_id == client_id,
+        R.category == category,
+        R.status == status,
+        R.year == year,
+        R.month == month,
+    )
+
+
+def _apply_bucket(connection, bucket, added, removed):
+    R = ExpenseMonthlyRollup
+    count_delta = len(added) - len(removed)
+    amount_delta = sum(added) - sum(removed)
+    now = datetime.utcnow()
+
+    if added:
+        # Upsert: crea el bucket o le suma los deltas en una sola sentencia
+        user_id, area_id, client_id, category, status, year, month = bucket
+        statement = insert_for(connection, R).values(
+            user_id=user_id, area_id=area_id, client_id=client_id, category=category,
+            status=status, year=year, month=month,
+            expense_count=count_delta, total_amount=amount_delta,
+            min_amount=min(added), max_amount=max(added), updated_at=now
+        )
+        new = statement.excluded
+        connection.execute(statement.on_conflict_do_update(index_elements=BUCKET_KEY, set_={
+            'expense_count': R.expense_count + new.expense_count,
+            'total_amount': R.total_amount + new.total_amount,
+            'min_amount': case(
+                ((R.min_amount.is_(None)) | (R.min_amount > new.min_amount), new.min_amount), else_=R.min_amount
+            ),
+            'max_amount': case(
+                ((R.max_amount.is_(None)) | (R.max_amount < new.max_amount), new.max_amount), else_=R.max_amount
+            ),
+            'updated_at': new.updated_at,
+        }))
+    else:
+        connection.execute(update(R).where(_bucket_filter(bucket)).values(
+            expense_count=R.expense_count + count_delta,
+            total_amount=R.total_amount + amount_delta,
+            updated_at=now,
+        ))
+
+    if removed:
+        # Un mínimo/máximo no se puede "restar": si salió un extremo se recalcula
+        connection.execute(delete(R).where(_bucket_filter(bucket), R.expense_count <= 0))
+        row = connection.execute(
+            select(R.min_amount, R.max_amount).where(_bucket_filter(bucket))
+        ).first()
+        if row and (row.min_amount is None or row.max_amount is None
+                    or min(removed) <= float(row.min_amount) or max(removed) >= float(row.max_amount)):
+            _recompute_extremes(connection, bucket)
+
+
+def _recompute_extremes(connection, bucket):
+    user_id, area_id, client_id, category, status, year, month = bucket
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+
+    low, high = connection.execute(
+        select(func.min(Expense.amount), func.max(Expense.amount)).where(
+            Expense.user_id == user_id,
+            Expense.client_id == client_id,
+            Expense.category == category,
+            Expense.status == status,
+            Expense.expense_date >= start,
+            Expense.expense_date < end,
+        )
+    ).one()
+
+    R = ExpenseMonthlyRollup
+    connection.execute(
+        update(R).where(_bucket_filter(bucket)).values(min_amount=low, max_amount=high)
+    )
+
+
+ROLLUP_COLUMNS = [
+    'user_id', 'area_id', 'client_id', 'category', 'status', 'year', 'month',
+    'expense_count', 'total_amount', 'min_amount', 'max_amount', 'updated_at'
+]
+
+
+def _rollup_source(*conditions):
+    """SELECT agrupado que genera los buckets (de todos los gastos o de los filtrados)"""
+    year_col = extract('year', Expense.expense_date)
+    month_col = extract('month', Expense.expense_date)
+
+    return select(
+        Expense.user_id,
+        User.area_id,
+        Expense.client_id,
+        Expense.category,
+        func.coalesce(Expense.status, 'pending'),
+        year_col,
+        month_col,
+        func.count(Expense.id),
+        func.sum(Expense.amount),
+        func.min(Expense.amount),
+        func.max(Expense.amount),
+        func.current_timestamp(),
+    ).join(User, User.id == Expense.user_id).where(*conditions).group_by(
+        Expense.user_id, User.area_id, Expense.client_id, Expense.category,
+        func.coalesce(Expense.status, 'pending'), year_col, month_col
+    )
+
+
+def move_users(connection, user_ids):
+    """
+    Recalcula los buckets de usuarios que cambiaron de área: se eliminan los
+    del área anterior y se generan de nuevo desde sus gastos. Los contadores
+    de presupuesto descuentan lo que había en el área anterior y suman lo
+    regenerado en la nueva.
+    """
+    R = ExpenseMonthlyRollup
+    user_ids = sorted(user_ids)
+    totals = select(
+        R.area_id, R.year, R.month, R.status, func.sum(R.expense_count), func.sum(R.total_amount)
+    ).where(R.user_id.in_(user_ids)).group_by(R.area_id, R.year, R.month, R.status)
+
+    previous = connection.execute(totals).all()
+    connection.execute(delete(R).where(R.user_id.in_(user_ids)))
+    connection.execute(insert(R).from_select(ROLLUP_COLUMNS, _rollup_source(Expense.user_id.in_(user_ids))))
+    apply_area_totals(connection, added=connection.execute(totals).all(), removed=previous)
+
+
+def rebuild_rollups():
+    """
+    Reconstruye la tabla de rollups completa con una sola consulta agrupada
+    (y los contadores de presupuesto por área). Retorna la cantidad de buckets
+    generados.
+    """
+    R = ExpenseMonthlyRollup
+    db.session.execute(delete(R))
+    db.session.execute(insert(R).from_select(ROLLUP_COLUMNS, _rollup_source()))
+    rebuild_area_spend()
+    db.session.commit()
+
+    return db.session.query(func.count(R.id)).scalar()
+
+
+def _track_old_value(target, value, oldvalue, initiator):
+    return value
+
+
+def init_app(app):
+    """Registrar listeners de sesión (una sola vez por proceso)"""
+    if event.contains(db.session, 'before_flush', _collect_changes):
+        return
+
+    # Cargar el valor anterior aunque el atributo esté expirado, para poder
+    # descontarlo del bucket correcto
+    for field in TRACKED_FIELDS:
+        event.listen(getattr(Expense, field), 'set', _track_old_value,
+                     active_history=True, retval=True)
+
+    event.listen(db.session, 'before_flush', _collect_changes)
+    event.listen(db.session, 'after_flush', _apply_changes)
+    event.listen(db.session, 'after_soft_rollback', _after_rollback)
@@ -0,0 +1,297 @@
+"""
+Índice de búsqueda de texto completo sobre gastos
+
+Cada gasto tiene un documento con tres campos, en orden de peso:
+
+- reason: el motivo del gasto
+- client: nombre y RUT del cliente (también el RUT sin puntos ni guion)
+- ocr_text: ocr_data.raw_text del recibo
+
+Según el motor de base de datos el índice es:
+
+- SQLite: tabla virtual FTS5 expense_search (rowid = id del gasto),
+  ordenada con bm25 y los pesos de WEIGHTS
+- PostgreSQL: tabla expense_search (expense_id, document tsvector) con índice
+  GIN, ordenada con ts_rank_cd
+
+La tabla se crea junto con expenses (db.create_all) y se mantiene en el mismo
+flush que crea, edita o elimina un gasto, o que cambia nombre o RUT de un
+cliente. Las escrituras masivas con Core (sin pasar por la sesión) deben
+llamar a reindex() explícitamente; `flask search rebuild` la reconstruye.
+"""
+import re
+from sqlalchemy import DDL, column, delete, event, func, insert, inspect, literal_column, select, table, text
+from extensions import db
+from models.company import Company
+from models.expense import Expense
+
+
+# Campos de Expense y Company que forman el documento
+EXPENSE_FIELDS = ('reason', 'client_id', 'ocr_data')
+CLIENT_FIELDS = ('name', 'rut')
+
+# Pesos de reason, client y ocr_text
+WEIGHTS = (10.0, 5.0, 1.0)
+
+# Configuración de texto de PostgreSQL (stemming en español)
+PG_CONFIG = 'spanish'
+
+# IDs por sentencia al reindexar
+CHUNK_SIZE = 500
+
+# Largo mínimo para buscar una palabra como prefijo ("ta" no expande a todo)
+MIN_PREFIX = 3
+
+# Relevancia: solo se ordenan los RANK_WINDOW resultados más recientes
+RANK_WINDOW = 2000
+
+# RUT con o sin puntos y guion: se busca en su forma compacta (965554443)
+RUT_PATTERN = re.compile(r'\b(\d{1,2})\.?(\d{3})\.?(\d{3})-?([\dkK])\b')
+
+_PENDING_KEY = 'search_index_changes'
+
+# rank: columna oculta de FTS5 con el puntaje bm25 configurado
+fts_table = table('expense_search', column('rowid'), column('reason'), column('client'), column('ocr_text'), column('rank'))
+pg_table = table('expense_search', column('expense_id'), column('document'))
+
+
+_SQLITE_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS expense_search USING fts5("
+    "reason, client, ocr_text, tokenize='unicode61 remove_diacritics 2')",
+    # Orden por defecto (columna rank): ORDER BY rank usa el camino optimizado de FTS5
+    "INSERT INTO expense_search(expense_search, rank) VALUES ('rank', 'bm25({}, {}, {})')".format(*WEIGHTS),
+)
+
+_POSTGRESQL_DDL = (
+    "CREATE TABLE IF NOT EXISTS expense_search ("
+    "expense_id INTEGER PRIMARY KEY REFERENCES expenses(id) ON DELETE CASCADE, "
+    "document tsvector NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_expense_search_document ON expense_search USING GIN (document)",
+)
+
+
+def supported(dialect_name):
+    return dialect_name in ('sqlite', 'postgresql')
+
+
+def create_schema(connection):
+    """Crea la tabla del índice si no existe (vacía; poblarla con rebuild())"""
+    name = connection.dialect.name
+    if name == 'sqlite':
+        exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = 'expense_search'")
+        ).first()
+        if not exists:
+            for statement in _SQLITE_DDL:
+                connection.execute(text(statement))
+    elif name == 'postgresql':
+        for statement in _POSTGRESQL_DDL:
+            connection.execute(text(statement))
+
+
+def _client_text():
+    rut = func.coalesce(Company.rut, '')
+    return func.coalesce(Company.name, '') + ' ' + rut + ' ' + func.replace(func.replace(rut, '.', ''), '-', '')
+
+
+def _ocr_text():
+    return func.coalesce(Expense.ocr_data['raw_text'].as_string(), '')
+
+
+def _documents(dialect_name):
+    """SELECT con (id, columnas del documento) de cada gasto, según el motor"""
+    if dialect_name == 'postgresql':
+        config = literal_column(f"'{PG_CONFIG}'::regconfig")
+        document = (
+            func.setweight(func.to_tsvector(config, func.coalesce(Expense.reason, '')), 'A').op('||')(
+                func.setweight(func.to_tsvector(literal_column("'simple'::regconfig"), _client_text()), 'B')
+            ).op('||')(
+                func.setweight(func.to_tsvector(config, _ocr_text()), 'C')
+            )
+        )
+        columns = (Expense.id, document.label('document'))
+    else:
+        columns = (Expense.id, func.coalesce(Expense.reason, ''), _client_text(), _ocr_text())
+    return select(*columns).outerjoin(Company, Company.id == Expense.client_id)
+
+
+def _key_column(dialect_name):
+    return pg_table.c.expense_id if dialect_name == 'postgresql' else fts_table.c.rowid
+
+
+def _target(dialect_name):
+    if dialect_name == 'postgresql':
+        return pg_table, ['expense_id', 'document']
+    return fts_table, ['rowid', 'reason', 'client', 'ocr_text']
+
+
+def _chunks(ids):
+    ids = sorted(ids)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
+
+
+def remove(connection, expense_ids):
+    """Quita gastos del índice"""
+    name = connection.dialect.name
+    if not supported(name):
+        return
+    target, _ = _target(name)
+    for chunk in _chunks(expense_ids):
+        connection.execute(delete(target).where(_key_column(name).in_(chunk)))
+
+
+def reindex(connection, expense_ids=None, client_ids=None):
+    """
+    Recalcula los documentos de los gastos indicados (o de todos los gastos
+    de los clientes indicados) dentro de la transacción actual.
+    """
+    name = connection.dialect.name
+    if not supported(name):
+        return
+    target, columns = _target(name)
+
+    conditions = [Expense.id.in_(chunk) for chunk in _chunks(expense_ids or ())]
+    conditions += [Expense.client_id.in_(chunk) for chunk in _chunks(client_ids or ())]
+    for condition in conditions:
+        ids = select(Expense.id).where(condition)
+        connection.execute(delete(target).where(_key_column(name).in_(ids)))
+        connection.execute(insert(target).from_select(columns, _documents(name).where(condition)))
+
+
+def rebuild():
+    """Reconstruye el índice completo con una sola sentencia; retorna la cantidad de gastos"""
+    connection = db.session.connection()
+    name = connection.dialect.name
+    if not supported(name):
+        return 0
+    create_schema(connection)
+    target, columns = _target(name)
+    connection.execute(delete(target))
+    connection.execute(insert(target).from_select(columns, _documents(name)))
+    count = connection.execute(select(func.count()).select_from(target)).scalar()
+    db.session.commit()
+    if name == 'sqlite':
+        # Compactar los segmentos del índice después de la carga
+        db.session.execute(text("INSERT INTO expense_search(expense_search) VALUES ('optimize')"))
+        db.session.commit()
+    return count
+
+
+def terms(query):
+    """Palabras de la búsqueda (sin operadores: el texto del usuario no es sintaxis)"""
+    query = RUT_PATTERN.sub(lambda match: ''.join(match.groups()), query or '')
+    return re.findall(r'\w+', query.lower())
+
+
+def _prefix(word, suffix, quote=''):
+    return quote + word + quote + (suffix if len(word) >= MIN_PREFIX else '')
+
+
+def _matching(query, words):
+    """(consulta restringida a las coincidencias, columna id del índice, orden por relevancia)"""
+    name = db.session.get_bind().dialect.name
+    if name == 'postgresql':
+        tsquery = func.to_tsquery(
+            literal_column(f"'{PG_CONFIG}'::regconfig"), ' & '.join(_prefix(w, ':*') for w in words)
+        )
+        document = pg_table.c.document.op('@@', return_type=db.Boolean)
+        matched = query.join(pg_table, pg_table.c.expense_id == Expense.id).filter(document(tsquery))
+        return matched, pg_table.c.expense_id, func.ts_rank_cd(pg_table.c.document, tsquery).desc()
+
+    if name == 'sqlite':
+        match = literal_column('expense_search').op('MATCH', return_type=db.Boolean)
+        matched = query.join(fts_table, fts_table.c.rowid == Expense.id).filter(
+            match(' '.join(_prefix(w, '*', quote='"') for w in words))
+        )
+        return matched, fts_table.c.rowid, fts_table.c.rank
+
+    # Otros motores: sin índice, solo el motivo
+    for word in words:
+        query = query.filter(Expense.reason.ilike(f'%{word}%'))
+    return query, None, None
+
+
+def search(query, words, offset=0, limit=20):
+    """
+    Gastos de la consulta que contienen todas las palabras (como prefijo desde
+    MIN_PREFIX letras), ordenados por relevancia.
+
+    Solo se puntúan las RANK_WINDOW coincidencias más recientes: con una
+    palabra muy común, puntuar todas costaría más que la búsqueda misma. Las
+    coincidencias anteriores siguen a continuación, de la más nueva a la más
+    antigua.
+    """
+    matched, key, rank = _matching(query, words)
+    if key is None:
+        return matched.order_by(Expense.id.desc()).offset(offset).limit(limit).all()
+
+    window = matched.with_entities(key.label('id')).order_by(None).order_by(key.desc()).limit(RANK_WINDOW).subquery()
+    threshold = select(func.min(window.c.id)).scalar_subquery()
+
+    results = matched.filter(key >= threshold).order_by(rank, Expense.id.desc()).offset(offset).limit(limit).all()
+    if len(results) == limit or (not results and offset == 0):
+        return results
+
+    # La página termina la ventana: se completa con las coincidencias anteriores
+    ranked = offset + len(results) if results else matched.filter(key >= threshold).order_by(None).count()
+    if ranked < RANK_WINDOW:
+        return results
+    older = matched.filter(key < threshold).order_by(key.desc())
+    return results + older.offset(max(offset - ranked, 0)).limit(limit - len(results)).all()
+
+
+def _collect_changes(session, flush_context, instances):
+    """before_flush: gastos y clientes cuyo documento cambia en este flush"""
+    changes = session.info.setdefault(_PENDING_KEY, {'new': [], 'dirty': set(), 'deleted': set(), 'clients': set()})
+
+    for obj in session.new:
+        if isinstance(obj, Expense):
+            changes['new'].append(obj)
+
+    for obj in session.dirty:
+        if isinstance(obj, Expense):
+            fields = EXPENSE_FIELDS
+        elif isinstance(obj, Company):
+            fields = CLIENT_FIELDS
+        else:
+            continue
+        state = inspect(obj)
+        if any(state.attrs[field].history.has_changes() for field in fields):
+            (changes['dirty'] if isinstance(obj, Expense) else changes['clients']).add(obj.id)
+
+    for obj in session.deleted:
+        if isinstance(obj, Expense):
+            changes['deleted'].add(obj.id)
+
+
+def _apply_changes(session, flush_context):
+    changes = session.info.pop(_PENDING_KEY, None)
+    if not changes:
+        return
+    connection = session.connection()
+    if changes['deleted']:
+        remove(connection, changes['deleted'])
+    expense_ids = changes['dirty'] | {obj.id for obj in changes['new'] if obj.id is not None}
+    if expense_ids or changes['clients']:
+        reindex(connection, expense_ids - changes['deleted'], changes['clients'])
+
+
+def _after_rollback(session, previous_transaction):
+    session.info.pop(_PENDING_KEY, None)
+
+
+def _create_table(target, connection, **kw):
+    create_schema(connection)
+
+
+def init_app(app):
+    """Registrar la creación de la tabla y los listeners de sesión (una sola vez por proceso)"""
+    if event.contains(db.session, 'before_flush', _collect_changes):
+        return
+
+    event.listen(Expense.__table__, 'after_create', _create_table)
+    event.listen(Expense.__table__, 'before_drop', DDL('DROP TABLE IF EXISTS expense_search'))
+    event.listen(db.session, 'before_flush', _collect_changes)
+    event.listen(db.session, 'after_flush', _apply_changes)
+    event.listen(db.session, 'after_soft_rollback', _after_rollback)
@@ -0,0 +1,273 @@
+"""
+Serializadores de la API REST
+
+Cada serializador declara qué relaciones usa su representación y la
+estrategia de carga de cada una. prepare() aplica esas opciones a la consulta
+que lo alimenta, de modo que serializar una página de N objetos no dispara N
+consultas perezosas adicionales.
+
+Uso:
+    query = expense_serializer.prepare(Expense.query.filter(...))
+    data = expense_serializer.dump_many(query.all())
+
+Para listados con `fields=` / `include=` (sparse fieldsets), project() cambia
+la consulta para seleccionar solo las columnas necesarias en lugar de
+entidades ORM completas:
+
+    query, dump = expense_serializer.project(query, fields=['id', 'amount'], include=['user'])
+    data = [dump(row) for row in query.all()]
+"""
+from sqlalchemy.orm import aliased, joinedload, selectinload
+from models.company import Area, Company
+from models.expense import Expense
+from models.user import User
+from utils.exceptions import ValidationError
+
+
+# Estrategias de carga: joined para muchos-a-uno, selectin para colecciones
+JOINED = joinedload
+SELECTIN = selectinload
+
+
+def _float(value):
+    return float(value) if value is not None else None
+
+
+def _iso(value):
+    return value.isoformat() if value is not None else None
+
+
+def _full_name(first_name, last_name):
+    return f"{first_name} {last_name}" if first_name is not None else None
+
+
+class Field:
+    """Campo proyectable: columnas que lee y cómo convertirlas al valor JSON"""
+
+    def __init__(self, *columns, convert=None, join=None):
+        self.columns = columns
+        self.convert = convert
+        self.join = join  # Nombre del join requerido (ver Serializer.joins)
+
+    def value(self, values):
+        if self.convert:
+            return self.convert(*values)
+        return values[0]
+
+
+def parse_list(value):
+    """'a, b,c' -> ['a', 'b', 'c'] (None si el parámetro no viene)"""
+    if value is None:
+        return None
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+class Serializer:
+    """Base: subclases definen model, relationships y to_dict()"""
+
+    model = None
+    # {nombre_relación: estrategia}
+    relationships = {}
+    # Proyección: {campo: Field}, {join: (alias, condición)}, {include: {campo: Field}}
+    fields = {}
+    joins = {}
+    includes = {}
+
+    def loader_options(self):
+        """Opciones de carga para las relaciones que usa to_dict()"""
+        return [strategy(getattr(self.model, name)) for name, strategy in self.relationships.items()]
+
+    def prepare(self, query):
+        """Aplica la carga anticipada de relaciones a una consulta del modelo"""
+        return query.options(*self.loader_options())
+
+    def get_or_404(self, ident):
+        """Obtiene un objeto por id con sus relaciones ya cargadas"""
+        return self.prepare(self.model.query).filter(self.model.id == ident).first_or_404()
+
+    def to_dict(self, obj):
+        raise NotImplementedError
+
+    def project(self, query, fields=None, include=None):
+        """
+        Reemplaza las entidades de la consulta por las columnas de los campos
+        pedidos (todos si fields es None) y de los objetos incluidos.
+        El id siempre se devuelve; created_at siempre se selecciona (paginación
+        por cursor) aunque solo se devuelve si fue pedido.
+
+        Returns:
+            tuple: (consulta, función fila -> dict)
+
+        Raises:
+            ValidationError: Si se pide un campo o include desconocido
+        """
+        fields = list(self.fields) if fields is None else fields
+        if 'id' not in fields:
+            fields = ['id'] + fields
+        include = include or []
+        unknown = [name for name in fields if name not in self.fields]
+        if unknown:
+            raise ValidationError(f"Campo(s) desconocido(s): {', '.join(unknown)}", field='fields')
+        unknown = [name for name in include if name not in self.includes]
+        if unknown:
+            raise ValidationError(f"Include(s) desconocido(s): {', '.join(unknown)}", field='include')
+
+        columns = [self.model.id.label('id'), self.model.created_at.label('created_at')]
+        layout = []  # (clave, subclave, Field, posición inicial)
+        required_joins = []
+
+        def add(key, subkey, field):
+            if field.join and field.join not in required_joins:
+                required_joins.append(field.join)
+            start = len(columns)
+            layout.append((key, subkey, field, start))
+            columns.extend(column.label(f'c{start + i}') for i, column in enumerate(field.columns))
+
+        for name in fields:
+            add(name, None, self.fields[name])
+        for name in include:
+            for subname, field in self.includes[name].items():
+                add(name, subname, field)
+
+        query = query.with_entities(*columns)
+        for name in required_joins:
+            target, condition = self.joins[name]
+            query = query.outerjoin(target, condition)
+
+        def dump(row):
+            data = {}
+            for key, subkey, field, start in layout:
+                value = field.value(row[start:start + len(field.columns)])
+                if subkey is None:
+                    data[key] = value
+                else:
+                    data.setdefault(key, {})[subkey] = value
+            # Un include sin fila relacionada se devuelve como null
+            for name in include:
+                if data[name].get('id') is None:
+                    data[name] = None
+            return data
+
+        return query, dump
+
+    def dump(self, obj):
+        return self.to_dict(obj)
+
+    def dump_many(self, objs):
+        return [self.to_dict(obj) for obj in objs]
+
+
+_ExpenseUser = aliased(User, name='expense_user')
+_ExpenseClient = aliased(Company, name='expense_client')
+_UserArea = aliased(Area, name='user_area')
+
+
+class ExpenseSerializer(Serializer):
+    model = Expense
+    relationships = {'user': JOINED, 'client': JOINED}
+
+    joins = {
+        'user': (_ExpenseUser, _ExpenseUser.id == Expense.user_id),
+        'client': (_ExpenseClient, _ExpenseClient.id == Expense.client_id),
+    }
+    fields = {
+        'id': Field(Expense.id),
+        'user_id': Field(Expense.user_id),
+        'user_name': Field(_ExpenseUser.first_name, _ExpenseUser.last_name, convert=_full_name, join='user'),
+        'client_id': Field(Expense.client_id),
+        'client_name': Field(_ExpenseClient.name, join='client'),
+        'amount': Field(Expense.amount, convert=_float),
+        'expense_date': Field(Expense.expense_date, convert=_iso),
+        'category': Field(Expense.category),
+        'reason': Field(Expense.reason),
+        'receipt_image': Field(Expense.receipt_image),
+        'latitude': Field(Expense.latitude, convert=lambda v: float(v) if v else None),
+        'longitude': Field(Expense.longitude, convert=lambda v: float(v) if v else None),
+        'address': Field(Expense.address),
+        'status': Field(Expense.status),
+        'created_at': Field(Expense.created_at, convert=_iso),
+        'updated_at': Field(Expense.updated_at, convert=_iso),
+        'ocr_data': Field(Expense.ocr_data),
+    }
+    includes = {
+        'user': {
+            'id': Field(_ExpenseUser.id, join='user'),
+            'full_name': Field(_ExpenseUser.first_name, _ExpenseUser.last_name, convert=_full_name, join='user'),
+            'email': Field(_ExpenseUser.email, join='user'),
+        },
+        'client': {
+            'id': Field(_ExpenseClient.id, join='client'),
+            'name': Field(_ExpenseClient.name, join='client'),
+            'rut': Field(_ExpenseClient.rut, join='client'),
+        },
+    }
+
+    def to_dict(self, expense):
+        return {
+            'id': expense.id,
+            'user_id': expense.user_id,
+            'user_name': expense.user.full_name if expense.user else None,
+            'client_id': expense.client_id,
+            'client_name': expense.client.name if expense.client else None,
+            'amount': float(expense.amount),
+            'expense_date': expense.expense_date.isoformat(),
+            'category': expense.category,
+            'reason': expense.reason,
+            'receipt_image': expense.receipt_image,
+            'latitude': float(expense.latitude) if expense.latitude else None,
+            'longitude': float(expense.longitude) if expense.longitude else None,
+            'address': expense.address,
+            'status': expense.status,
+            'created_at': expense.created_at.isoformat(),
+            'updated_at': expense.updated_at.isoformat() if expense.updated_at else None,
+            'ocr_data': expense.ocr_data
+        }
+
+
+class UserSerializer(Serializer):
+    model = User
+    relationships = {'area': JOINED}
+
+    joins = {
+        'area': (_UserArea, _UserArea.id == User.area_id),
+    }
+    fields = {
+        'id': Field(User.id),
+        'email': Field(User.email),
+        'first_name': Field(User.first_name),
+        'last_name': Field(User.last_name),
+        'full_name': Field(User.first_name, User.last_name, convert=_full_name),
+        'role': Field(User.role),
+        'area_id': Field(User.area_id),
+        'area_name': Field(_UserArea.name, join='area'),
+        'supervisor_id': Field(User.supervisor_id),
+        'is_active': Field(User.is_active),
+        'created_at': Field(User.created_at, convert=_iso),
+        'last_login': Field(User.last_login, convert=_iso),
+    }
+    includes = {
+        'area': {
+            'id': Field(_UserArea.id, join='area'),
+            'name': Field(_UserArea.name, join='area'),
+        },
+    }
+
+    def to_dict(self, user):
+        return {
+            'id': user.id,
+            'email': user.email,
+            'first_name': user.first_name,
+            'last_name': user.last_name,
+            'full_name': user.full_name,
+            'role': user.role,
+            'area_id': user.area_id,
+            'area_name': user.area.name if user.area else None,
+            'supervisor_id': user.supervisor_id,
+            'is_active': user.is_active,
+            'created_at': user.created_at.isoformat(),
+            'last_login': user.last_login.isoformat() if user.last_login else None
+        }
+
+
+expense_serializer = ExpenseSerializer()
+user_serializer = UserSerializer()
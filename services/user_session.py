@@ -0,0 +1,128 @@
+"""
+Usuario de sesión en caché (user_loader de Flask-Login)
+
+Flask-Login carga el usuario en cada request autenticado. En lugar de una
+entidad ORM se usa un SessionUser: una copia inmutable de los campos que
+usan las verificaciones de permisos y la navegación (id, rol, área,
+supervisor, estado y nombre), guardada en el caché bajo 'user:<id>' con el
+TTL de USER_SESSION_TTL. Con el caché caliente, autenticar un request no
+consulta la base de datos.
+
+Cualquier otro atributo (email, relaciones, etc.) se resuelve cargando la
+entidad User una sola vez por request. Todo commit que modifique o elimine
+un User invalida su copia, sea desde admin.users_edit, la API o la CLI.
+"""
+from collections import namedtuple
+from flask import current_app
+from flask_login import UserMixin
+from sqlalchemy import event
+from extensions import db, cache
+from models.user import User
+
+
+# Lo que se guarda en el caché (tupla simple: serializable con pickle)
+UserSnapshot = namedtuple('UserSnapshot', 'id role area_id supervisor_id is_active first_name last_name')
+
+_PENDING_KEY = 'user_session_changes'
+
+
+def _key(user_id):
+    return f'user:{user_id}'
+
+
+class SessionUser(UserMixin):
+    """Usuario autenticado de solo lectura construido desde un UserSnapshot"""
+
+    __slots__ = ('_snapshot', '_entity')
+
+    def __init__(self, snapshot):
+        object.__setattr__(self, '_snapshot', snapshot)
+        object.__setattr__(self, '_entity', None)
+
+    id = property(lambda self: self._snapshot.id)
+    role = property(lambda self: self._snapshot.role)
+    area_id = property(lambda self: self._snapshot.area_id)
+    supervisor_id = property(lambda self: self._snapshot.supervisor_id)
+    is_active = property(lambda self: self._snapshot.is_active)
+    first_name = property(lambda self: self._snapshot.first_name)
+    last_name = property(lambda self: self._snapshot.last_name)
+
+    @property
+    def full_name(self):
+        return f"{self.first_name} {self.last_name}"
+
+    def get_entity(self):
+        """Entidad User (se consulta la primera vez que se necesita)"""
+        if self._entity is None:
+            object.__setattr__(self, '_entity', db.session.get(User, self.id))
+        return self._entity
+
+    def __getattr__(self, name):
+        # Solo se llama para atributos que no están en la copia
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.get_entity(), name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('SessionUser es de solo lectura; modificar la entidad de get_entity()')
+
+    def __repr__(self):
+        return f'<SessionUser {self.id} {self.role}>'
+
+
+def _snapshot(user_id):
+    row = db.session.query(
+        User.id, User.role, User.area_id, User.supervisor_id, User.is_active,
+        User.first_name, User.last_name
+    ).filter(User.id == user_id).first()
+    return UserSnapshot(*row) if row else None
+
+
+def load_user(user_id):
+    """SessionUser del ID de sesión, o None si el usuario no existe"""
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+
+    key = _key(user_id)
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = _snapshot(user_id)
+        if snapshot is None:
+            return None
+        cache.set(key, snapshot, current_app.config.get('USER_SESSION_TTL', 60))
+    return SessionUser(snapshot)
+
+
+def invalidate(*user_ids):
+    """Descarta la copia en caché de los usuarios indicados"""
+    cache.delete(*(_key(user_id) for user_id in user_ids))
+
+
+def _collect_changes(session, flush_context, instances):
+    """before_flush: usuarios modificados o eliminados"""
+    touched = session.info.setdefault(_PENDING_KEY, set())
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User) and obj.id is not None:
+            touched.add(obj.id)
+
+
+def _after_commit(session):
+    touched = session.info.pop(_PENDING_KEY, None)
+    if touched:
+        invalidate(*touched)
+
+
+def _after_rollback(session, previous_transaction):
+    session.info.pop(_PENDING_KEY, None)
+
+
+def init_app(app):
+    """Registrar listeners de sesión (una sola vez por proceso)"""
+    if event.contains(db.session, 'before_flush', _collect_changes):
+        return
+
+    event.listen(db.session, 'before_flush', _collect_changes)
+    event.listen(db.session, 'after_commit', _after_commit)
+    event.listen(db.session, 'after_soft_rollback', _after_rollback)
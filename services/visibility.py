@@ -0,0 +1,98 @@
+"""
+Alcance de visibilidad de gastos según rol
+
+Todas las vistas que listan o agregan gastos obtienen su filtro desde aquí:
+
+    scope = visibility.for_user(current_user)
+    query = scope.expenses()                      # Expense.query ya filtrado
+    summary = expense_summary(scope.rollups())    # mismo alcance sobre el rollup
+
+- Admin: sin restricción
+- Supervisor: subordinados de todos los niveles (subconsulta sobre
+  user_hierarchy), opcionalmente también los propios
+- User: solo los propios
+
+El filtro es SQL (se compone con cualquier consulta y no materializa IDs).
+Para verificaciones en Python (¿puede ver / aprobar este gasto?) el conjunto
+de subordinados se consulta una sola vez y queda en caché durante el request.
+"""
+from flask import g, has_request_context
+from extensions import db
+from models.expense import Expense
+from models.report import ExpenseMonthlyRollup
+from services.hierarchy_service import subordinate_ids
+
+
+_G_KEY = '_visibility_scopes'
+
+
+class VisibilityScope:
+    """Alcance de un usuario; usar for_user() para obtenerlo"""
+
+    def __init__(self, user):
+        self.user = user
+        self._subordinates = None
+
+    @property
+    def is_global(self):
+        return self.user.role == 'admin'
+
+    def filter(self, user_column, include_self=False):
+        """Condición sobre la columna de usuario (None: sin restricción)"""
+        if self.is_global:
+            return None
+        if self.user.role == 'supervisor':
+            # El propio usuario entra vía la fila depth=0 de la jerarquía
+            return user_column.in_(subordinate_ids(self.user.id, include_self))
+        return user_column == self.user.id
+
+    def apply(self, query, user_column, include_self=False):
+        condition = self.filter(user_column, include_self)
+        return query if condition is None else query.filter(condition)
+
+    def expenses(self, query=None, include_self=False):
+        """Consulta de Expense (por defecto Expense.query) restringida al alcance"""
+        return self.apply(Expense.query if query is None else query, Expense.user_id, include_self)
+
+    def rollups(self, include_self=False):
+        """Filtro equivalente sobre la tabla de rollups mensuales"""
+        return self.filter(ExpenseMonthlyRollup.user_id, include_self)
+
+    def subordinates(self):
+        """IDs de todos los subordinados (una consulta por request)"""
+        if self._subordinates is None:
+            if self.user.role == 'supervisor':
+                self._subordinates = frozenset(db.session.scalars(subordinate_ids(self.user.id)))
+            else:
+                self._subordinates = frozenset()
+        return self._subordinates
+
+    def can_view(self, owner_id, include_self=True):
+        """True si los gastos de owner_id están dentro del alcance"""
+        if owner_id == self.user.id:
+            return include_self
+        return self.is_global or owner_id in self.subordinates()
+
+
+def for_user(user):
+    """
+    Alcance del usuario. Dentro de un request se reutiliza la misma instancia
+    (y su conjunto de subordinados) hasta que el request termina.
+    """
+    if not has_request_context():
+        return VisibilityScope(user)
+
+    scopes = g.setdefault(_G_KEY, {})
+    scope = scopes.get(user.id)
+    if scope is None or scope.user.role != user.role:
+        scope = scopes[user.id] = VisibilityScope(user)
+    return scope
+
+
+def _clear_cache(exc):
+    g.pop(_G_KEY, None)
+
+
+def init_app(app):
+    """El caché vive solo durante el request (el contexto de app puede ser más largo)"""
+    app.teardown_request(_clear_cache)
@@ -4,6 +4,8 @@ Configuración de pytest y fixtures compartidos
 import pytest
 import os
 import sys
+from contextlib import contextmanager
+from sqlalchemy import event
 
 # Agregar el directorio raíz al path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -115,3 +117,60 @@ def init_database(app):
         yield db
 
         db.session.remove()
+
+
+class QueryCounter:
+    """Sentencias SQL ejecutadas dentro de un bloque"""
+
+    def __init__(self):
+        self.statements = []
+
+    def __len__(self):
+        return len(self.statements)
+
+    def __str__(self):
+        return '\n'.join(f'{i + 1}. {statement}' for i, statement in enumerate(self.statements))
+
+
+@pytest.fixture(scope='function')
+def count_queries(app):
+    """
+    Cuenta las sentencias SQL ejecutadas en un bloque:
+
+        with count_queries() as queries:
+            client.get('/api/v1/expenses')
+        assert len(queries) == 3
+    """
+    @contextmanager
+    def counter():
+        queries = QueryCounter()
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            queries.statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield queries
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    return counter
+
+
+@pytest.fixture(scope='function')
+def assert_num_queries(count_queries):
+    """
+    Verifica la cantidad exacta de sentencias SQL de un bloque:
+
+        with assert_num_queries(3):
+            client.get('/api/v1/expenses')
+    """
+    @contextmanager
+    def check(expected):
+        with count_queries() as queries:
+            yield queries
+        assert len(queries) == expected, (
+            f'Se esperaban {expected} consultas SQL y se ejecutaron {len(queries)}:\n{queries}'
+        )
+
+    return check
@@ -353,4 +353,979 @@ class TestStatsAPI:
             assert data['success'] is True
             assert 'total_expenses' in data['data']
             assert 'pending' in data['data']
-            assert 'approved' in data['data']
\ No newline at end of file
+            assert 'approved' in data['data']
+
+class TestCursorPagination:
+    """Tests para paginación por cursor (keyset)"""
+
+    @pytest.fixture
+    def many_expenses(self, app, init_database):
+        from extensions import db
+        user = User.query.filter_by(email="user@test.com").first()
+        company = Company.query.first()
+        # Varios gastos comparten created_at para probar el desempate por id
+        timestamps = [datetime(2024, 1, 1 + i // 3, 12, 0) for i in range(25)]
+        for i, created_at in enumerate(timestamps):
+            db.session.add(Expense(
+                user_id=user.id, client_id=company.id, amount=1000 + i,
+                category="Transporte", reason=f"Gasto {i}", receipt_image="test.jpg",
+                expense_date=created_at.date(), created_at=created_at
+            ))
+        db.session.commit()
+        return [e.id for e in Expense.query.order_by(Expense.created_at.desc(), Expense.id.desc())]
+
+    def test_walk_all_pages(self, client, app, many_expenses):
+        """Test recorrer todas las páginas sin repetir ni omitir gastos"""
+        with client:
+            login(client, 'user@test.com', 'user123')
+
+            seen = []
+            cursor = ''
+            while True:
+                response = client.get(f'/api/v1/expenses?per_page=10&cursor={cursor}')
+                assert response.status_code == 200
+                data = json.loads(response.data)['data']
+                assert data['total'] == 25
+                seen += [e['id'] for e in data['expenses']]
+                if not data['has_next']:
+                    break
+                cursor = data['next_cursor']
+
+            assert seen == many_expenses
+
+    def test_skip_count(self, client, app, many_expenses):
+        """Test count=false omite el total"""
+        with client:
+            login(client, 'user@test.com', 'user123')
+            response = client.get('/api/v1/expenses?cursor=&count=false&per_page=5')
+            data = json.loads(response.data)['data']
+            assert 'total' not in data
+            assert len(data['expenses']) == 5
+            assert data['next_cursor']
+
+    def test_invalid_cursor(self, client, app, many_expenses):
+        """Test cursor inválido retorna 400"""
+        with client:
+            login(client, 'user@test.com', 'user123')
+            response = client.get('/api/v1/expenses?cursor=no-es-un-cursor')
+            assert response.status_code == 400
+
+    def test_html_listing_with_cursor(self, client, app, many_expenses):
+        """Test listado web con cursor muestra el enlace a la página siguiente"""
+        with client:
+            login(client, 'user@test.com', 'user123')
+            response = client.get('/expenses/my?cursor=&count=false')
+            assert response.status_code == 200
+            assert b'Siguiente' in response.data
+            assert b'cursor=' in response.data
+
+
+class TestQueryCounts:
+    """Tests de cantidad de consultas SQL por endpoint (sin N+1)"""
+
+    @pytest.fixture
+    def expenses(self, app, init_database):
+        from extensions import db
+        company = Company.query.first()
+        users = User.query.all()
+        for i in range(30):
+            db.session.add(Expense(
+                user_id=users[i % len(users)].id, client_id=company.id, amount=1000,
+                category="Transporte", reason="Test", receipt_image="test.jpg",
+                expense_date=datetime.now().date()
+            ))
+        db.session.commit()
+
+    def test_list_expenses_queries_do_not_grow(self, client, app, expenses, count_queries):
+        """Test la cantidad de consultas no depende del tamaño de la página"""
+        with client:
+            login(client, 'admin@test.com', 'admin123')
+
+            with count_queries() as small_page:
+                client.get('/api/v1/expenses?per_page=2')
+            with count_queries() as large_page:
+                response = client.get('/api/v1/expenses?per_page=30')
+
+            assert len(json.loads(response.data)['data']['expenses']) == 30
+            assert len(large_page) == len(small_page), str(large_page)
+
+    def test_list_expenses_query_count(self, client, app, expenses, assert_num_queries):
+        """Test listado: página con relaciones y total"""
+        with client:
+            login(client, 'admin@test.com', 'admin123')
+            with assert_num_queries(2):
+                client.get('/api/v1/expenses?per_page=30')
+            with assert_num_queries(1):
+                client.get('/api/v1/expenses?cursor=&count=false&per_page=30')
+
+    def test_get_expense_query_count(self, client, app, expenses, assert_num_queries):
+        """Test detalle de gasto: validadores HTTP y gasto con relaciones (304: solo validadores)"""
+        expense_id = Expense.query.first().id
+        with client:
+            login(client, 'admin@test.com', 'admin123')
+            with assert_num_queries(2):
+                response = client.get(f'/api/v1/expenses/{expense_id}')
+            with assert_num_queries(1):
+                client.get(f'/api/v1/expenses/{expense_id}', headers={'If-None-Match': response.headers['ETag']})
+
+    def test_list_users_query_count(self, client, app, init_database, assert_num_queries):
+        """Test listado de usuarios carga las áreas en la misma consulta"""
+        with client:
+            login(client, 'admin@test.com', 'admin123')
+            with assert_num_queries(1):
+                client.get('/api/v1/users')
+
+
+class TestSparseFieldsets:
+    """Tests para fields= / include= en listados"""
+
+    @pytest.fixture
+    def expense(self, app, init_database):
+        from extensions import db
+        user = User.query.filter_by(email="user@test.com").first()
+        company = Company.query.first()
+        expense = Expense(
+            user_id=user.id, client_id=company.id, amount=12345,
+            category="Transporte", reason="Taxi", receipt_image="test.jpg",
+            expense_date=datetime(2024, 3, 15).date(),
+            ocr_data={'raw_text': 'x' * 1000}
+        )
+        db.session.add(expense)
+        db.session.commit()
+        return expense.id
+
+    def test_fields(self, client, app, expense, count_queries):
+        """Test solo se devuelven y seleccionan los campos pedidos"""
+        with client:
+            login(client, 'user@test.com', 'user123')
+            with count_queries() as queries:
+                response = client.get('/api/v1/expenses?fields=amount,status,expense_date')
+
+            item = json.loads(response.data)['data']['expenses'][0]
+            assert item == {'id': expense, 'amount': 12345.0, 'status': 'pending', 'expense_date': '2024-03-15'}
+            page_query = [q for q in queries.statements if 'LIMIT' in q][0]
+            assert 'ocr_data' not in page_query
+            assert 'reason' not in page_query
+
+    def test_include(self, client, app, expense):
+        """Test include agrega usuario y cliente con un join"""
+        with client:
+            login(client, 'user@test.com', 'user123')
+            response = client.get('/api/v1/expenses?fields=amount&include=user,client')
+            item = json.loads(response.data)['data']['expenses'][0]
+            assert item['user']['full_name'] == 'User Test'
+            assert item['client']['name'] == 'Cliente Test'
+            assert 'reason' not in item
+
+    def test_fields_with_cursor(self, client, app, expense):
+        """Test sparse fieldsets con paginación por cursor"""
+        with client:
+            login(client, 'user@test.com', 'user123')
+            response = client.get('/api/v1/expenses?cursor=&fields=amount')
+            data = json.loads(response.data)['data']
+            assert data['expenses'] == [{'id': expense, 'amount': 12345.0}]
+
+    def test_unknown_field(self, client, app, expense):
+        """Test campo desconocido retorna 400"""
+        with client:
+            login(client, 'user@test.com', 'user123')
+            response = client.get('/api/v1/expenses?fields=amount,password_hash')
+            assert response.status_code == 400
+
+    def test_users_fields(self, client, app, init_database):
+        """Test sparse fieldsets en el listado de usuarios"""
+        with client:
+            login(client, 'admin@test.com', 'admin123')
+            response = client.get('/api/v1/users?fields=email&include=area')
+            users = json.loads(response.data)['data']
+            assert set(users[0]) == {'id', 'email', 'area'}
+            assert users[0]['area']['name'] == 'IT'
+
+
+class TestExpenseExport:
+    """Tests para la exportación en streaming (CSV / NDJSON)"""
+
+    @pytest.fixture
+    def expenses(self, app, init_database):
+        from extensions import db
+        company = Company.query.first()
+        user = User.query.filter_by(email="user@test.com").first()
+        admin = User.query.filter_by(email="admin@test.com").first()
+        for i in range(5):
+            db.session.add(Expense(
+                user_id=user.id, client_id=company.id, amount=1000 + i,
+                category="Transporte", reason=f"Taxi, viaje {i}", receipt_image="test.jpg",
+                expense_date=datetime(2024, 3, 1 + i).date(),
+                status='approved' if i % 2 else 'pending'
+            ))
+        db.session.add(Expense(
+            user_id=admin.id, client_id=company.id, amount=50000,
+            category="Alojamiento", reason="Hotel", receipt_image="test.jpg",
+            expense_date=datetime(2024, 4, 1).date()
+        ))
+        db.session.commit()
+
+    def test_export_csv(self, client, app, expenses):
+        """Test CSV con encabezado y una fila por gasto"""
+        import csv
+        import io
+        with client:
+            login(client, 'user@test.com', 'user123')
+            response = client.get('/api/v1/expenses/export?format=csv')
+            assert response.status_code == 200
+            assert response.is_streamed
+            assert response.mimetype == 'text/csv'
+            assert 'attachment' in response.headers['Content-Disposition']
+
+            rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+            assert len(rows) == 5
+            assert rows[0]['reason'] == 'Taxi, viaje 0'
+            assert rows[0]['amount'] == '1000.0'
+            assert 'ocr_data' not in rows[0]
+
+    def test_export_ndjson_with_filters(self, client, app, expenses):
+        """Test NDJSON con filtros, campos e include"""
+        with client:
+            login(client, 'admin@test.com', 'admin123')
+            response = client.get('/api/v1/expenses/export?format=ndjson&status=approved'
+                                  '&date_from=2024-03-01&date_to=2024-03-31&fields=amount&include=user')
+            assert response.status_code == 200
+            assert response.mimetype == 'application/x-ndjson'
+
+            lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+            assert [line['amount'] for line in lines] == [1001.0, 1003.0]
+            assert lines[0]['user']['email'] == 'user@test.com'
+            assert set(lines[0]) == {'id', 'amount', 'user'}
+
+    def test_export_csv_include_columns(self, client, app, expenses):
+        """Test los includes se exportan como columnas user.*"""
+        with client:
+            login(client, 'admin@test.com', 'admin123')
+            response = client.get('/api/v1/expenses/export?format=csv&fields=amount&include=user')
+            header = response.get_data(as_text=True).splitlines()[0]
+            assert header == 'id,amount,user.id,user.full_name,user.email'
+
+    def test_export_respects_scope(self, client, app, expenses):
+        """Test un usuario no exporta gastos de otros"""
+        with client:
+            login(client, 'user@test.com', 'user123')
+            response = client.get('/api/v1/expenses/export?format=ndjson')
+            lines = response.get_data(as_text=True).splitlines()
+            assert len(lines) == 5
+            assert all(json.loads(line)['category'] == 'Transporte' for line in lines)
+
+    def test_export_without_own_expenses(self, client, app, expenses):
+        """Test include_self=0 deja fuera los gastos propios del supervisor (mismo alcance que los reportes)"""
+        from extensions import db
+        supervisor = User.query.filter_by(email='supervisor@test.com').first()
+        db.session.add(Expense(
+            user_id=supervisor.id, client_id=Company.query.first().id, amount=7000,
+            category="Alimentación", reason="Almuerzo", receipt_image="test.jpg",
+            expense_date=datetime(2024, 3, 10).date()
+        ))
+        db.session.commit()
+        with client:
+            login(client, 'supervisor@test.com', 'super123')
+            everything = client.get('/api/v1/expenses/export?format=ndjson').get_data(as_text=True).splitlines()
+            team = client.get('/api/v1/expenses/export?format=ndjson&include_self=0').get_data(as_text=True)
+            assert len(everything) == 6
+            assert [json.loads(line)['category'] for line in team.splitlines()] == ['Transporte'] * 5
+
+    def test_export_invalid_format(self, client, app, expenses):
+        """Test formato o fecha inválidos retornan 400"""
+        with client:
+            login(client, 'user@test.com', 'user123')
+            assert client.get('/api/v1/expenses/export?format=xlsx').status_code == 400
+            assert client.get('/api/v1/expenses/export?format=csv&date_from=marzo').status_code == 400
+
+
+class TestBatchApprovals:
+    """Tests para aprobación / rechazo masivo"""
+
+    @pytest.fixture
+    def pending_expenses(self, app, init_database):
+        from extensions import db
+        user = User.query.filter_by(email="user@test.com").first()
+        company = Company.query.first()
+        expenses = [
+            Expense(
+                user_id=user.id, client_id=company.id, amount=1000 * (i + 1),
+                category="Transporte", reason="Test", receipt_image="test.jpg",
+                expense_date=datetime(2024, 5, 10).date()
+            )
+            for i in range(6)
+        ]
+        db.session.add_all(expenses)
+        db.session.commit()
+        return [e.id for e in expenses]
+
+    def post_batch(self, client, payload):
+        return client.post('/api/v1/approvals/batch', data=json.dumps(payload),
+                           content_type='application/json')
+
+    def test_batch_approve(self, client, app, pending_expenses):
+        """Test aprobar varios gastos con resultado por gasto"""
+        from models.approval import Approval
+        from models.report import ExpenseMonthlyRollup
+        with client:
+            login(client, 'supervisor@test.com', 'super123')
+            response = self.post_batch(client, {
+                'expense_ids': pending_expenses[:4] + [999999], 'action': 'approved', 'comments': 'OK'
+            })
+            assert response.status_code == 200
+            data = json.loads(response.data)['data']
+            assert data['processed'] == 4
+            assert data['results'][-1] == {'expense_id': 999999, 'success': False, 'error': 'Gasto no encontrado'}
+
+            approved = Expense.query.filter(Expense.status == 'approved').count()
+            assert approved == 4
+            assert Approval.query.filter_by(action='approved', comments='OK').count() == 4
+
+            # El rollup refleja los cambios de estado
+            bucket = ExpenseMonthlyRollup.query.filter_by(status='approved', year=2024, month=5).one()
+            assert bucket.expense_count == 4
+            assert float(bucket.total_amount) == 10000
+
+    def test_batch_partial_failures(self, client, app, pending_expenses):
+        """Test gastos ya procesados o de clientes pendientes no bloquean al resto"""
+        from extensions import db
+        first, second = Expense.query.filter(Expense.id.in_(pending_expenses[:2])).order_by(Expense.id)
+        first.status = 'rejected'
+        pending_client = Company(name='Cliente Pendiente', rut='77.777.777-7', status='pending')
+        db.session.add(pending_client)
+        db.session.flush()
+        second.client_id = pending_client.id
+        db.session.commit()
+
+        with client:
+            login(client, 'admin@test.com', 'admin123')
+            response = self.post_batch(client, {'expense_ids': pending_expenses, 'action': 'approved'})
+            results = json.loads(response.data)['data']['results']
+            assert [r['success'] for r in results] == [False, False, True, True, True, True]
+            assert results[0]['error'] == 'Este gasto ya fue procesado'
+            assert 'pendiente' in results[1]['error']
+
+    def test_batch_reject_requires_comments(self, client, app, pending_expenses):
+        """Test rechazo masivo sin motivo retorna 400"""
+        with client:
+            login(client, 'supervisor@test.com', 'super123')
+            response = self.post_batch(client, {'expense_ids': pending_expenses, 'action': 'rejected'})
+            assert response.status_code == 400
+            assert Expense.query.filter_by(status='pending').count() == len(pending_expenses)
+
+    def test_batch_own_expenses_and_role(self, client, app, pending_expenses):
+        """Test un usuario no puede usar el endpoint ni aprobar gastos propios"""
+        with client:
+            login(client, 'user@test.com', 'user123')
+            response = self.post_batch(client, {'expense_ids': pending_expenses, 'action': 'approved'})
+            assert response.status_code == 403
+
+    def test_batch_query_count(self, client, app, pending_expenses, count_queries):
+        """Test las consultas no crecen con el tamaño del lote"""
+        with client:
+            login(client, 'supervisor@test.com', 'super123')
+            # El primer lote crea el bucket 'approved' del rollup
+            self.post_batch(client, {'expense_ids': pending_expenses[:1], 'action': 'approved'})
+            with count_queries() as small:
+                self.post_batch(client, {'expense_ids': pending_expenses[1:2], 'action': 'approved'})
+            with count_queries() as large:
+                self.post_batch(client, {'expense_ids': pending_expenses[2:], 'action': 'approved'})
+            # Un UPDATE (executemany) y un INSERT para todo el lote
+            assert sum(q.startswith('UPDATE expenses') for q in large.statements) == 1
+            assert sum(q.startswith('INSERT INTO approvals') for q in large.statements) == 1
+            assert len(large) <= len(small), str(large)
+
+    def test_batch_form(self, client, app, pending_expenses):
+        """Test formulario de aprobación masiva en la lista de pendientes"""
+        with client:
+            login(client, 'supervisor@test.com', 'super123')
+            response = client.get('/approvals/pending')
+            assert b'name="expense_ids"' in response.data
+
+            response = client.post('/approvals/batch', data={
+                'expense_ids': [str(i) for i in pending_expenses[:3]],
+                'action': 'rejected',
+                'comments': 'Sin respaldo'
+            }, follow_redirects=True)
+            assert response.status_code == 200
+            assert '3 gasto(s) rechazado(s)'.encode() in response.data
+            assert Expense.query.filter_by(status='rejected').count() == 3
+
+
+class TestBulkCreateExpenses:
+    """Tests para la carga masiva de gastos"""
+
+    def rows(self, app, count=3, **overrides):
+        company = Company.query.first()
+        rows = []
+        for i in range(count):
+            row = {
+                'amount': 1000 + i, 'category': 'Transporte', 'reason': f'Tarjeta {i}',
+                'client_id': company.id, 'receipt_image': f'feed-{i}.jpg', 'expense_date': '2024-06-15'
+            }
+            row.update(overrides)
+            rows.append(row)
+        return rows
+
+    def test_bulk_json_array(self, client, app, init_database):
+        """Test arreglo JSON con errores por fila"""
+        from models.report import ExpenseMonthlyRollup
+        with client:
+            login(client, 'user@test.com', 'user123')
+            rows = self.rows(app)
+            rows.insert(1, dict(rows[0], category='Desconocida'))
+            rows.append(dict(rows[0], amount=999999))  # Supera el máximo de Transporte
+            rows.append(dict(rows[0], client_id=None))
+
+            response = client.post('/api/v1/expenses/bulk', data=json.dumps(rows),
+                                   content_type='application/json')
+            assert response.status_code == 201
+            data = json.loads(response.data)['data']
+            assert [c['index'] for c in data['created']] == [0, 2, 3]
+            assert [(e['index'], e['field']) for e in data['errors']] == [
+                (1, 'category'), (4, 'amount'), (5, 'client_id')
+            ]
+
+            created = Expense.query.filter(Expense.id.in_([c['id'] for c in data['created']]))
+            assert sorted(float(e.amount) for e in created) == [1000, 1001, 1002]
+
+            # Rollup actualizado aunque el INSERT no pase por el ORM
+            bucket = ExpenseMonthlyRollup.query.filter_by(year=2024, month=6, status='pending').one()
+            assert bucket.expense_count == 3
+            assert float(bucket.total_amount) == 3003
+
+    def test_bulk_ndjson(self, client, app, init_database):
+        """Test NDJSON con una línea inválida"""
+        with client:
+            login(client, 'user@test.com', 'user123')
+            lines = [json.dumps(row) for row in self.rows(app)]
+            lines.insert(2, '{no es json')
+            response = client.post('/api/v1/expenses/bulk', data='\n'.join(lines) + '\n',
+                                   content_type='application/x-ndjson')
+            assert response.status_code == 201
+            data = json.loads(response.data)['data']
+            assert len(data['created']) == 3
+            assert data['errors'] == [{'index': 2, 'error': 'JSON inválido', 'field': None}]
+
+    def test_bulk_lookups(self, client, app, init_database, count_queries):
+        """Test categorías y clientes se consultan por bloque, no por fila"""
+        app.config['BULK_IMPORT_CHUNK_SIZE'] = 4
+        with client:
+            login(client, 'user@test.com', 'user123')
+            body = json.dumps(self.rows(app, 10))
+            with count_queries() as queries:
+                response = client.post('/api/v1/expenses/bulk', data=body, content_type='application/json')
+            assert len(json.loads(response.data)['data']['created']) == 10
+            selects = [q for q in queries.statements if q.startswith('SELECT')]
+            assert sum('FROM expense_categories' in q for q in selects) == 1
+            # El cliente ya consultado en el primer bloque no se vuelve a pedir
+            assert sum('FROM clients' in q for q in selects) == 1
+
+    def test_bulk_limits(self, client, app, init_database):
+        """Test cuerpo inválido y límite de filas"""
+        app.config['BULK_IMPORT_MAX_ROWS'] = 2
+        with client:
+            login(client, 'user@test.com', 'user123')
+            response = client.post('/api/v1/expenses/bulk', data=json.dumps({'foo': 1}),
+                                   content_type='application/json')
+            assert response.status_code == 400
+
+            response = client.post('/api/v1/expenses/bulk', data=json.dumps(self.rows(app)),
+                                   content_type='application/json')
+            assert response.status_code == 400
+            assert Expense.query.count() == 0
+
+    def test_bulk_idempotency_key(self, client, app, init_database):
+        """Test un reintento con la misma clave no duplica gastos"""
+        with client:
+            login(client, 'user@test.com', 'user123')
+            body = json.dumps(self.rows(app))
+            headers = {'Idempotency-Key': 'feed-2024-06-15'}
+
+            first = client.post('/api/v1/expenses/bulk', data=body, headers=headers,
+                                content_type='application/json')
+            retry = client.post('/api/v1/expenses/bulk', data=body, headers=headers,
+                                content_type='application/json')
+            assert first.status_code == retry.status_code == 201
+            assert retry.headers['Idempotent-Replayed'] == 'true'
+            assert json.loads(retry.data) == json.loads(first.data)
+            assert Expense.query.count() == 3
+
+            other = client.post('/api/v1/expenses/bulk', data=json.dumps(self.rows(app, 1)),
+                                headers=headers, content_type='application/json')
+            assert other.status_code == 422
+            assert Expense.query.count() == 3
+
+
+class TestReferenceDataCache:
+    """Tests para el caché de clientes, categorías y áreas"""
+
+    def test_cached_between_requests(self, client, app, init_database, count_queries):
+        """Test la segunda lectura no consulta la base de datos"""
+        with client:
+            login(client, 'user@test.com', 'user123')
+            first = client.get('/api/v1/clients')
+            with count_queries() as queries:
+                second = client.get('/api/v1/clients')
+            assert first.get_json()['data'] == second.get_json()['data']
+            assert not [q for q in queries.statements if 'FROM clients' in q]
+
+            from extensions import cache
+            assert cache.stats()['reference']['hits'] >= 1
+
+    def test_invalidated_on_commit(self, client, app, init_database):
+        """Test crear o desactivar un registro invalida la entrada"""
+        from extensions import db
+        from models.company import ExpenseCategory
+        with client:
+            login(client, 'user@test.com', 'user123')
+            names = [c['name'] for c in client.get('/api/v1/categories').get_json()['data']]
+            assert 'Capacitación' not in names
+
+            db.session.add(ExpenseCategory(name='Capacitación', max_amount=50000))
+            db.session.commit()
+            names = [c['name'] for c in client.get('/api/v1/categories').get_json()['data']]
+            assert 'Capacitación' in names
+
+            company = Company.query.first()
+            company.is_active = False
+            db.session.commit()
+            assert client.get('/api/v1/clients').get_json()['data'] == []
+
+    def test_other_worker_change(self, client, app, init_database):
+        """Test un cambio confirmado en otro worker (sin invalidar este caché) cambia ETag y datos"""
+        from sqlalchemy import update
+        from extensions import db
+        from services import http_cache
+        with client:
+            login(client, 'user@test.com', 'user123')
+            etag = client.get('/api/v1/clients').headers['ETag']
+
+            db.session.execute(update(Company).values(name='Nombre nuevo'))
+            http_cache.bump(db.session.connection(), ['clients'])
+            db.session.commit()
+            response = client.get('/api/v1/clients', headers={'If-None-Match': etag})
+            assert response.status_code == 200
+            assert response.headers['ETag'] != etag
+            assert [c['name'] for c in response.get_json()['data']] == ['Nombre nuevo']
+
+    def test_rollback_keeps_entry(self, client, app, init_database, count_queries):
+        """Test un rollback no invalida el caché"""
+        from extensions import db
+        with client:
+            login(client, 'user@test.com', 'user123')
+            client.get('/api/v1/clients')
+            Company.query.first().name = 'Otro nombre'
+            db.session.flush()
+            db.session.rollback()
+            with count_queries() as queries:
+                client.get('/api/v1/clients')
+            assert not [q for q in queries.statements if 'FROM clients' in q]
+
+    def test_ttl_expiry(self, app, monkeypatch):
+        """Test SimpleCache descarta entradas vencidas"""
+        from utils import cache as cache_module
+        backend = cache_module.SimpleCache()
+        now = [1000.0]
+        monkeypatch.setattr(cache_module.time, 'monotonic', lambda: now[0])
+        backend.set('reference:clients', ('a',), ttl=60)
+        assert backend.get('reference:clients') == ('a',)
+        now[0] += 61
+        assert backend.get('reference:clients') is cache_module._MISSING
+
+    def test_pluggable_backend(self):
+        """Test el backend se elige por ruta de importación"""
+        from app import create_app
+        from extensions import cache
+
+        class DictBackend(dict):
+            def get(self, key):
+                from utils.cache import _MISSING
+                return dict.get(self, key, _MISSING)
+
+            def set(self, key, value, ttl=None):
+                self[key] = value
+
+            def delete(self, key):
+                self.pop(key, None)
+
+        app = create_app()
+        app.config['CACHE_BACKEND'] = DictBackend
+        cache.init_app(app)
+        with app.app_context():
+            assert cache.get_or_set('reference:test', lambda: 42) == 42
+            assert cache.backend['reference:test'] == 42
+
+    def test_stats_endpoint(self, client, app, init_database):
+        """Test estadísticas por espacio de nombres"""
+        with client:
+            login(client, 'admin@test.com', 'admin123')
+            client.get('/api/v1/categories')
+            client.get('/api/v1/categories')
+            data = client.get('/api/v1/cache/stats').get_json()['data']
+            assert data['backend'] == 'SimpleCache'
+            assert data['namespaces']['reference']['misses'] >= 1
+            assert data['namespaces']['reference']['hits'] >= 1
+
+    def test_stats_endpoint_admin_only(self, client, app, init_database):
+        """Test estadísticas solo para admin"""
+        with client:
+            login(client, 'user@test.com', 'user123')
+            assert client.get('/api/v1/cache/stats').status_code == 403
+
+
+class TestSessionUserCache:
+    """Tests para el usuario de sesión en caché (user_loader)"""
+
+    def user_id(self, email='user@test.com'):
+        return User.query.filter_by(email=email).first().id
+
+    def test_load_user_cached(self, app, init_database, count_queries):
+        """Test la segunda carga no consulta la tabla users"""
+        from services.user_session import load_user, SessionUser
+        user_id = self.user_id()
+        first = load_user(str(user_id))
+        with count_queries() as queries:
+            second = load_user(str(user_id))
+        assert len(queries) == 0
+        assert isinstance(second, SessionUser)
+        assert (second.id, second.role, second.is_authenticated) == (user_id, 'user', True)
+        assert second == first
+        assert load_user('999999') is None
+        assert load_user('abc') is None
+
+    def test_snapshot_is_read_only(self, app, init_database, count_queries):
+        """Test atributos fuera de la copia se cargan de la entidad una sola vez"""
+        from extensions import db
+        from services.user_session import load_user
+        user = load_user(self.user_id())
+        db.session.expunge_all()  # Sin entidades en el mapa de identidad
+        with pytest.raises(AttributeError):
+            user.role = 'admin'
+        with count_queries() as queries:
+            assert user.full_name == 'User Test'
+        assert len(queries) == 0
+        with count_queries() as queries:
+            assert user.email == 'user@test.com'
+            assert user.get_entity().email == 'user@test.com'
+        assert len(queries) == 1
+
+    def test_invalidated_on_admin_edit(self, client, app, init_database):
+        """Test editar un usuario desde admin descarta su copia"""
+        from services.user_session import load_user
+        user_id = self.user_id()
+        assert load_user(user_id).role == 'user'
+        with client:
+            login(client, 'admin@test.com', 'admin123')
+            response = client.post(f'/admin/users/{user_id}/edit', data={
+                'email': 'user@test.com', 'first_name': 'User', 'last_name': 'Test',
+                'role': 'supervisor', 'area_id': User.query.get(user_id).area_id
+            })
+            assert response.status_code == 302
+        assert load_user(user_id).role == 'supervisor'
+
+    def test_can_approve_with_snapshot(self, app, init_database, count_queries):
+        """Test permisos de aprobación sin cargar la entidad User"""
+        from extensions import db
+        from services.approval_service import can_approve_expense
+        from services.user_session import load_user
+        supervisor = load_user(self.user_id('supervisor@test.com'))
+        expense = Expense(user_id=self.user_id(), amount=1000, category='Transporte',
+                          reason='Taxi', receipt_image='r.jpg', client_id=Company.query.first().id,
+                          expense_date=datetime(2024, 6, 1).date())
+        db.session.add(expense)
+        db.session.commit()
+        with count_queries() as queries:
+            assert can_approve_expense(supervisor, expense)
+        assert not [q for q in queries.statements if 'FROM users' in q]
+
+
+class TestConditionalRequests:
+    """Tests para ETag / If-None-Match / If-Modified-Since"""
+
+    @pytest.fixture
+    def expense(self, app, init_database):
+        from extensions import db
+        expense = Expense(
+            user_id=User.query.filter_by(email='user@test.com').first().id,
+            client_id=Company.query.first().id, amount=1000, category='Transporte',
+            reason='Taxi', receipt_image='test.jpg', expense_date=datetime(2024, 6, 1).date()
+        )
+        db.session.add(expense)
+        db.session.commit()
+        return expense.id
+
+    def test_expense_not_modified(self, client, app, expense):
+        """Test 304 mientras el gasto no cambie; 200 con nuevo ETag al cambiar"""
+        from extensions import db
+        with client:
+            login(client, 'user@test.com', 'user123')
+            first = client.get(f'/api/v1/expenses/{expense}')
+            etag = first.headers['ETag']
+            assert first.headers['Last-Modified']
+            assert 'no-cache' in first.headers['Cache-Control']
+
+            again = client.get(f'/api/v1/expenses/{expense}', headers={'If-None-Match': etag})
+            assert again.status_code == 304
+            assert again.data == b''
+            assert again.headers['ETag'] == etag
+
+            db.session.get(Expense, expense).reason = 'Taxi aeropuerto'
+            db.session.commit()
+            changed = client.get(f'/api/v1/expenses/{expense}', headers={'If-None-Match': etag})
+            assert changed.status_code == 200
+            assert changed.headers['ETag'] != etag
+            assert changed.get_json()['data']['reason'] == 'Taxi aeropuerto'
+
+    def test_expense_etag_follows_client_name(self, client, app, expense):
+        """Test renombrar el cliente cambia el ETag del gasto"""
+        from extensions import db
+        with client:
+            login(client, 'user@test.com', 'user123')
+            etag = client.get(f'/api/v1/expenses/{expense}').headers['ETag']
+            Company.query.first().name = 'Nuevo nombre'
+            db.session.commit()
+            response = client.get(f'/api/v1/expenses/{expense}', headers={'If-None-Match': etag})
+            assert response.status_code == 200
+            assert response.get_json()['data']['client_name'] == 'Nuevo nombre'
+
+    def test_permissions_checked_before_304(self, client, app, expense):
+        """Test un usuario sin permiso recibe 403 aunque envíe If-None-Match"""
+        from extensions import db
+        db.session.get(Expense, expense).user_id = User.query.filter_by(email='admin@test.com').first().id
+        db.session.commit()
+        with client:
+            login(client, 'user@test.com', 'user123')
+            response = client.get(f'/api/v1/expenses/{expense}', headers={'If-None-Match': '*'})
+            assert response.status_code == 403
+            assert 'ETag' not in response.headers
+            assert client.get('/api/v1/expenses/999999', headers={'If-None-Match': '*'}).status_code == 404
+
+    def test_collections_not_modified(self, client, app, init_database, count_queries):
+        """Test 304 en clientes, categorías y resumen sin cargar los datos"""
+        from extensions import db
+        from models.company import ExpenseCategory
+        with client:
+            login(client, 'user@test.com', 'user123')
+            etags = {url: client.get(url).headers['ETag']
+                     for url in ('/api/v1/clients', '/api/v1/categories', '/api/v1/stats/summary')}
+            for url, etag in etags.items():
+                with count_queries() as queries:
+                    response = client.get(url, headers={'If-None-Match': etag})
+                assert response.status_code == 304, url
+                assert len(queries) == 1, str(queries)
+
+            db.session.add(ExpenseCategory(name='Capacitación'))
+            db.session.commit()
+            assert client.get('/api/v1/categories', headers={
+                'If-None-Match': etags['/api/v1/categories']}).status_code == 200
+            assert client.get('/api/v1/clients', headers={
+                'If-None-Match': etags['/api/v1/clients']}).status_code == 304
+
+    def test_stats_change_after_bulk_import(self, client, app, init_database):
+        """Test la carga masiva (sin ORM) también cambia la versión de gastos"""
+        with client:
+            login(client, 'user@test.com', 'user123')
+            etag = client.get('/api/v1/stats/summary').headers['ETag']
+            row = {'amount': 1000, 'category': 'Transporte', 'reason': 'Tarjeta',
+                   'client_id': Company.query.first().id, 'receipt_image': 'feed.jpg'}
+            client.post('/api/v1/expenses/bulk', data=json.dumps([row]), content_type='application/json')
+            response = client.get('/api/v1/stats/summary', headers={'If-None-Match': etag})
+            assert response.status_code == 200
+            assert response.get_json()['data']['total_expenses'] == 1
+
+    def test_ocr_result_does_not_bump_version(self, client, app, expense):
+        """Test guardar el OCR de un gasto no invalida los agregados, solo el ETag del gasto"""
+        from extensions import db
+        with client:
+            login(client, 'user@test.com', 'user123')
+            stats_etag = client.get('/api/v1/stats/summary').headers['ETag']
+            expense_etag = client.get(f'/api/v1/expenses/{expense}').headers['ETag']
+
+            db.session.get(Expense, expense).ocr_data = {'success': True, 'raw_text': 'TOTAL 1000'}
+            db.session.commit()
+            assert client.get('/api/v1/stats/summary', headers={'If-None-Match': stats_etag}).status_code == 304
+            assert client.get(f'/api/v1/expenses/{expense}', headers={
+                'If-None-Match': expense_etag}).status_code == 200
+
+            db.session.get(Expense, expense).amount = 2500
+            db.session.commit()
+            assert client.get('/api/v1/stats/summary', headers={'If-None-Match': stats_etag}).status_code == 200
+
+    def test_bump_creates_and_increments(self, app, init_database):
+        """Test bump crea la fila de una tabla nueva y luego la incrementa (upsert)"""
+        from extensions import db
+        from models.table_version import TableVersion
+        from services import http_cache
+        for _ in range(2):
+            http_cache.bump(db.session.connection(), ['reports'])
+        db.session.commit()
+        assert db.session.get(TableVersion, 'reports').version == 2
+
+    def test_if_modified_since(self, client, app, expense):
+        """Test If-Modified-Since sin If-None-Match"""
+        with client:
+            login(client, 'user@test.com', 'user123')
+            last_modified = client.get(f'/api/v1/expenses/{expense}').headers['Last-Modified']
+            response = client.get(f'/api/v1/expenses/{expense}', headers={'If-Modified-Since': last_modified})
+            assert response.status_code == 304
+            response = client.get(f'/api/v1/expenses/{expense}', headers={
+                'If-Modified-Since': 'Mon, 01 Jan 2001 00:00:00 GMT'})
+            assert response.status_code == 200
+
+
+class TestExpenseSearch:
+    """Tests para la búsqueda de texto completo"""
+
+    @pytest.fixture
+    def searchable(self, app, init_database):
+        from extensions import db
+        users = {u.role: u for u in User.query.all()}
+        client_test = Company.query.first()
+        other = Company(rut='96.555.444-3', name='Constructora Andes', status='active', is_active=True)
+        db.session.add(other)
+        db.session.flush()
+
+        def add(owner, reason, company, raw_text=None):
+            expense = Expense(
+                user_id=users[owner].id, client_id=company.id, amount=1000, category='Transporte',
+                reason=reason, receipt_image='r.jpg', expense_date=datetime(2024, 6, 1).date(),
+                ocr_data={'success': True, 'raw_text': raw_text} if raw_text else None
+            )
+            db.session.add(expense)
+            return expense
+
+        expenses = {
+            'airport': add('user', 'Taxi al aeropuerto', client_test, 'RADIO TAXI SpA TOTAL 12000'),
+            'lunch': add('user', 'Almuerzo de trabajo', client_test, 'Restaurante El Taxista TOTAL 8000'),
+            'board': add('supervisor', 'Taxi reunión directorio', client_test),
+            'hotel': add('admin', 'Hotel en Concepción', other),
+        }
+        db.session.commit()
+        return {name: expense.id for name, expense in expenses.items()}
+
+    def search(self, client, q, **params):
+        response = client.get('/api/v1/expenses/search', query_string=dict(params, q=q))
+        assert response.status_code == 200, response.data
+        return [e['id'] for e in json.loads(response.data)['data']['expenses']]
+
+    def test_search_fields(self, client, app, searchable):
+        """Test busca en motivo, cliente (nombre y RUT) y texto OCR"""
+        with client:
+            login(client, 'admin@test.com', 'admin123')
+            assert self.search(client, 'aeropuerto') == [searchable['airport']]
+            assert self.search(client, 'constructora') == [searchable['hotel']]
+            assert self.search(client, '96.555.444-3') == [searchable['hotel']]
+            assert self.search(client, '965554443') == [searchable['hotel']]
+            # Sin distinguir tildes y con prefijos
+            assert self.search(client, 'concepcion') == [searchable['hotel']]
+            assert self.search(client, 'restaur') == [searchable['lunch']]
+            assert self.search(client, 'taxi aeropuerto') == [searchable['airport']]
+            # Palabras de menos de MIN_PREFIX letras no se expanden como prefijo
+            assert self.search(client, 'ta') == []
+            assert self.search(client, 'inexistente') == []
+
+    def test_ranking_and_filters(self, client, app, searchable):
+        """Test coincidencias en el motivo pesan más que en el texto OCR"""
+        with client:
+            login(client, 'admin@test.com', 'admin123')
+            ids = self.search(client, 'taxi')
+            assert set(ids[:2]) == {searchable['airport'], searchable['board']}
+            assert ids[2] == searchable['lunch']
+
+            response = client.get('/api/v1/expenses/search?q=taxi&per_page=2')
+            data = json.loads(response.data)['data']
+            assert len(data['expenses']) == 2 and data['has_more'] is True
+
+            supervisor = User.query.filter_by(role='supervisor').first()
+            assert self.search(client, 'taxi', user_id=supervisor.id) == [searchable['board']]
+
+    def test_user_scope(self, client, app, searchable):
+        """Test un usuario solo encuentra sus propios gastos"""
+        with client:
+            login(client, 'user@test.com', 'user123')
+            assert set(self.search(client, 'taxi')) == {searchable['airport'], searchable['lunch']}
+            assert self.search(client, 'hotel') == []
+
+            response = client.get('/api/v1/expenses/search?q=%20*%20')
+            assert response.status_code == 400
+
+    def test_supervisor_scope(self, client, app, searchable):
+        """Test un supervisor encuentra los gastos de su equipo y los propios"""
+        with client:
+            login(client, 'supervisor@test.com', 'super123')
+            assert len(self.search(client, 'taxi')) == 3
+            assert self.search(client, 'hotel') == []
+
+    def test_index_follows_changes(self, client, app, searchable):
+        """Test el índice se actualiza al editar, eliminar o renombrar el cliente"""
+        from extensions import db
+        from services import search_index
+
+        def ids(q):
+            return [e.id for e in search_index.search(Expense.query, search_index.terms(q))]
+
+        airport = db.session.get(Expense, searchable['airport'])
+        airport.reason = 'Traslado al hotel'
+        db.session.commit()
+        assert ids('aeropuerto') == []
+        assert set(ids('hotel')) == {searchable['airport'], searchable['hotel']}
+
+        lunch = db.session.get(Expense, searchable['lunch'])
+        lunch.ocr_data = {'success': True, 'raw_text': 'Cafetería Central'}
+        db.session.commit()
+        assert ids('cafeteria') == [searchable['lunch']]
+        assert ids('restaurante') == []
+
+        other = Company.query.filter_by(rut='96.555.444-3').one()
+        other.name = 'Inmobiliaria Sur'
+        db.session.commit()
+        assert ids('inmobiliaria') == [searchable['hotel']]
+        assert ids('constructora') == []
+
+        db.session.delete(db.session.get(Expense, searchable['board']))
+        db.session.commit()
+        assert ids('directorio') == []
+
+        # Un rollback no deja documentos en el índice
+        airport.reason = 'Pasajes a Temuco'
+        db.session.flush()
+        db.session.rollback()
+        assert ids('temuco') == []
+
+    def test_rank_window(self, client, app, searchable, monkeypatch):
+        """Test fuera de la ventana de relevancia siguen las coincidencias más antiguas"""
+        from services import search_index
+        monkeypatch.setattr(search_index, 'RANK_WINDOW', 1)
+        pages = [search_index.search(Expense.query, ['taxi'], offset=offset, limit=1) for offset in range(4)]
+        assert [[e.id for e in page] for page in pages] == [
+            [searchable['board']], [searchable['lunch']], [searchable['airport']], []
+        ]
+        assert [e.id for e in search_index.search(Expense.query, ['taxi'], offset=0, limit=3)] == [
+            searchable['board'], searchable['lunch'], searchable['airport']
+        ]
+
+    def test_bulk_import_indexed(self, client, app, init_database):
+        """Test los gastos de la carga masiva (Core) quedan indexados"""
+        company = Company.query.first()
+        rows = [{'amount': 1000, 'category': 'Transporte', 'reason': f'Peaje autopista {i}',
+                 'client_id': company.id, 'receipt_image': 'feed.jpg', 'expense_date': '2024-06-15'} for i in range(3)]
+        with client:
+            login(client, 'user@test.com', 'user123')
+            response = client.post('/api/v1/expenses/bulk', data=json.dumps(rows), content_type='application/json')
+            assert response.status_code in (200, 201, 207)
+            assert len(self.search(client, 'peaje')) == 3
+
+    def test_rebuild_command(self, app, runner, searchable):
+        """Test flask search rebuild regenera el índice completo"""
+        from extensions import db
+        from sqlalchemy import text
+        from services import search_index
+        db.session.execute(text('DELETE FROM expense_search'))
+        db.session.commit()
+        assert search_index.search(Expense.query, ['taxi']) == []
+
+        result = runner.invoke(args=['search', 'rebuild'])
+        assert result.exit_code == 0, result.output
+        assert '4 gasto(s)' in result.output
+        assert len(search_index.search(Expense.query, ['taxi'])) == 3
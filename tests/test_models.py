@@ -126,3 +126,133 @@ class TestAreaModel:
             users = area.users.all()
             assert len(users) > 0
             assert all(u.area_id == area.id for u in users)
+
+
+class TestUserHierarchy:
+    """Tests para la tabla de clausura de supervisión"""
+
+    def pairs(self):
+        from models.user import UserHierarchy
+        return {(h.ancestor_id, h.descendant_id, h.depth) for h in UserHierarchy.query.all()}
+
+    def rebuilt_pairs(self):
+        from services.hierarchy_service import rebuild_hierarchy
+        rebuild_hierarchy()
+        return self.pairs()
+
+    @pytest.fixture
+    def org(self, app, init_database):
+        """gerente -> supervisor -> usuario, más un segundo supervisor sin equipo"""
+        from extensions import db
+        supervisor = User.query.filter_by(email="supervisor@test.com").first()
+        manager = User(email="manager@test.com", first_name="Manager", last_name="Test", role="supervisor")
+        manager.set_password("manager123")
+        other = User(email="other@test.com", first_name="Other", last_name="Test", role="supervisor")
+        db.session.add_all([manager, other])
+        db.session.flush()
+        supervisor.supervisor_id = manager.id
+        db.session.commit()
+        return {u.email.split('@')[0]: u.id for u in User.query.all()}
+
+    def test_closure_rows(self, app, org):
+        """Test pares ancestro/descendiente de todos los niveles"""
+        pairs = self.pairs()
+        assert (org['manager'], org['user'], 2) in pairs
+        assert (org['supervisor'], org['user'], 1) in pairs
+        assert (org['user'], org['user'], 0) in pairs
+        assert pairs == self.rebuilt_pairs()
+
+    def test_move_subtree(self, app, org):
+        """Test cambiar el supervisor mueve todo el subárbol"""
+        from extensions import db
+        supervisor = db.session.get(User, org['supervisor'])
+        supervisor.supervisor_id = org['other']
+        db.session.commit()
+
+        pairs = self.pairs()
+        assert (org['other'], org['user'], 2) in pairs
+        assert not any(a == org['manager'] and d != org['manager'] for a, d, _ in pairs)
+        assert pairs == self.rebuilt_pairs()
+
+        supervisor.supervisor_id = None
+        db.session.commit()
+        assert self.pairs() == self.rebuilt_pairs()
+
+    def test_new_user_under_new_supervisor(self, app, org):
+        """Test usuarios nuevos en el mismo flush que su supervisor"""
+        from extensions import db
+        lead = User(email="lead@test.com", first_name="Lead", last_name="Test", role="supervisor",
+                    supervisor_id=org['user'])
+        db.session.add(lead)
+        db.session.flush()
+        member = User(email="member@test.com", first_name="Member", last_name="Test")
+        member.supervisor = lead
+        member2 = User(email="member2@test.com", first_name="Member", last_name="Two")
+        db.session.add_all([member, member2])
+        lead.subordinates.append(member2)
+        db.session.commit()
+
+        assert (org['manager'], member.id, 4) in self.pairs()
+        assert self.pairs() == self.rebuilt_pairs()
+
+    def test_cycle_rejected(self, app, org):
+        """Test un usuario no puede quedar bajo su propio subordinado"""
+        from extensions import db
+        from utils.exceptions import ValidationError
+        manager = db.session.get(User, org['manager'])
+        manager.supervisor_id = org['user']
+        with pytest.raises(ValidationError):
+            db.session.commit()
+
+        # El error se lanza antes de ejecutar SQL: la sesión sigue usable sin rollback
+        manager.supervisor_id = org['other']
+        db.session.commit()
+        assert self.pairs() == self.rebuilt_pairs()
+
+    def test_cycle_across_pending_moves(self, app, org):
+        """Test un ciclo formado por dos cambios del mismo flush"""
+        from extensions import db
+        from utils.exceptions import ValidationError
+        other = db.session.get(User, org['other'])
+        user = db.session.get(User, org['user'])
+        other.supervisor_id = org['user']
+        user.supervisor = other
+        with pytest.raises(ValidationError):
+            db.session.flush()
+        db.session.rollback()
+        assert self.pairs() == self.rebuilt_pairs()
+
+    def test_multilevel_visibility(self, app, client, org):
+        """Test un gerente ve y aprueba gastos de subordinados indirectos"""
+        from extensions import db
+        import json
+        expense = Expense(
+            user_id=org['user'], client_id=Company.query.first().id, amount=1000,
+            category="Transporte", reason="Taxi", receipt_image="test.jpg",
+            expense_date=datetime.now().date()
+        )
+        db.session.add(expense)
+        db.session.commit()
+        expense_id = expense.id
+
+        with client:
+            client.post('/login', data={'email': 'manager@test.com', 'password': 'manager123'})
+            data = json.loads(client.get('/api/v1/expenses').data)['data']
+            assert [e['id'] for e in data['expenses']] == [expense_id]
+            assert str(expense_id).encode() in client.get('/approvals/pending').data
+
+            response = client.post('/api/v1/approvals/batch', data=json.dumps(
+                {'expense_ids': [expense_id], 'action': 'approved'}
+            ), content_type='application/json')
+            assert json.loads(response.data)['data']['processed'] == 1
+
+    def test_rebuild_command(self, app, runner, org):
+        """Test flask hierarchy rebuild"""
+        from extensions import db
+        from models.user import UserHierarchy
+        db.session.query(UserHierarchy).delete()
+        db.session.commit()
+
+        result = runner.invoke(args=['hierarchy', 'rebuild'])
+        assert result.exit_code == 0
+        assert (org['manager'], org['user'], 2) in self.pairs()
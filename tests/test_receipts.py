@@ -0,0 +1,564 @@
+"""
+Tests para almacenamiento de recibos y flujo de subida
+"""
+import pytest
+import io
+import os
+from datetime import datetime
+from PIL import Image
+from extensions import db, storage
+from models.expense import Expense
+from models.company import Company
+from models.job import OCRJob
+from models.receipt import ReceiptBlob
+from services.receipt_store import possible_duplicates, duplicate_receipt_ids
+
+
+def login(client, email, password):
+    """Helper para hacer login"""
+    return client.post('/login', data={
+        'email': email,
+        'password': password
+    }, follow_redirects=True)
+
+
+def make_image(color='white', size=(60, 40), fmt='PNG'):
+    """Imagen de prueba en memoria"""
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def submit_expense(client, content, filename='boleta.png', amount='10000'):
+    """Envía el formulario de nuevo gasto con un recibo"""
+    client_obj = Company.query.first()
+    return client.post('/expenses/new', data={
+        'client_id': str(client_obj.id),
+        'amount': amount,
+        'category': 'Transporte',
+        'reason': 'Taxi',
+        'latitude': '-33.4489',
+        'longitude': '-70.6693',
+        'receipt': (io.BytesIO(content), filename),
+    }, content_type='multipart/form-data')
+
+
+@pytest.fixture
+def upload_folder(app, tmp_path):
+    """Carpeta de subidas aislada por test"""
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    return tmp_path
+
+
+class TestReceiptUpload:
+    """Tests para la subida de recibos"""
+
+    def test_upload_creates_expense_and_job(self, client, app, init_database, upload_folder):
+        """Test la subida crea el gasto y encola el OCR"""
+        with client:
+            login(client, 'user@test.com', 'user123')
+            response = submit_expense(client, make_image())
+            assert response.status_code == 302
+
+        expense = Expense.query.one()
+        assert expense.receipt_sha256
+        assert os.path.exists(upload_folder / expense.receipt_image)
+        assert OCRJob.query.filter_by(expense_id=expense.id).count() == 1
+
+    def test_duplicate_upload_reuses_file(self, client, app, init_database, upload_folder):
+        """Test un recibo idéntico no se vuelve a escribir ni a procesar"""
+        content = make_image('red')
+        with client:
+            login(client, 'user@test.com', 'user123')
+            submit_expense(client, content, filename='uno.png')
+
+            # Simular OCR ya procesado para el primer recibo
+            blob = ReceiptBlob.query.one()
+            blob.ocr_result = {'success': True, 'confidence': 'high'}
+            db.session.commit()
+
+            submit_expense(client, content, filename='dos.png')
+
+        first, second = Expense.query.order_by(Expense.id).all()
+        assert first.receipt_image == second.receipt_image
+        assert ReceiptBlob.query.count() == 1
+        assert len([f for f in os.listdir(upload_folder) if not f.startswith('.')]) == 1
+
+        # El segundo gasto toma el OCR del caché, sin trabajo en cola
+        assert second.ocr_data['confidence'] == 'high'
+        assert OCRJob.query.filter_by(expense_id=second.id).count() == 0
+
+        assert possible_duplicates(second) == [first]
+        assert duplicate_receipt_ids([first, second]) == {first.id, second.id}
+
+    def test_different_uploads_not_flagged(self, client, app, init_database, upload_folder):
+        """Test recibos distintos no se marcan como duplicados"""
+        with client:
+            login(client, 'user@test.com', 'user123')
+            submit_expense(client, make_image('red'))
+            submit_expense(client, make_image('blue'))
+
+        expenses = Expense.query.all()
+        assert len({e.receipt_image for e in expenses}) == 2
+        assert duplicate_receipt_ids(expenses) == set()
+
+    def test_rollback_discards_new_file(self, app, init_database, upload_folder):
+        """Test si la transacción se revierte no queda el archivo huérfano"""
+        from services.receipt_store import store_receipt
+        blob, created = store_receipt(make_upload(make_image('green')))
+        assert created and storage.exists(blob.stored_path)
+        stored_path = blob.stored_path
+
+        db.session.rollback()
+        assert not storage.exists(stored_path)
+        assert ReceiptBlob.query.count() == 0
+
+    def test_concurrent_same_content(self, app, init_database, upload_folder, monkeypatch):
+        """Test otra subida del mismo contenido registrada entre la búsqueda y el INSERT"""
+        from sqlalchemy import insert
+        from services import receipt_store
+        original_key = receipt_store.receipt_key
+
+        def racing_key(sha256, extension):
+            # La otra subida inserta su ReceiptBlob justo después de nuestra búsqueda
+            key = original_key(sha256, extension)
+            db.session.execute(insert(ReceiptBlob).values(sha256=sha256, stored_path=key, size=1))
+            return key
+
+        monkeypatch.setattr(receipt_store, 'receipt_key', racing_key)
+        blob, created = receipt_store.store_receipt(make_upload(make_image('purple')))
+        assert created is False
+        assert storage.exists(blob.stored_path)
+        db.session.commit()
+        assert ReceiptBlob.query.count() == 1
+
+    def test_malicious_upload_rejected(self, client, app, init_database, upload_folder):
+        """Test archivo con contenido sospechoso es rechazado"""
+        content = make_image() + b'<?php system($_GET["c"]); ?>'
+        with client:
+            login(client, 'user@test.com', 'user123')
+            submit_expense(client, content)
+
+        assert Expense.query.count() == 0
+        assert os.listdir(upload_folder) == []
+
+
+class CountingStream(io.BytesIO):
+    """Stream que cuenta los bytes leídos"""
+
+    bytes_read = 0
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        self.bytes_read += len(chunk)
+        return chunk
+
+
+def make_upload(content, filename='boleta.png'):
+    from werkzeug.datastructures import FileStorage
+    return FileStorage(stream=CountingStream(content), filename=filename)
+
+
+class TestUploadPipeline:
+    """Tests para la validación de subidas en una sola lectura"""
+
+    def test_receive_upload_single_read(self, app, upload_folder):
+        """Test el stream se lee una vez y se obtienen hash, tipo y dimensiones"""
+        import hashlib
+        from utils.file_validators import receive_upload
+        content = make_image(size=(800, 600), fmt='JPEG')
+        upload = make_upload(content, filename='foto.JPEG')
+
+        result = receive_upload(upload, str(upload_folder))
+
+        assert upload.stream.bytes_read == len(content)
+        assert result.sha256 == hashlib.sha256(content).hexdigest()
+        assert result.size == len(content)
+        assert (result.mime_type, result.extension) == ('image/jpeg', 'jpg')
+        assert (result.width, result.height) == (800, 600)
+        assert open(result.path, 'rb').read() == content
+
+    def test_oversized_upload_stops_reading(self, app, upload_folder):
+        """Test un archivo sobre el límite se rechaza sin leerlo completo"""
+        from utils.file_validators import receive_upload, FileValidationError
+        content = make_image() + b'\0' * (3 * 1024 * 1024)
+        upload = make_upload(content)
+
+        with pytest.raises(FileValidationError, match='demasiado grande'):
+            receive_upload(upload, str(upload_folder), max_size_mb=1)
+
+        assert upload.stream.bytes_read < 2 * 1024 * 1024
+        assert os.listdir(upload_folder) == []
+
+    def test_non_image_rejected_by_magic(self, app, upload_folder):
+        """Test el tipo se detecta por contenido, no por la extensión"""
+        from utils.file_validators import receive_upload, FileValidationError
+        upload = make_upload(b'solo texto, no una imagen\n' * 200)
+
+        with pytest.raises(FileValidationError, match='imagen válida'):
+            receive_upload(upload, str(upload_folder))
+        assert os.listdir(upload_folder) == []
+
+    def test_pattern_across_chunk_boundary(self, app, upload_folder):
+        """Test un patrón sospechoso partido entre dos bloques se detecta"""
+        from utils.file_validators import receive_upload, FileValidationError, CHUNK_SIZE
+        image = make_image()
+        content = image + b'\0' * (CHUNK_SIZE - len(image) - 3) + b'<script>alert(1)</script>'
+
+        with pytest.raises(FileValidationError, match='<script'):
+            receive_upload(make_upload(content), str(upload_folder))
+        assert os.listdir(upload_folder) == []
+
+    def test_stored_extension_from_content(self, client, app, init_database, upload_folder):
+        """Test el recibo se guarda con la extensión del tipo detectado"""
+        with client:
+            login(client, 'user@test.com', 'user123')
+            submit_expense(client, make_image(fmt='JPEG'), filename='boleta.jpeg')
+
+        expense = Expense.query.one()
+        assert expense.receipt_image.endswith(f'{expense.receipt_sha256}.jpg')
+        assert os.path.isfile(upload_folder / expense.receipt_image)
+
+
+class TestReceiptVariants:
+    """Tests para las versiones reducidas de recibos"""
+
+    def upload(self, client, content=None):
+        login(client, 'user@test.com', 'user123')
+        submit_expense(client, content or make_image(size=(3000, 2000), fmt='JPEG'), filename='boleta.jpg')
+        return Expense.query.one()
+
+    def test_generate_variants(self, app, upload_folder):
+        """Test cada versión queda acotada a su tamaño sin ampliar imágenes chicas"""
+        from services.receipt_images import RECEIPT_VARIANTS, generate_variants
+        source = upload_folder / 'abc.jpg'
+        source.write_bytes(make_image(size=(3000, 2000), fmt='JPEG'))
+
+        variants = generate_variants(str(source), storage.backend, 'abc.jpg')
+        assert set(variants) == set(RECEIPT_VARIANTS)
+        for size, name in variants.items():
+            with Image.open(upload_folder / name) as img:
+                assert max(img.size) == RECEIPT_VARIANTS[size]
+                assert img.format == 'WEBP'
+
+        small = upload_folder / 'small.png'
+        small.write_bytes(make_image(size=(60, 40)))
+        with Image.open(upload_folder / generate_variants(str(small), storage.backend, 'small.png')['full']) as img:
+            assert img.size == (60, 40)
+
+    def test_worker_records_variants(self, client, app, init_database, upload_folder, monkeypatch):
+        """Test el worker genera las versiones junto con el OCR"""
+        from services import ocr_queue
+        monkeypatch.setattr(ocr_queue, 'process_receipt', lambda path, **options: {'success': True})
+        with client:
+            expense = self.upload(client)
+
+        job_id, path = ocr_queue.claim_jobs(10, 'worker-1')[0]
+        _, ocr_result, variants, error = ocr_queue.run_receipt_task((job_id, path, {}, storage.spec()))
+        assert error is None
+        ocr_queue.complete_job(job_id, ocr_result, variants)
+        db.session.commit()
+
+        blob = ReceiptBlob.query.one()
+        assert set(blob.variants) == {'thumb', 'preview', 'full'}
+        assert all(os.path.exists(upload_folder / name) for name in blob.variants.values())
+        assert os.path.basename(blob.variants['thumb']).startswith(expense.receipt_sha256)
+
+    def test_serve_and_regenerate(self, client, app, init_database, upload_folder):
+        """Test se sirve la versión pedida y se regenera si falta"""
+        with client:
+            expense = self.upload(client)
+            response = client.get(f'/receipts/{expense.id}/thumb')
+            assert response.status_code == 200
+            assert response.mimetype == 'image/webp'
+            assert 'private' in response.headers['Cache-Control']
+            with Image.open(io.BytesIO(response.data)) as img:
+                assert max(img.size) == 240
+
+            # La versión generada al vuelo queda registrada
+            thumb = ReceiptBlob.query.one().variants['thumb']
+            os.remove(upload_folder / thumb)
+            assert client.get(f'/receipts/{expense.id}/thumb').status_code == 200
+            assert os.path.exists(upload_folder / thumb)
+
+            original = client.get(f'/receipts/{expense.id}/original')
+            assert original.status_code == 200
+            assert len(original.data) == os.path.getsize(upload_folder / expense.receipt_image)
+            assert client.get(f'/receipts/{expense.id}/huge').status_code == 404
+
+    def test_legacy_variant_generated_once(self, client, app, init_database, upload_folder, monkeypatch):
+        """Test un recibo sin hash reutiliza la versión ya generada"""
+        from services import receipt_images
+        calls = []
+        original = receipt_images.generate_variants
+        monkeypatch.setattr(receipt_images, 'generate_variants',
+                            lambda *args, **kwargs: calls.append(args) or original(*args, **kwargs))
+        with client:
+            expense = self.upload(client)
+            expense.receipt_sha256 = None
+            db.session.commit()
+
+            assert client.get(f'/receipts/{expense.id}/thumb').status_code == 200
+            assert client.get(f'/receipts/{expense.id}/thumb').status_code == 200
+            assert client.get(f'/receipts/{expense.id}/preview').status_code == 200
+            assert len(calls) == 1
+
+            os.remove(upload_folder / receipt_images.variant_name(expense.receipt_image, 'thumb'))
+            assert client.get(f'/receipts/{expense.id}/thumb').status_code == 200
+            assert len(calls) == 2
+
+    def test_unreadable_original(self, client, app, init_database, upload_folder):
+        """Test un original truncado responde 404 sin error del servidor"""
+        with client:
+            expense = self.upload(client)
+            content = (upload_folder / expense.receipt_image).read_bytes()
+            (upload_folder / expense.receipt_image).write_bytes(content[:200])
+            assert client.get(f'/receipts/{expense.id}/thumb').status_code == 404
+            assert not ReceiptBlob.query.one().variants
+
+    def test_permissions(self, client, app, init_database, upload_folder):
+        """Test solo quien puede ver el gasto obtiene el recibo"""
+        from models.user import User
+        with client:
+            expense = self.upload(client)
+            expense.user_id = User.query.filter_by(email='admin@test.com').first().id
+            db.session.commit()
+            assert client.get(f'/receipts/{expense.id}/preview').status_code == 404
+
+
+@pytest.fixture
+def object_storage(app, tmp_path):
+    """Almacenamiento S3 respaldado por el objeto-store local (sin MinIO)"""
+    app.config['UPLOAD_FOLDER'] = str(tmp_path / 'staging')
+    app.config['STORAGE_BACKEND'] = 'utils.storage.S3Storage'
+    app.config['STORAGE_OPTIONS'] = {
+        'bucket': 'recibos', 'prefix': 'rinde/', 'endpoint_url': f'file://{tmp_path / "objects"}'
+    }
+    return tmp_path / 'objects' / 'recibos' / 'rinde'
+
+
+class TestStorage:
+    """Tests para los backends de almacenamiento de recibos"""
+
+    @pytest.mark.parametrize('backend', ['local', 'object'])
+    def test_backend_roundtrip(self, app, tmp_path, backend, request):
+        """Test guardar, leer por rangos, copiar, copia local y eliminar"""
+        from utils.storage import StorageNotFound
+        if backend == 'object':
+            request.getfixturevalue('object_storage')
+        else:
+            app.config['UPLOAD_FOLDER'] = str(tmp_path)
+        content = bytes(range(256)) * 1000
+
+        storage.save('ab/recibo.jpg', io.BytesIO(content))
+        assert storage.exists('ab/recibo.jpg')
+        assert storage.size('ab/recibo.jpg') == len(content)
+
+        stream = storage.open('ab/recibo.jpg', 1000, 1999)
+        assert stream.read() == content[1000:2000]
+        stream.close()
+
+        with storage.local_copy('ab/recibo.jpg') as path:
+            assert open(path, 'rb').read() == content
+
+        storage.copy('ab/recibo.jpg', 'cd/copia.jpg')
+        assert storage.exists('ab/recibo.jpg')
+        assert storage.open('cd/copia.jpg').read() == content
+
+        storage.delete('ab/recibo.jpg')
+        assert not storage.exists('ab/recibo.jpg')
+        with pytest.raises(StorageNotFound):
+            storage.open('ab/recibo.jpg')
+
+    def test_upload_and_serve_from_object_store(self, client, app, init_database, object_storage, monkeypatch):
+        """Test subida, OCR y descarga (con Range) pasan por el objeto-store"""
+        from services import ocr_queue
+        monkeypatch.setattr(ocr_queue, 'process_receipt', lambda path, **options: {'success': True})
+        content = make_image(size=(1200, 900), fmt='JPEG')
+        with client:
+            login(client, 'user@test.com', 'user123')
+            submit_expense(client, content, filename='boleta.jpg')
+            expense = Expense.query.one()
+            assert (object_storage / expense.receipt_image).read_bytes() == content
+            # No quedan temporales en el nodo que recibió la subida
+            assert os.listdir(app.config['UPLOAD_FOLDER']) == []
+
+            job_id, name = ocr_queue.claim_jobs(10, 'worker-1')[0]
+            _, ocr_result, variants, error = ocr_queue.run_receipt_task((job_id, name, {}, storage.spec()))
+            assert error is None
+            assert all((object_storage / variant).exists() for variant in variants.values())
+
+            response = client.get(f'/receipts/{expense.id}/original')
+            assert response.status_code == 200
+            assert response.data == content
+            assert response.headers['Accept-Ranges'] == 'bytes'
+
+            partial = client.get(f'/receipts/{expense.id}/original', headers={'Range': 'bytes=100-199'})
+            assert partial.status_code == 206
+            assert partial.data == content[100:200]
+            assert partial.headers['Content-Range'] == f'bytes 100-199/{len(content)}'
+
+            cached = client.get(f'/receipts/{expense.id}/original', headers={'If-None-Match': response.headers['ETag']})
+            assert cached.status_code == 304
+
+    def test_local_range_request(self, client, app, init_database, upload_folder):
+        """Test el backend local también atiende Range"""
+        content = make_image(size=(400, 300), fmt='JPEG')
+        with client:
+            login(client, 'user@test.com', 'user123')
+            submit_expense(client, content, filename='boleta.jpg')
+            expense = Expense.query.one()
+            response = client.get(f'/receipts/{expense.id}/original', headers={'Range': 'bytes=0-9'})
+            assert response.status_code == 206
+            assert response.data == content[:10]
+
+
+class TestReceiptLayout:
+    """Tests para el layout por hash y la migración de recibos existentes"""
+
+    def test_upload_sharded_by_hash(self, client, app, init_database, upload_folder):
+        """Test el recibo se guarda en ab/cd/<sha256>.<ext>"""
+        with client:
+            login(client, 'user@test.com', 'user123')
+            submit_expense(client, make_image(fmt='JPEG'), filename='boleta.jpeg')
+
+        expense = Expense.query.one()
+        sha256 = expense.receipt_sha256
+        assert expense.receipt_image == f'{sha256[:2]}/{sha256[2:4]}/{sha256}.jpg'
+        assert os.path.isfile(upload_folder / expense.receipt_image)
+        assert sorted(os.listdir(upload_folder)) == [sha256[:2]]
+
+    def test_serve_strong_etag_and_cache_headers(self, client, app, init_database, upload_folder):
+        """Test ETag fuerte, caché inmutable y 304 sin leer el almacenamiento"""
+        with client:
+            login(client, 'user@test.com', 'user123')
+            submit_expense(client, make_image(fmt='JPEG'), filename='boleta.jpg')
+            expense = Expense.query.one()
+
+            response = client.get(f'/receipts/{expense.id}/original')
+            etag = response.headers['ETag']
+            assert etag == f'"{expense.receipt_sha256}-original"'
+            cache_control = response.headers['Cache-Control']
+            assert 'immutable' in cache_control and 'private' in cache_control
+            assert 'public' not in cache_control
+
+            os.remove(upload_folder / expense.receipt_image)
+            cached = client.get(f'/receipts/{expense.id}/original', headers={'If-None-Match': etag})
+            assert cached.status_code == 304
+            assert cached.headers['ETag'] == etag
+
+    def test_relayout_command(self, app, runner, init_database, upload_folder):
+        """Test la migración mueve, registra por contenido y deduplica"""
+        import hashlib
+        from services.receipt_images import variant_name
+        from models.user import User
+        from models.company import Company
+        user = User.query.filter_by(email='user@test.com').first()
+        client_obj = Company.query.first()
+
+        # Recibo ya indexado pero guardado en la raíz, con una versión reducida
+        indexed = make_image('red')
+        sha_indexed = hashlib.sha256(indexed).hexdigest()
+        (upload_folder / f'{sha_indexed}.png').write_bytes(indexed)
+        (upload_folder / f'{sha_indexed}.thumb.webp').write_bytes(b'thumb')
+        db.session.add(ReceiptBlob(sha256=sha_indexed, stored_path=f'{sha_indexed}.png', size=len(indexed),
+                                   variants={'thumb': f'{sha_indexed}.thumb.webp'}))
+
+        # Recibos antiguos: uno nuevo, uno repetido y uno cuyo archivo se perdió
+        legacy = make_image('blue')
+        (upload_folder / 'boleta_20240101_101010_1.png').write_bytes(legacy)
+        (upload_folder / 'boleta_20240101_101011_1.png').write_bytes(indexed)
+        # Versiones generadas al vuelo con el nombre antiguo
+        (upload_folder / variant_name('boleta_20240101_101010_1.png', 'preview')).write_bytes(b'preview')
+        (upload_folder / variant_name('boleta_20240101_101011_1.png', 'thumb')).write_bytes(b'otra')
+        names = [f'{sha_indexed}.png', 'boleta_20240101_101010_1.png',
+                 'boleta_20240101_101011_1.png', 'perdida_20240101_101012_1.png']
+        for i, name in enumerate(names):
+            db.session.add(Expense(
+                user_id=user.id, client_id=client_obj.id, amount=1000, category='Transporte', reason='Taxi',
+                receipt_image=name, receipt_sha256=sha_indexed if i == 0 else None, expense_date=datetime.now()
+            ))
+        db.session.commit()
+
+        result = runner.invoke(args=['receipts', 'relayout', '--dry-run'])
+        assert '1 recibo(s) por mover y 3 gasto(s)' in result.output
+
+        result = runner.invoke(args=['receipts', 'relayout', '--batch-size', '2'])
+        assert result.exit_code == 0, result.output
+        assert '1 movido(s), 1 registrado(s) por contenido, 1 duplicado(s) eliminado(s), 1 faltante(s)' in result.output
+
+        db.session.expire_all()
+        expenses = Expense.query.order_by(Expense.id).all()
+        sha_legacy = hashlib.sha256(legacy).hexdigest()
+        key_indexed = f'{sha_indexed[:2]}/{sha_indexed[2:4]}/{sha_indexed}.png'
+        assert expenses[0].receipt_image == expenses[2].receipt_image == key_indexed
+        assert expenses[2].receipt_sha256 == sha_indexed
+        assert expenses[1].receipt_image == f'{sha_legacy[:2]}/{sha_legacy[2:4]}/{sha_legacy}.png'
+        assert expenses[3].receipt_sha256 is None
+
+        blob = ReceiptBlob.query.filter_by(sha256=sha_indexed).one()
+        assert blob.variants == {'thumb': f'{sha_indexed[:2]}/{sha_indexed[2:4]}/{sha_indexed}.thumb.webp'}
+        assert (upload_folder / blob.variants['thumb']).read_bytes() == b'thumb'
+        assert ReceiptBlob.query.count() == 2
+        legacy_blob = ReceiptBlob.query.filter_by(sha256=sha_legacy).one()
+        assert legacy_blob.variants == {'preview': variant_name(legacy_blob.stored_path, 'preview')}
+        assert (upload_folder / legacy_blob.variants['preview']).read_bytes() == b'preview'
+        # En la raíz no quedan archivos, solo los directorios por hash
+        assert all((upload_folder / entry).is_dir() for entry in os.listdir(upload_folder))
+
+        # Relanzar no encuentra trabajo
+        result = runner.invoke(args=['receipts', 'relayout'])
+        assert '0 movido(s), 0 registrado(s)' in result.output
+
+    def test_relayout_interrupted(self, app, init_database, upload_folder, monkeypatch):
+        """Test si el lote falla antes del commit los gastos siguen apuntando a archivos existentes"""
+        import hashlib
+        from models.user import User
+        from models.company import Company
+        from services import receipt_relayout
+        user = User.query.filter_by(email='user@test.com').first()
+        client_obj = Company.query.first()
+
+        indexed = make_image('red')
+        sha_indexed = hashlib.sha256(indexed).hexdigest()
+        (upload_folder / f'{sha_indexed}.png').write_bytes(indexed)
+        (upload_folder / f'{sha_indexed}.thumb.webp').write_bytes(b'thumb')
+        db.session.add(ReceiptBlob(sha256=sha_indexed, stored_path=f'{sha_indexed}.png', size=len(indexed),
+                                   variants={'thumb': f'{sha_indexed}.thumb.webp'}))
+        legacy = make_image('blue')
+        (upload_folder / 'boleta_20240101_101010_1.png').write_bytes(legacy)
+        for name, sha256 in [(f'{sha_indexed}.png', sha_indexed), ('boleta_20240101_101010_1.png', None)]:
+            db.session.add(Expense(
+                user_id=user.id, client_id=client_obj.id, amount=1000, category='Transporte', reason='Taxi',
+                receipt_image=name, receipt_sha256=sha256, expense_date=datetime.now()
+            ))
+        db.session.commit()
+
+        def interrupted(renames):
+            raise RuntimeError('interrumpido')
+
+        original = receipt_relayout._repoint_expenses
+        monkeypatch.setattr(receipt_relayout, '_repoint_expenses', interrupted)
+        for step in (receipt_relayout.relayout_blobs, receipt_relayout.relayout_legacy):
+            with pytest.raises(RuntimeError):
+                step(log=lambda message: None)
+            db.session.rollback()
+
+        # Ningún gasto quedó apuntando a un archivo eliminado
+        for expense in Expense.query.all():
+            assert os.path.isfile(upload_folder / expense.receipt_image)
+        assert (upload_folder / f'{sha_indexed}.thumb.webp').exists()
+
+        monkeypatch.setattr(receipt_relayout, '_repoint_expenses', original)
+        stats = receipt_relayout.run_relayout(log=lambda message: None)
+        assert stats == {'moved': 1, 'missing': 0, 'hashed': 1, 'deduplicated': 0}
+
+        db.session.expire_all()
+        sha_legacy = hashlib.sha256(legacy).hexdigest()
+        assert [expense.receipt_image for expense in Expense.query.order_by(Expense.id)] == [
+            f'{sha_indexed[:2]}/{sha_indexed[2:4]}/{sha_indexed}.png',
+            f'{sha_legacy[:2]}/{sha_legacy[2:4]}/{sha_legacy}.png',
+        ]
+        blob = ReceiptBlob.query.filter_by(sha256=sha_indexed).one()
+        assert (upload_folder / blob.variants['thumb']).read_bytes() == b'thumb'
+        assert all((upload_folder / entry).is_dir() for entry in os.listdir(upload_folder))
@@ -0,0 +1,517 @@
+"""
+Tests para reportes y servicio de consultas agregadas
+"""
+import pytest
+import json
+from datetime import date
+from extensions import db
+from models.user import User
+from models.expense import Expense
+from models.company import Company
+from models.report import ExpenseMonthlyRollup
+from services.report_service import (
+    rollup_scope_filter, expense_summary, totals_by_category, monthly_totals, last_months
+)
+from services.rollup_service import rebuild_rollups
+
+
+def login(client, email, password):
+    """Helper para hacer login"""
+    return client.post('/login', data={
+        'email': email,
+        'password': password
+    }, follow_redirects=True)
+
+
+def create_expense(user, client_obj, amount, status='pending', category='Transporte', expense_date=None):
+    """Helper para crear un gasto"""
+    expense = Expense(
+        user_id=user.id,
+        client_id=client_obj.id,
+        amount=amount,
+        category=category,
+        reason='Test',
+        receipt_image='test.jpg',
+        expense_date=expense_date or date.today(),
+        status=status
+    )
+    db.session.add(expense)
+    return expense
+
+
+@pytest.fixture
+def report_data(app, init_database):
+    """Gastos de prueba: dos del subordinado del supervisor y uno del admin"""
+    user = User.query.filter_by(email="user@test.com").first()
+    admin = User.query.filter_by(email="admin@test.com").first()
+    client_obj = Company.query.first()
+
+    create_expense(user, client_obj, 10000, status='approved')
+    create_expense(user, client_obj, 5000, status='pending', category='Alimentación',
+                   expense_date=date(2020, 3, 15))
+    create_expense(admin, client_obj, 7000, status='rejected')
+    db.session.commit()
+    return init_database
+
+
+class TestReportService:
+    """Tests para las consultas agregadas"""
+
+    def test_summary_admin_scope(self, app, report_data):
+        """Test métricas sin filtro de visibilidad"""
+        admin = User.query.filter_by(email="admin@test.com").first()
+        today = date.today()
+        summary = expense_summary(rollup_scope_filter(admin), year=today.year, month=today.month)
+
+        assert summary['total_count'] == 3
+        assert float(summary['total_amount']) == 22000
+        assert float(summary['approved_amount']) == 10000
+        assert summary['pending_count'] == 1
+        assert summary['approved_count'] == 1
+        assert summary['rejected_count'] == 1
+        assert summary['month_count'] == 2
+        assert float(summary['month_amount']) == 17000
+
+    def test_summary_supervisor_scope(self, app, report_data):
+        """Test supervisor solo ve gastos de subordinados"""
+        supervisor = User.query.filter_by(email="supervisor@test.com").first()
+        summary = expense_summary(rollup_scope_filter(supervisor))
+
+        assert summary['total_count'] == 2
+        assert float(summary['total_amount']) == 15000
+
+    def test_totals_by_category(self, app, report_data):
+        """Test agrupación por categoría"""
+        supervisor = User.query.filter_by(email="supervisor@test.com").first()
+        rows = {row.category: row for row in totals_by_category(rollup_scope_filter(supervisor))}
+
+        assert rows['Transporte'].count == 1
+        assert float(rows['Alimentación'].total) == 5000
+
+    def test_monthly_totals(self, app, report_data):
+        """Test totales mensuales agrupados"""
+        totals = monthly_totals(None, date(2020, 1, 1), date(2021, 1, 1))
+        count, total = totals[(2020, 3)]
+        assert count == 1
+        assert float(total) == 5000
+        assert len(totals) == 1
+
+    def test_last_months(self):
+        """Test secuencia de meses cruzando el año"""
+        months = last_months(3, today=date(2024, 2, 10))
+        assert months == [(2023, 12), (2024, 1), (2024, 2)]
+
+
+def rollup_state():
+    """Contenido del rollup como dict comparable"""
+    return {
+        (r.user_id, r.area_id, r.client_id, r.category, r.status, r.year, r.month):
+            (r.expense_count, float(r.total_amount), float(r.min_amount), float(r.max_amount))
+        for r in ExpenseMonthlyRollup.query.all()
+    }
+
+
+class TestRollupMaintenance:
+    """Tests para el mantenimiento incremental del rollup mensual"""
+
+    def test_rollup_on_create(self, app, report_data):
+        """Test los gastos creados quedan agregados"""
+        state = rollup_state()
+        assert sum(v[0] for v in state.values()) == 3
+        assert sum(v[1] for v in state.values()) == 22000
+
+    def test_rollup_on_status_change(self, app, report_data):
+        """Test aprobar un gasto lo mueve de bucket"""
+        expense = Expense.query.filter_by(status='pending').first()
+        expense.status = 'approved'
+        db.session.commit()
+
+        statuses = {key[4] for key in rollup_state()}
+        assert 'pending' not in statuses
+
+    def test_rollup_on_expired_attribute(self, app, report_data):
+        """Test el valor anterior se recupera aunque el objeto esté expirado"""
+        expense = Expense.query.filter_by(status='approved').first()
+        db.session.commit()  # expira todos los atributos
+        expense.amount = 3000
+        db.session.commit()
+
+        assert_rollup_matches_rebuild()
+
+    def test_rollup_on_amount_change_and_delete(self, app, report_data):
+        """Test editar montos y eliminar gastos ajusta totales y extremos"""
+        user = User.query.filter_by(email="user@test.com").first()
+        client_obj = Company.query.first()
+        extra = create_expense(user, client_obj, 20000, status='approved')
+        db.session.commit()
+
+        extra.amount = 1000
+        db.session.commit()
+        assert_rollup_matches_rebuild()
+
+        db.session.delete(extra)
+        db.session.commit()
+        assert_rollup_matches_rebuild()
+
+    def test_rollup_on_area_change(self, app, report_data):
+        """Test cambiar el área de un usuario mueve sus buckets sin duplicar montos"""
+        from models.company import Area
+        user = User.query.filter_by(email="user@test.com").first()
+        new_area = Area(name="Ventas")
+        db.session.add(new_area)
+        db.session.commit()
+
+        user.area_id = new_area.id
+        db.session.commit()
+        assert {key[1] for key in rollup_state() if key[0] == user.id} == {new_area.id}
+
+        # Un cambio de estado posterior queda en el área nueva
+        expense = Expense.query.filter_by(user_id=user.id, status='pending').first()
+        expense.status = 'approved'
+        db.session.commit()
+        state = rollup_state()
+        assert sum(v[0] for v in state.values()) == 3
+        assert sum(v[1] for v in state.values()) == 22000
+        assert_rollup_matches_rebuild()
+
+    def test_rollup_area_change_with_expense_change(self, app, report_data):
+        """Test cambio de área y de gasto en el mismo flush"""
+        from models.company import Area
+        user = User.query.filter_by(email="user@test.com").first()
+        new_area = Area(name="Ventas")
+        db.session.add(new_area)
+        db.session.commit()
+
+        user.area_id = new_area.id
+        Expense.query.filter_by(user_id=user.id, status='approved').first().amount = 4000
+        create_expense(user, Company.query.first(), 2500)
+        db.session.commit()
+        assert_rollup_matches_rebuild()
+
+    def test_rollup_bucket_without_area(self, app, report_data):
+        """Test gastos de un usuario sin área comparten un solo bucket (NULL en el índice único)"""
+        user = User.query.filter_by(email="user@test.com").first()
+        user.area_id = None
+        db.session.commit()
+        for amount in (1000, 3000):
+            create_expense(user, Company.query.first(), amount, expense_date=date(2021, 1, 5))
+            db.session.commit()
+
+        rows = ExpenseMonthlyRollup.query.filter_by(area_id=None, year=2021).all()
+        assert len(rows) == 1
+        assert (rows[0].expense_count, float(rows[0].total_amount)) == (2, 4000)
+        assert (float(rows[0].min_amount), float(rows[0].max_amount)) == (1000, 3000)
+        assert_rollup_matches_rebuild()
+
+    def test_rebuild_command(self, app, runner, report_data):
+        """Test comando CLI de reconstrucción"""
+        before = rollup_state()
+        ExpenseMonthlyRollup.query.delete()
+        db.session.commit()
+
+        result = runner.invoke(args=['rollup', 'rebuild'])
+        assert 'Rollup reconstruido' in result.output
+        assert rollup_state() == before
+
+
+def assert_rollup_matches_rebuild():
+    """El rollup incremental debe ser idéntico a una reconstrucción completa"""
+    incremental = rollup_state()
+    rebuild_rollups()
+    assert incremental == rollup_state()
+
+
+def area_spend_state():
+    """Contadores de presupuesto por área como dict comparable"""
+    from models.report import AreaMonthlySpend
+    return {
+        (r.area_id, r.year, r.month): (
+            r.expense_count, float(r.total_amount), r.pending_count, float(r.pending_amount),
+            r.approved_count, float(r.approved_amount)
+        )
+        for r in AreaMonthlySpend.query.all()
+    }
+
+
+def assert_area_spend_matches_rebuild():
+    """Los contadores incrementales deben coincidir con una reconstrucción"""
+    incremental = area_spend_state()
+    rebuild_rollups()
+    assert incremental == area_spend_state()
+
+
+class TestAreaBudget:
+    """Tests para los contadores de presupuesto por área"""
+
+    def test_counters_follow_transitions(self, app, report_data):
+        """Test alta, aprobación, rechazo, cambio de monto y eliminación"""
+        user = User.query.filter_by(email="user@test.com").first()
+        today = date.today()
+        key = (user.area_id, today.year, today.month)
+        # 10000 aprobado (usuario) + 7000 rechazado (admin), misma área
+        assert area_spend_state()[key] == (2, 17000, 0, 0, 1, 10000)
+
+        extra = create_expense(user, Company.query.first(), 4000)
+        db.session.commit()
+        assert area_spend_state()[key] == (3, 21000, 1, 4000, 1, 10000)
+
+        extra.status = 'approved'
+        db.session.commit()
+        assert area_spend_state()[key] == (3, 21000, 0, 0, 2, 14000)
+
+        extra.amount = 2500
+        extra.status = 'reimbursed'
+        db.session.commit()
+        assert area_spend_state()[key] == (3, 19500, 0, 0, 2, 12500)
+        assert_area_spend_matches_rebuild()
+
+        db.session.delete(extra)
+        db.session.commit()
+        assert_area_spend_matches_rebuild()
+
+    def test_counters_follow_area_change(self, app, report_data):
+        """Test el gasto de un usuario pasa a su nueva área y los cambios siguientes quedan ahí"""
+        from models.company import Area
+        from services.budget_service import budget_status
+        user = User.query.filter_by(email="user@test.com").first()
+        old_area = user.area_id
+        today = date.today()
+        for amount in (100, 7):
+            create_expense(user, Company.query.first(), amount)
+        new_area = Area(name="Ventas", budget_monthly=1000)
+        db.session.add(new_area)
+        db.session.commit()
+
+        user.area_id = new_area.id
+        db.session.commit()
+        expense = Expense.query.filter_by(user_id=user.id, status='pending', amount=100).one()
+        expense.status = 'approved'
+        db.session.commit()
+
+        status = {row['area_id']: row for row in budget_status()}
+        assert (status[old_area]['pending_count'], status[old_area]['approved_amount']) == (0, 0)
+        assert status[old_area]['expense_count'] == 1  # el rechazado del admin
+        assert (status[new_area.id]['pending_count'], status[new_area.id]['pending_amount']) == (1, 7)
+        assert (status[new_area.id]['approved_count'], status[new_area.id]['approved_amount']) == (2, 10100)
+        assert area_spend_state()[(new_area.id, 2020, 3)][:2] == (1, 5000)
+        assert_area_spend_matches_rebuild()
+
+    def test_status_change_without_counter_row(self, app, report_data):
+        """Test un cambio de estado sobre un período sin fila la crea (en vez de perder el delta)"""
+        from models.report import AreaMonthlySpend
+        user = User.query.filter_by(email="user@test.com").first()
+        AreaMonthlySpend.query.filter_by(year=2020).delete()
+        db.session.commit()
+
+        expense = Expense.query.filter_by(user_id=user.id, status='pending').one()
+        expense.status = 'approved'
+        db.session.commit()
+        assert area_spend_state()[(user.area_id, 2020, 3)] == (0, 0, -1, -5000, 1, 5000)
+
+    def test_bulk_import_updates_counters(self, client, app, report_data):
+        """Test la carga masiva (INSERT Core) también actualiza los contadores"""
+        user = User.query.filter_by(email="user@test.com").first()
+        today = date.today()
+        row = {'amount': 1500, 'category': 'Transporte', 'reason': 'Tarjeta',
+               'client_id': Company.query.first().id, 'receipt_image': 'feed.jpg'}
+        with client:
+            login(client, 'user@test.com', 'user123')
+            response = client.post('/api/v1/expenses/bulk', data=json.dumps([row, row]),
+                                   content_type='application/json')
+            assert response.status_code == 201
+        assert area_spend_state()[(user.area_id, today.year, today.month)][2:4] == (2, 3000)
+        assert_area_spend_matches_rebuild()
+
+    def test_budget_status(self, app, report_data, count_queries):
+        """Test estado por área en consultas constantes"""
+        from services.budget_service import budget_status
+        with count_queries() as queries:
+            rows = budget_status()
+        assert len(queries) == 2
+        assert len(rows) == 1
+        area = rows[0]
+        assert area['user_count'] == 3
+        # Comprometido = pendientes + aprobados (el rechazado no consume presupuesto)
+        assert area['committed_amount'] == 10000
+        assert area['remaining'] == 990000
+        assert area['usage_pct'] == 1.0
+        assert area['status'] == 'ok'
+
+        app.config['BUDGET_WARNING_THRESHOLD'] = 1
+        assert budget_status()[0]['status'] == 'warning'
+        assert budget_status(2020, 3)[0]['pending_amount'] == 5000
+
+    def test_budget_api(self, client, app, report_data):
+        """Test endpoint de presupuesto"""
+        with client:
+            login(client, 'admin@test.com', 'admin123')
+            response = client.get('/api/v1/areas/budget?year=2020&month=3')
+            data = json.loads(response.data)['data']
+            assert data[0]['pending_count'] == 1
+            assert data[0]['committed_amount'] == 5000
+            assert client.get('/api/v1/areas/budget?month=13').status_code == 400
+
+    def test_budget_api_admin_only(self, client, app, report_data):
+        """Test solo admin consulta el presupuesto"""
+        with client:
+            login(client, 'supervisor@test.com', 'super123')
+            assert client.get('/api/v1/areas/budget').status_code == 403
+
+    def test_by_area_report(self, client, app, report_data):
+        """Test reporte por área desde los contadores"""
+        with client:
+            login(client, 'admin@test.com', 'admin123')
+            response = client.get('/reports/by-area')
+            assert response.status_code == 200
+            assert b'17,000' in response.data
+            assert b'10,000' in response.data
+
+
+class TestReportRoutes:
+    """Tests para las vistas de reportes"""
+
+    def test_dashboard_as_admin(self, client, app, report_data):
+        """Test dashboard como admin"""
+        with client:
+            login(client, 'admin@test.com', 'admin123')
+            response = client.get('/reports/dashboard')
+            assert response.status_code == 200
+
+    def test_dashboard_as_supervisor(self, client, app, report_data):
+        """Test dashboard como supervisor"""
+        with client:
+            login(client, 'supervisor@test.com', 'super123')
+            response = client.get('/reports/dashboard')
+            assert response.status_code == 200
+
+    def test_chart_data_monthly(self, client, app, report_data):
+        """Test datos de gráfico mensual"""
+        with client:
+            login(client, 'admin@test.com', 'admin123')
+            response = client.get('/reports/api/chart-data?type=monthly')
+            data = json.loads(response.data)
+            assert len(data) == 12
+            assert data[-1]['value'] == 17000
+
+    def test_stats_summary_values(self, client, app, report_data):
+        """Test resumen de estadísticas de la API"""
+        with client:
+            login(client, 'supervisor@test.com', 'super123')
+            response = client.get('/api/v1/stats/summary')
+            data = json.loads(response.data)['data']
+            assert data['total_expenses'] == 2
+            assert data['total_amount'] == 15000
+
+
+class TestVisibilityScope:
+    """Tests para el alcance de visibilidad compartido"""
+
+    def test_filters_by_role(self, app, report_data):
+        """Test cada rol ve los gastos que le corresponden"""
+        from services import visibility
+        users = {u.role: u for u in User.query.all()}
+
+        def visible(role, include_self=False):
+            scope = visibility.for_user(users[role])
+            return sorted(float(e.amount) for e in scope.expenses(include_self=include_self))
+
+        assert visibility.for_user(users['admin']).filter(Expense.user_id) is None
+        assert visible('admin') == [5000, 7000, 10000]
+        assert visible('supervisor') == [5000, 10000]
+        assert visible('user', include_self=True) == [5000, 10000]
+
+        # El mismo alcance sobre el rollup da los mismos totales
+        summary = expense_summary(visibility.for_user(users['supervisor']).rollups())
+        assert summary['total_count'] == 2
+
+    def test_subordinates_cached_per_request(self, app, report_data, count_queries):
+        """Test el conjunto de subordinados se consulta una vez por request"""
+        from services import visibility
+        supervisor = User.query.filter_by(email="supervisor@test.com").first()
+        user = User.query.filter_by(email="user@test.com").first()
+
+        with app.test_request_context():
+            with count_queries() as queries:
+                assert visibility.for_user(supervisor) is visibility.for_user(supervisor)
+                assert visibility.for_user(supervisor).can_view(user.id)
+                assert visibility.for_user(supervisor).can_view(user.id)
+            assert len(queries) == 1
+
+        # El caché no sobrevive al request
+        with app.test_request_context():
+            with count_queries() as queries:
+                visibility.for_user(supervisor).can_view(user.id)
+            assert len(queries) == 1
+
+    def test_pending_list_uses_scope(self, client, app, report_data):
+        """Test la lista de pendientes del supervisor usa el mismo alcance"""
+        with client:
+            login(client, 'supervisor@test.com', 'super123')
+            response = client.get('/approvals/pending')
+            assert response.status_code == 200
+            assert b'5,000' in response.data
+            assert b'7,000' not in response.data
+
+
+class TestChartDataCache:
+    """Tests para el caché de series del dashboard"""
+
+    def test_combined_endpoint(self, client, app, report_data):
+        """Test las tres series en una respuesta, iguales a las individuales"""
+        with client:
+            login(client, 'admin@test.com', 'admin123')
+            combined = client.get('/reports/api/chart-data/all').get_json()
+            assert set(combined) == {'monthly', 'category', 'status'}
+            for chart_type, series in combined.items():
+                assert client.get(f'/reports/api/chart-data?type={chart_type}').get_json() == series
+            assert {row['label']: row['value'] for row in combined['status']} == {
+                'approved': 1, 'pending': 1, 'rejected': 1
+            }
+
+    def test_warm_load_is_one_query(self, client, app, report_data, count_queries):
+        """Test con el caché caliente solo se consulta la versión"""
+        with client:
+            login(client, 'admin@test.com', 'admin123')
+            client.get('/reports/api/chart-data/all')
+            with count_queries() as queries:
+                response = client.get('/reports/api/chart-data/all')
+            assert response.status_code == 200
+            assert len(queries) == 1, str(queries)
+            assert 'table_versions' in queries.statements[0]
+
+            with count_queries() as queries:
+                response = client.get('/reports/api/chart-data/all',
+                                      headers={'If-None-Match': response.headers['ETag']})
+            assert response.status_code == 304
+            assert len(queries) == 1
+
+    def test_invalidated_by_expense_changes(self, client, app, report_data):
+        """Test crear o aprobar un gasto cambia las series"""
+        user = User.query.filter_by(email="user@test.com").first()
+        with client:
+            login(client, 'admin@test.com', 'admin123')
+            before = client.get('/reports/api/chart-data/all').get_json()
+
+            expense = create_expense(user, Company.query.first(), 3000)
+            db.session.commit()
+            after = client.get('/reports/api/chart-data/all').get_json()
+            assert after['monthly'][-1]['value'] == before['monthly'][-1]['value'] + 3000
+
+            expense.status = 'approved'
+            db.session.commit()
+            status = {row['label']: row['value'] for row in
+                      client.get('/reports/api/chart-data?type=status').get_json()}
+            assert status['approved'] == 2
+
+    def test_scoped_per_user(self, client, app, report_data):
+        """Test el supervisor no recibe la entrada del admin"""
+        from services.report_charts import ChartSeries
+        admin = User.query.filter_by(email="admin@test.com").first()
+        supervisor = User.query.filter_by(email="supervisor@test.com").first()
+        with app.test_request_context():
+            admin_series = ChartSeries(admin)
+            supervisor_series = ChartSeries(supervisor)
+            assert admin_series.key('status') != supervisor_series.key('status')
+            assert admin_series.etag != supervisor_series.etag
+            assert sum(row['value'] for row in supervisor_series.get('status')) == 2
+            assert sum(row['value'] for row in admin_series.get('status')) == 3
@@ -21,8 +21,50 @@ def update_schema():
             except Exception as e:
                 print(f"Could not add created_by column (might already exist): {e}")
             
+            # Add receipt_sha256 column (deduplicación de recibos)
+            try:
+                conn.execute(text("ALTER TABLE expenses ADD COLUMN receipt_sha256 VARCHAR(64)"))
+                conn.execute(text("CREATE INDEX IF NOT EXISTS idx_expense_receipt_sha256 ON expenses (receipt_sha256)"))
+                print("Added receipt_sha256 column.")
+            except Exception as e:
+                print(f"Could not add receipt_sha256 column (might already exist): {e}")
+
+            # Índice para paginación por cursor (created_at, id)
+            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_expense_created_id ON expenses (created_at, id)"))
+
+            # Add keywords column (sugerencia de categoría por OCR)
+            try:
+                conn.execute(text("ALTER TABLE expense_categories ADD COLUMN keywords TEXT"))
+                print("Added keywords column.")
+            except Exception as e:
+                print(f"Could not add keywords column (might already exist): {e}")
+
+            # Add variants column (versiones reducidas de recibos)
+            try:
+                conn.execute(text("ALTER TABLE receipt_blobs ADD COLUMN variants JSON"))
+                print("Added variants column.")
+            except Exception as e:
+                print(f"Could not add variants column (might already exist): {e}")
+
+            # uq_rollup_bucket pasa de restricción a índice único sobre coalesce(area_id/client_id, 0)
+            # (en SQLite la restricción anterior queda en la tabla y no interfiere)
+            if conn.dialect.name == 'postgresql':
+                conn.execute(text("ALTER TABLE expense_monthly_rollups DROP CONSTRAINT IF EXISTS uq_rollup_bucket"))
+
             conn.commit()
             print("Schema update complete.")
 
+        # Crear tablas nuevas y poblar el rollup mensual y la jerarquía
+        db.create_all()
+        from services.rollup_service import rebuild_rollups
+        print(f"Rollup mensual reconstruido: {rebuild_rollups()} bucket(s).")
+        from models.report import ExpenseMonthlyRollup
+        for index in ExpenseMonthlyRollup.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
+        from services.hierarchy_service import rebuild_hierarchy
+        print(f"Jerarquía de supervisión reconstruida: {rebuild_hierarchy()} fila(s).")
+        from services.search_index import rebuild as rebuild_search_index
+        print(f"Índice de búsqueda reconstruido: {rebuild_search_index()} gasto(s).")
+
 if __name__ == "__main__":
     update_schema()
@@ -0,0 +1,180 @@
+"""
+Caché de datos con TTL y backend intercambiable
+
+Por defecto los valores se guardan en memoria del proceso (SimpleCache). Para
+compartirlos entre procesos/servidores se configura otro backend por ruta de
+importación, p. ej.:
+
+    CACHE_BACKEND = 'utils.cache.RedisCache'
+    CACHE_OPTIONS = {'url': 'redis://localhost:6379/0'}
+
+Además del backend, cada request memoriza los valores ya leídos (en flask.g),
+así varias lecturas de la misma clave en un request no vuelven al backend.
+
+Uso:
+    value = cache.get_or_set('clients:active', load_clients, ttl=300)
+    cache.delete('clients:active')
+"""
+import pickle
+import threading
+import time
+from collections import defaultdict
+from flask import current_app, g, has_request_context
+from werkzeug.utils import import_string
+
+
+_MISSING = object()
+_G_KEY = '_cache_memo'
+
+
+class SimpleCache:
+    """Backend en memoria del proceso (thread-safe)"""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return _MISSING
+            expires, value = entry
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return _MISSING
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            if len(self._data) >= self.max_entries and key not in self._data:
+                self._prune()
+            self._data[key] = (time.monotonic() + ttl if ttl else None, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def _prune(self):
+        now = time.monotonic()
+        for key in [k for k, (expires, _) in self._data.items() if expires is not None and expires < now]:
+            del self._data[key]
+        if len(self._data) >= self.max_entries:
+            # Descartar la entrada más antigua
+            self._data.pop(next(iter(self._data)))
+
+
+class RedisCache:
+    """Backend compartido en Redis (requiere el paquete redis)"""
+
+    def __init__(self, url='redis://localhost:6379/0', prefix='rinde:'):
+        import redis  # Dependencia opcional: solo se importa si se configura este backend
+        self._client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self._client.get(self.prefix + key)
+        return _MISSING if raw is None else pickle.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        self._client.set(self.prefix + key, pickle.dumps(value), ex=int(ttl) if ttl else None)
+
+    def delete(self, key):
+        self._client.delete(self.prefix + key)
+
+    def clear(self):
+        keys = list(self._client.scan_iter(self.prefix + '*'))
+        if keys:
+            self._client.delete(*keys)
+
+
+class Cache:
+    """Extensión Flask: backend por aplicación más contadores de aciertos/fallos"""
+
+    def init_app(self, app):
+        app.config.setdefault('CACHE_BACKEND', 'utils.cache.SimpleCache')
+        app.config.setdefault('CACHE_OPTIONS', {})
+        app.config.setdefault('CACHE_DEFAULT_TTL', 300)
+
+        backend = app.config['CACHE_BACKEND']
+        if isinstance(backend, str):
+            backend = import_string(backend)
+        app.extensions['cache'] = {
+            'backend': backend(**app.config['CACHE_OPTIONS']),
+            'stats': defaultdict(lambda: {'hits': 0, 'misses': 0}),
+        }
+        app.teardown_request(_clear_memo)
+
+    @property
+    def _state(self):
+        return current_app.extensions['cache']
+
+    @property
+    def backend(self):
+        return self._state['backend']
+
+    def _memo(self):
+        return g.setdefault(_G_KEY, {}) if has_request_context() else None
+
+    def _count(self, key, outcome):
+        # Contadores por espacio de nombres (parte de la clave antes de ':')
+        self._state['stats'][key.split(':', 1)[0]][outcome] += 1
+
+    def get(self, key, default=None):
+        memo = self._memo()
+        if memo is not None and key in memo:
+            self._count(key, 'hits')
+            return memo[key]
+
+        value = self.backend.get(key)
+        if value is _MISSING:
+            self._count(key, 'misses')
+            return default
+
+        self._count(key, 'hits')
+        if memo is not None:
+            memo[key] = value
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.backend.set(key, value, current_app.config['CACHE_DEFAULT_TTL'] if ttl is None else ttl)
+        memo = self._memo()
+        if memo is not None:
+            memo[key] = value
+
+    def get_or_set(self, key, factory, ttl=None):
+        """Valor de la clave; si no está, lo calcula con factory() y lo guarda"""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = factory()
+            self.set(key, value, ttl)
+        return value
+
+    def delete(self, *keys):
+        memo = self._memo()
+        for key in keys:
+            self.backend.delete(key)
+            if memo is not None:
+                memo.pop(key, None)
+
+    def clear(self):
+        self.backend.clear()
+        if has_request_context():
+            g.pop(_G_KEY, None)
+
+    def stats(self):
+        """{espacio: {'hits', 'misses', 'hit_rate'}} de este proceso"""
+        result = {}
+        for namespace, counts in self._state['stats'].items():
+            total = counts['hits'] + counts['misses']
+            result[namespace] = dict(counts, hit_rate=round(counts['hits'] / total, 3) if total else None)
+        return result
+
+
+def _clear_memo(exc):
+    g.pop(_G_KEY, None)
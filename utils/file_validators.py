@@ -1,110 +1,191 @@
 """
 Utilidades de validación de archivos para seguridad
+
+receive_upload() valida un archivo subido leyendo el stream una sola vez:
+mientras lo copia a un temporal calcula el SHA-256, controla el tamaño,
+detecta el tipo real (magic bytes) y busca patrones sospechosos. Al final
+solo lee el encabezado de la imagen para obtener formato y dimensiones.
 """
+import hashlib
 import os
+import tempfile
+from collections import namedtuple
 import magic
 from PIL import Image
 from werkzeug.utils import secure_filename
 from flask import current_app
 
+CHUNK_SIZE = 64 * 1024
+
+# Bytes iniciales usados para detectar el tipo real del archivo
+SNIFF_BYTES = 2048
+
+# Tipo MIME permitido -> (formato PIL, extensión con que se guarda)
+ALLOWED_MIME_TYPES = {
+    'image/jpeg': ('JPEG', 'jpg'),
+    'image/png': ('PNG', 'png'),
+    'image/gif': ('GIF', 'gif'),
+    'image/webp': ('WEBP', 'webp'),
+}
+
+# Patrones sospechosos (en minúsculas)
+SUSPICIOUS_PATTERNS = (
+    b'<?php',
+    b'<script',
+    b'javascript:',
+    b'data:text/html',
+    b'vbscript:',
+    b'%pdf-',  # PDF files disfrazados
+)
+
+ValidatedUpload = namedtuple('ValidatedUpload', 'path filename extension mime_type size sha256 width height')
+
+
 class FileValidationError(Exception):
     """Excepción para errores de validación de archivos"""
     pass
 
-def validate_file_upload(file, allowed_extensions=None, max_size_mb=None):
+
+def _check_filename(file, allowed_extensions):
+    if not file or file.filename == '':
+        raise FileValidationError('No se seleccionó ningún archivo')
+
+    filename = secure_filename(file.filename)
+    if not ('.' in filename and
+            filename.rsplit('.', 1)[1].lower() in allowed_extensions):
+        raise FileValidationError(
+            f'Tipo de archivo no permitido. Extensiones permitidas: {", ".join(allowed_extensions)}'
+        )
+    return filename
+
+
+def _check_mime_type(head):
+    mime_type = magic.from_buffer(head, mime=True)
+    if mime_type not in ALLOWED_MIME_TYPES:
+        raise FileValidationError(
+            f'Tipo de archivo no detectado como imagen válida. Detectado: {mime_type}'
+        )
+    return mime_type
+
+
+class _SignatureScanner:
+    """Busca SUSPICIOUS_PATTERNS por bloques (incluso si un patrón queda partido entre dos)"""
+
+    def __init__(self):
+        self.overlap = max(len(pattern) for pattern in SUSPICIOUS_PATTERNS) - 1
+        self.tail = b''
+
+    def feed(self, chunk):
+        window = self.tail + chunk.lower()
+        for pattern in SUSPICIOUS_PATTERNS:
+            if pattern in window:
+                raise FileValidationError(
+                    f"Archivo rechazado por seguridad: Patrón sospechoso detectado: {pattern.decode('utf-8', errors='ignore')}"
+                )
+        self.tail = window[-self.overlap:]
+
+
+def receive_upload(file, directory, allowed_extensions=None, max_size_mb=None):
     """
-    Validación completa de archivos subidos
-    
+    Valida un archivo subido copiándolo una sola vez a un temporal en `directory`
+    (mismo sistema de archivos que el destino, para moverlo con os.replace).
+
     Args:
         file: Objeto FileStorage de Flask
+        directory: Carpeta donde crear el temporal
         allowed_extensions: Set de extensiones permitidas (opcional)
         max_size_mb: Tamaño máximo en MB (opcional)
-    
+
     Returns:
-        dict: Información del archivo validado
-    
+        ValidatedUpload: El llamador debe mover o eliminar upload.path
+
     Raises:
-        FileValidationError: Si el archivo no es válido
+        FileValidationError: Si el archivo no es válido (el temporal ya se eliminó)
     """
-    if not file or file.filename == '':
-        raise FileValidationError('No se seleccionó ningún archivo')
-    
-    # Usar configuración por defecto si no se especifica
     if allowed_extensions is None:
         allowed_extensions = current_app.config.get('ALLOWED_EXTENSIONS', {'png', 'jpg', 'jpeg', 'gif', 'webp'})
-    
     if max_size_mb is None:
         max_size_mb = current_app.config.get('MAX_CONTENT_LENGTH', 10 * 1024 * 1024) // (1024 * 1024)
-    
-    filename = secure_filename(file.filename)
-    
-    # Validar extensión
-    if not ('.' in filename and 
-            filename.rsplit('.', 1)[1].lower() in allowed_extensions):
-        raise FileValidationError(
-            f'Tipo de archivo no permitido. Extensiones permitidas: {", ".join(allowed_extensions)}'
-        )
-    
-    # Validar tamaño
-    file.seek(0, os.SEEK_END)
-    file_size = file.tell()
-    file.seek(0)
-    
     max_size_bytes = max_size_mb * 1024 * 1024
-    if file_size > max_size_bytes:
-        raise FileValidationError(
-            f'Archivo demasiado grande. Tamaño máximo: {max_size_mb}MB'
-        )
-    
-    # Validar contenido real del archivo (magic bytes)
+
+    # Nombre y extensión se validan antes de leer el contenido
+    filename = _check_filename(file, allowed_extensions)
+
+    digest = hashlib.sha256()
+    scanner = _SignatureScanner()
+    head = b''
+    mime_type = None
+    size = 0
+
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
     try:
-        # Leer primeros bytes para determinar tipo real
-        file_content = file.read(1024)
-        file.seek(0)
-        
-        # Usar python-magic para detectar tipo real
-        mime_type = magic.from_buffer(file_content, mime=True)
-        
-        # Mapear MIME types permitidos
-        allowed_mime_types = {
-            'image/jpeg',
-            'image/png', 
-            'image/gif',
-            'image/webp'
-        }
-        
-        if mime_type not in allowed_mime_types:
-            raise FileValidationError(
-                f'Tipo de archivo no detectado como imagen válida. Detectado: {mime_type}'
-            )
-        
-        # Validar que sea realmente una imagen usando PIL
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = file.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size_bytes:
+                    raise FileValidationError(f'Archivo demasiado grande. Tamaño máximo: {max_size_mb}MB')
+
+                if mime_type is None:
+                    head += chunk[:SNIFF_BYTES - len(head)]
+                    if len(head) >= SNIFF_BYTES:
+                        # Rechazar temprano: no se sigue leyendo un archivo que no es imagen
+                        mime_type = _check_mime_type(head)
+
+                scanner.feed(chunk)
+                digest.update(chunk)
+                out.write(chunk)
+
+        if mime_type is None:
+            mime_type = _check_mime_type(head)
+
+        # Solo el encabezado: formato y dimensiones sin decodificar la imagen
+        expected_format, extension = ALLOWED_MIME_TYPES[mime_type]
         try:
-            img = Image.open(file)
-            img.verify()  # Verificar que es una imagen válida
-            file.seek(0)
-            
-            # Obtener dimensiones
-            img = Image.open(file)
-            width, height = img.size
-            file.seek(0)
-            
+            with Image.open(temp_path) as img:
+                image_format = img.format
+                width, height = img.size
         except Exception as e:
             raise FileValidationError(f'El archivo no es una imagen válida: {str(e)}')
-        
-        return {
-            'filename': filename,
-            'mime_type': mime_type,
-            'size': file_size,
-            'width': width,
-            'height': height,
-            'is_valid': True
-        }
-        
-    except Exception as e:
-        if isinstance(e, FileValidationError):
-            raise
-        raise FileValidationError(f'Error validando archivo: {str(e)}')
+        if image_format != expected_format:
+            raise FileValidationError(f'El archivo no es una imagen válida: formato {image_format}')
+
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+    return ValidatedUpload(temp_path, filename, extension, mime_type, size, digest.hexdigest(), width, height)
+
+
+def validate_file_upload(file, allowed_extensions=None, max_size_mb=None):
+    """
+    Validación completa de archivos subidos (sin guardarlos; ver receive_upload)
+    
+    Args:
+        file: Objeto FileStorage de Flask
+        allowed_extensions: Set de extensiones permitidas (opcional)
+        max_size_mb: Tamaño máximo en MB (opcional)
+    
+    Returns:
+        dict: Información del archivo validado
+    
+    Raises:
+        FileValidationError: Si el archivo no es válido
+    """
+    upload = receive_upload(file, tempfile.gettempdir(), allowed_extensions, max_size_mb)
+    os.remove(upload.path)
+    file.stream.seek(0)
+
+    return {
+        'filename': upload.filename,
+        'mime_type': upload.mime_type,
+        'size': upload.size,
+        'width': upload.width,
+        'height': upload.height,
+        'is_valid': True
+    }
 
 def generate_unique_filename(original_filename, user_id=None):
     """
@@ -152,17 +233,7 @@ def scan_file_for_malware(file_path):
         with open(file_path, 'rb') as f:
             content = f.read(1024)  # Leer primeros KB
             
-            # Patrones sospechosos básicos
-            suspicious_patterns = [
-                b'<?php',
-                b'<script',
-                b'javascript:',
-                b'data:text/html',
-                b'vbscript:',
-                b'%PDF-',  # PDF files disfrazados
-            ]
-            
-            for pattern in suspicious_patterns:
+            for pattern in SUSPICIOUS_PATTERNS:
                 if pattern in content.lower():
                     return False, f"Patrón sospechoso detectado: {pattern.decode('utf-8', errors='ignore')}"
         
@@ -0,0 +1,112 @@
+"""
+Paginación por cursor (keyset) para listados de gastos
+
+En lugar de COUNT(*) + OFFSET, cada página continúa desde la última fila
+vista usando (created_at, id), lo que permite usar el índice
+idx_expense_created_id y mantiene el costo constante en páginas profundas.
+El cursor es opaco para el cliente (base64 de la última clave).
+"""
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_
+from utils.exceptions import ValidationError
+
+
+MAX_PER_PAGE = 100
+
+
+def encode_cursor(created_at, row_id):
+    """Cursor opaco para continuar después de (created_at, id)"""
+    payload = json.dumps([created_at.isoformat() if created_at else None, row_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decodifica un cursor generado por encode_cursor.
+
+    Raises:
+        ValidationError: Si el cursor no es válido
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return (datetime.fromisoformat(created_at) if created_at else None), int(row_id)
+    except (ValueError, TypeError):
+        raise ValidationError('Cursor de paginación inválido', field='cursor')
+
+
+def cursor_requested(args):
+    """La paginación por cursor es opcional: se activa al enviar el parámetro cursor"""
+    return 'cursor' in args
+
+
+def count_requested(args):
+    """count=false omite el total (evita el COUNT(*) en cada página)"""
+    return args.get('count', 'true').lower() not in ['false', '0', 'no']
+
+
+class KeysetPage:
+    """Página de resultados obtenida con keyset_paginate"""
+
+    is_keyset = True
+
+    def __init__(self, items, per_page, next_cursor, total=None, cursor=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.total = total
+        self.cursor = cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def is_first(self):
+        return not self.cursor
+
+    def to_dict(self):
+        data = {
+            'next_cursor': self.next_cursor,
+            'has_next': self.has_next,
+            'per_page': self.per_page,
+        }
+        if self.total is not None:
+            data['total'] = self.total
+        return data
+
+
+def keyset_paginate(query, model, cursor=None, per_page=20, with_count=True):
+    """
+    Pagina una consulta ordenada por (created_at, id) descendente.
+
+    Args:
+        query: Consulta ya filtrada (sin order_by)
+        model: Modelo con columnas created_at e id
+        cursor: Cursor de la página anterior ('' o None para la primera)
+        per_page: Resultados por página (máximo MAX_PER_PAGE)
+        with_count: Calcular el total de resultados
+
+    Returns:
+        KeysetPage
+    """
+    per_page = max(1, min(per_page or 20, MAX_PER_PAGE))
+    total = query.order_by(None).count() if with_count else None
+
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            model.created_at < created_at,
+            and_(model.created_at == created_at, model.id < row_id)
+        ))
+
+    rows = query.order_by(model.created_at.desc(), model.id.desc()).limit(per_page + 1).all()
+    items = rows[:per_page]
+    next_cursor = None
+    if len(rows) > per_page:
+        last = items[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+
+    return KeysetPage(items, per_page, next_cursor, total=total, cursor=cursor)
@@ -0,0 +1,397 @@
+"""
+Almacenamiento de recibos con backend intercambiable
+
+Los recibos (y sus versiones reducidas) se guardan bajo un nombre relativo
+(p. ej. 'ab/cd/<sha256>.jpg'). El backend se configura por ruta de importación:
+
+    STORAGE_BACKEND = 'utils.storage.LocalStorage'    # disco local (UPLOAD_FOLDER)
+    STORAGE_BACKEND = 'utils.storage.S3Storage'       # S3 o compatible (MinIO)
+    STORAGE_OPTIONS = {'bucket': 'recibos', 'endpoint_url': 'http://minio:9000'}
+
+Con S3Storage todos los nodos de la aplicación y los workers OCR ven los
+mismos archivos. Con endpoint_url='file:///ruta' S3Storage usa
+LocalObjectClient, un objeto-store local con la misma API (subconjunto de
+boto3), útil en desarrollo y tests sin levantar MinIO.
+
+Los procesos del pool OCR no tienen contexto de aplicación: reciben
+storage.spec() (picklable) y obtienen el backend con build_backend(spec).
+
+Uso:
+    storage.save_file(name, temp_path)
+    with storage.local_copy(name) as path:
+        Image.open(path)
+    return storage.send(name, max_age=3600)
+"""
+import mimetypes
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from flask import current_app, request, send_from_directory, stream_with_context
+from werkzeug.utils import import_string, safe_join
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+class StorageNotFound(Exception):
+    """El archivo no existe en el almacenamiento"""
+    pass
+
+
+def _iter_chunks(stream, length=None):
+    """Lee un stream por bloques (hasta `length` bytes) y lo cierra al terminar"""
+    try:
+        remaining = length
+        while remaining is None or remaining > 0:
+            chunk = stream.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+    finally:
+        stream.close()
+
+
+class LocalStorage:
+    """Archivos en un directorio local (un solo nodo o disco compartido)"""
+
+    def __init__(self, upload_folder, root=None):
+        self.root = root or upload_folder
+
+    def path(self, name):
+        """Ruta absoluta de un archivo (rechaza nombres fuera de root)"""
+        path = safe_join(self.root, name)
+        if path is None:
+            raise StorageNotFound(name)
+        return path
+
+    def staging_dir(self):
+        # Mismo sistema de archivos que root: save_file mueve con os.replace
+        os.makedirs(self.root, exist_ok=True)
+        return self.root
+
+    def save_file(self, name, temp_path):
+        """Mueve un archivo local (de staging_dir) a su ubicación final"""
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+
+    def save(self, name, stream):
+        """Guarda un stream por bloques (escritura atómica)"""
+        fd, temp_path = tempfile.mkstemp(dir=self.staging_dir(), prefix='.storage-')
+        with os.fdopen(fd, 'wb') as out:
+            shutil.copyfileobj(stream, out, CHUNK_SIZE)
+        self.save_file(name, temp_path)
+
+    def copy(self, name, new_name):
+        """Copia un archivo dentro del almacenamiento (escritura atómica)"""
+        with self.open(name) as stream:
+            self.save(new_name, stream)
+
+    def move(self, name, new_name):
+        """Renombra un archivo dentro del almacenamiento"""
+        self.save_file(new_name, self.path(name))
+
+    def exists(self, name):
+        return os.path.isfile(self.path(name))
+
+    def size(self, name):
+        try:
+            return os.path.getsize(self.path(name))
+        except FileNotFoundError:
+            raise StorageNotFound(name)
+
+    def delete(self, name):
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    def open(self, name, start=0, end=None):
+        """Stream binario del archivo, opcionalmente desde `start` hasta `end` (inclusive)"""
+        try:
+            stream = open(self.path(name), 'rb')
+        except FileNotFoundError:
+            raise StorageNotFound(name)
+        stream.seek(start)
+        return stream if end is None else _LimitedStream(stream, end - start + 1)
+
+    @contextmanager
+    def local_copy(self, name):
+        """Ruta local del archivo (aquí, el archivo mismo)"""
+        path = self.path(name)
+        if not os.path.isfile(path):
+            raise StorageNotFound(name)
+        yield path
+
+    def send(self, name, max_age=None, etag=None):
+        """
+        Respuesta con el archivo; Werkzeug atiende Range y validación condicional.
+        El cuerpo va por wsgi.file_wrapper (sendfile en gunicorn), o por
+        X-Sendfile si USE_X_SENDFILE está activo.
+        """
+        return send_from_directory(self.root, name, max_age=max_age, etag=etag or True)
+
+
+class LocalObjectClient:
+    """
+    Objeto-store local con la API de boto3 que usa S3Storage
+    (cada bucket es un directorio bajo root; los objetos son archivos).
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, bucket, key):
+        path = safe_join(self.root, bucket, key)
+        if path is None:
+            raise _not_found()
+        return path
+
+    def upload_file(self, Filename, Bucket, Key):
+        with open(Filename, 'rb') as stream:
+            self.upload_fileobj(stream, Bucket, Key)
+
+    def upload_fileobj(self, Fileobj, Bucket, Key):
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.object-')
+        with os.fdopen(fd, 'wb') as out:
+            shutil.copyfileobj(Fileobj, out, CHUNK_SIZE)
+        os.replace(temp_path, path)
+
+    def copy_object(self, Bucket, Key, CopySource):
+        with open(self._path(CopySource['Bucket'], CopySource['Key']), 'rb') as stream:
+            self.upload_fileobj(stream, Bucket, Key)
+
+    def download_file(self, Bucket, Key, Filename):
+        with open(Filename, 'wb') as out:
+            shutil.copyfileobj(self.get_object(Bucket=Bucket, Key=Key)['Body'], out, CHUNK_SIZE)
+
+    def head_object(self, Bucket, Key):
+        try:
+            stat = os.stat(self._path(Bucket, Key))
+        except FileNotFoundError:
+            raise _not_found()
+        return {
+            'ContentLength': stat.st_size,
+            'ETag': f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"',
+            'LastModified': datetime.fromtimestamp(stat.st_mtime, timezone.utc),
+        }
+
+    def get_object(self, Bucket, Key, Range=None):
+        head = self.head_object(Bucket, Key)
+        stream = open(self._path(Bucket, Key), 'rb')
+        if Range:
+            start, end = Range.split('=', 1)[1].split('-')
+            last = head['ContentLength'] - 1
+            start, end = int(start), min(int(end), last) if end else last
+            stream.seek(start)
+            return dict(head, Body=_LimitedStream(stream, end - start + 1), ContentLength=end - start + 1,
+                        ContentRange=f'bytes {start}-{end}/{head["ContentLength"]}')
+        return dict(head, Body=stream)
+
+    def delete_object(self, Bucket, Key):
+        try:
+            os.remove(self._path(Bucket, Key))
+        except FileNotFoundError:
+            pass
+
+
+class _LimitedStream:
+    """Cuerpo de un GET con Range: no lee más allá del rango pedido"""
+
+    def __init__(self, stream, length):
+        self._stream = stream
+        self._remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        chunk = self._stream.read(size)
+        self._remaining -= len(chunk)
+        return chunk
+
+    def close(self):
+        self._stream.close()
+
+
+def _not_found():
+    # Misma forma que botocore.exceptions.ClientError
+    error = StorageNotFound('NoSuchKey')
+    error.response = {'Error': {'Code': 'NoSuchKey'}}
+    return error
+
+
+def _is_not_found(error):
+    code = getattr(error, 'response', {}).get('Error', {}).get('Code')
+    return code in ('404', 'NoSuchKey', 'NotFound')
+
+
+class S3Storage:
+    """
+    Archivos en un bucket S3 o compatible (requiere boto3, salvo con
+    endpoint_url='file:///ruta'). Las credenciales se toman del entorno
+    estándar de boto3 (AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY).
+    """
+
+    def __init__(self, upload_folder, bucket, prefix='', endpoint_url=None, region_name=None):
+        self.upload_folder = upload_folder
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self.region_name = region_name
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            if self.endpoint_url and self.endpoint_url.startswith('file://'):
+                self._client = LocalObjectClient(self.endpoint_url[len('file://'):])
+            else:
+                import boto3  # Dependencia opcional: solo se importa si se configura este backend
+                self._client = boto3.client('s3', endpoint_url=self.endpoint_url, region_name=self.region_name)
+        return self._client
+
+    def _key(self, name):
+        return self.prefix + name
+
+    def staging_dir(self):
+        # Los temporales de subida quedan en disco local hasta save_file
+        os.makedirs(self.upload_folder, exist_ok=True)
+        return self.upload_folder
+
+    def save_file(self, name, temp_path):
+        try:
+            self.client.upload_file(temp_path, self.bucket, self._key(name))
+        finally:
+            os.remove(temp_path)
+
+    def save(self, name, stream):
+        self.client.upload_fileobj(stream, self.bucket, self._key(name))
+
+    def copy(self, name, new_name):
+        """Copia del lado del servidor"""
+        self.client.copy_object(Bucket=self.bucket, Key=self._key(new_name),
+                                CopySource={'Bucket': self.bucket, 'Key': self._key(name)})
+
+    def move(self, name, new_name):
+        """Copia del lado del servidor y elimina el original"""
+        self.copy(name, new_name)
+        self.delete(name)
+
+    def head(self, name):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(name))
+        except Exception as e:
+            if _is_not_found(e):
+                raise StorageNotFound(name)
+            raise
+
+    def exists(self, name):
+        try:
+            self.head(name)
+        except StorageNotFound:
+            return False
+        return True
+
+    def size(self, name):
+        return self.head(name)['ContentLength']
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(name))
+
+    def open(self, name, start=0, end=None):
+        """Stream del objeto; con start/end se pide solo ese rango al servidor"""
+        options = {}
+        if start or end is not None:
+            options['Range'] = f'bytes={start}-{"" if end is None else end}'
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self._key(name), **options)['Body']
+        except Exception as e:
+            if _is_not_found(e):
+                raise StorageNotFound(name)
+            raise
+
+    @contextmanager
+    def local_copy(self, name):
+        """Descarga el objeto a un temporal local (se elimina al salir)"""
+        suffix = os.path.splitext(name)[1]
+        fd, temp_path = tempfile.mkstemp(dir=self.staging_dir(), prefix='.download-', suffix=suffix)
+        os.close(fd)
+        try:
+            try:
+                self.client.download_file(self.bucket, self._key(name), temp_path)
+            except Exception as e:
+                if _is_not_found(e):
+                    raise StorageNotFound(name)
+                raise
+            yield temp_path
+        finally:
+            os.remove(temp_path)
+
+    def send(self, name, max_age=None, etag=None):
+        """Respuesta en streaming; un Range se pide tal cual al bucket"""
+        head = self.head(name)
+        size = head['ContentLength']
+        response = current_app.response_class(mimetype=mimetypes.guess_type(name)[0] or 'application/octet-stream')
+        response.set_etag(etag or head['ETag'].strip('"'))
+        response.last_modified = head.get('LastModified')
+        response.accept_ranges = 'bytes'
+        if max_age is not None:
+            response.cache_control.max_age = max_age
+        response.make_conditional(request)
+        if response.status_code == 304:
+            return response
+
+        byte_range = request.range.range_for_length(size) if request.range else None
+        if byte_range is not None:
+            start, stop = byte_range
+            response.status_code = 206
+            response.content_range = f'bytes {start}-{stop - 1}/{size}'
+            response.content_length = stop - start
+            body = self.open(name, start, stop - 1)
+        else:
+            response.content_length = size
+            body = self.open(name)
+        response.response = stream_with_context(_iter_chunks(body, response.content_length))
+        return response
+
+
+_backends = {}
+
+
+def build_backend(spec):
+    """Backend de un spec (ruta, opciones); memorizado por proceso"""
+    key = repr(spec)
+    if key not in _backends:
+        path, options = spec
+        _backends[key] = import_string(path)(**options)
+    return _backends[key]
+
+
+class Storage:
+    """Extensión Flask: delega en el backend configurado de la aplicación actual"""
+
+    def init_app(self, app):
+        app.config.setdefault('STORAGE_BACKEND', 'utils.storage.LocalStorage')
+        app.config.setdefault('STORAGE_OPTIONS', {})
+
+    def spec(self):
+        """(ruta del backend, opciones): picklable para los procesos del pool"""
+        config = current_app.config
+        backend = config['STORAGE_BACKEND']
+        if not isinstance(backend, str):
+            backend = f'{backend.__module__}.{backend.__qualname__}'
+        return backend, dict(config['STORAGE_OPTIONS'], upload_folder=config['UPLOAD_FOLDER'])
+
+    @property
+    def backend(self):
+        # Se resuelve en cada uso: la configuración puede cambiar después de init_app (tests)
+        return build_backend(self.spec())
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
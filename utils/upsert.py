@@ -0,0 +1,23 @@
+"""
+INSERT ... ON CONFLICT DO UPDATE según el motor de base de datos
+
+SQLite (>= 3.24) y PostgreSQL tienen la misma sintaxis y SQLAlchemy expone
+la misma API en ambos dialectos (on_conflict_do_update, excluded). Un upsert
+crea o actualiza la fila en una sola sentencia atómica, sin la carrera de
+UPDATE seguido de INSERT entre escritores concurrentes.
+"""
+from sqlalchemy.dialects import postgresql, sqlite
+
+
+_DIALECTS = {
+    'sqlite': sqlite.insert,
+    'postgresql': postgresql.insert,
+}
+
+
+def insert_for(connection, table):
+    """INSERT con soporte de on_conflict_do_update para el motor de la conexión"""
+    try:
+        return _DIALECTS[connection.dialect.name](table)
+    except KeyError:
+        raise NotImplementedError(f'Upsert no soportado en {connection.dialect.name}') from None